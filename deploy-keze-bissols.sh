@@ -76,6 +76,7 @@ GAME_URL=https://keze.bissols.com
 
 # Security
 SECRET_KEY=keze-game-$(date +%s)-$(openssl rand -hex 8)
+GAME_RNG_SECRET=$(openssl rand -hex 32)
 EOF
 
 echo "✅ Environment file created for keze.bissols.com"
@@ -79,6 +79,7 @@ GAME_URL=https://$DOMAIN
 
 # Security
 SECRET_KEY=keze-game-$(date +%s)-$(openssl rand -hex 8)
+GAME_RNG_SECRET=$(openssl rand -hex 32)
 EOF
 
 echo "✅ Environment file created with MySQL configuration"
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Streaming anti-cheat analyzer for Keze Tap Game
+
+Tails game_actions by id and keeps a little state per active user:
+
+  - actions in the last ANTICHEAT_WINDOW seconds; more than
+    SUSPICIOUS_ACTION_THRESHOLD (by default, the most the per-route rate
+    limits let through) is flagged as "rate"
+  - recent gaps between tap records; a near-constant rhythm (coefficient of
+    variation below ANTICHEAT_MIN_INTERVAL_CV) is flagged as "rhythm"
+  - recent plays per game; a win count ANTICHEAT_WIN_Z standard deviations
+    above what the payout tables give is flagged as "luck"
+
+Flagged rows get verified = FALSE. With ANTICHEAT_AUTO_BAN, users whose rate
+reaches ANTICHEAT_BAN_FACTOR times the threshold are banned. Each batch's
+flags, bans and the new checkpoint are written in one transaction; on start
+the window before the checkpoint is re-read (without flagging) to rebuild
+the state. Banned users are then dropped from the shared user cache and
+leaderboard when those use Redis; workers' tap buffers stop crediting them
+on their next flush (see tap_buffer.py).
+
+Audit writers in several processes insert batches concurrently, so ids can
+commit out of the order they were allocated, and row timestamps are taken
+when a record is queued, not when it commits. The cursor therefore keeps the
+last ANTICHEAT_SETTLE_IDS ids below the newest one it has seen open: every
+poll re-reads that range and processes rows that have appeared in it since.
+Only ids further back than that are checkpointed, so after a restart the
+open range is processed again (re-flagging is harmless).
+
+    python anticheat.py            # follow new rows
+    python anticheat.py --once     # catch up and exit
+    python anticheat.py --from-id 0 --dry-run   # replay history, report only
+"""
+
+import argparse
+import math
+import statistics
+import sys
+import time
+from collections import defaultdict, deque
+from datetime import timedelta
+from config import Config
+from db import create_database
+from rate_limit import action_ceiling
+import games
+import queries
+
+CHECKPOINT = "anticheat"
+
+ROWS_QUERY = """
+SELECT id, user_id, action, amount, payout, timestamp
+FROM game_actions
+WHERE id > %s
+ORDER BY id
+LIMIT %s
+"""
+
+CHECKPOINT_QUERY = "SELECT last_id, last_timestamp FROM anticheat_checkpoints WHERE name = %s"
+
+SAVE_CHECKPOINT_QUERY = """
+INSERT INTO anticheat_checkpoints (name, last_id, last_timestamp, updated_at)
+VALUES (%s, %s, %s, NOW())
+ON DUPLICATE KEY UPDATE
+    last_id = VALUES(last_id),
+    last_timestamp = VALUES(last_timestamp),
+    updated_at = VALUES(updated_at)
+"""
+
+WARMUP_START_QUERY = "SELECT MIN(id) AS id FROM game_actions WHERE timestamp >= %s"
+
+FLAG_QUERY = "UPDATE game_actions SET verified = FALSE WHERE id IN ({})"
+
+BAN_QUERY = "UPDATE users SET banned = TRUE WHERE banned = FALSE AND telegram_id IN ({})"
+
+# Chance a play counts as a win (payout above stake); flips win on a matching call
+WIN_PROBABILITY = {
+    action: 0.5 if action == 'flip' else sum(outcome.probability for outcome in table if outcome.won)
+    for action, table in games.PAYOUT_TABLES.items()
+}
+
+class _UserState:
+    __slots__ = ('actions', 'last_tap', 'gaps', 'plays')
+
+    def __init__(self, samples):
+        self.actions = deque()  # timestamps inside the window
+        self.last_tap = None
+        self.gaps = deque(maxlen=samples)  # seconds between tap records
+        self.plays = defaultdict(lambda: deque(maxlen=samples * 4))  # game -> won flags
+
+class AntiCheatAnalyzer:
+    """Incremental per-user checks over game_actions rows in id order"""
+
+    def __init__(self, window=60.0, threshold=None, min_samples=30, min_interval_cv=0.05,
+                 win_z=4.0, ban_factor=3.0):
+        self.window = timedelta(seconds=window)
+        # A player held to the rate limits is never flagged for rate
+        self.threshold = threshold if threshold is not None else action_ceiling(window)
+        self.min_samples = min_samples
+        self.min_interval_cv = min_interval_cv
+        self.win_z = win_z
+        self.ban_factor = ban_factor
+        self._users = {}
+        self.rows_seen = 0
+        self.flagged = defaultdict(int)
+
+    def observe(self, rows):
+        """Fold a batch of rows into the state; returns ({row id: reason}, {user ids to ban})"""
+        flags = {}
+        bans = set()
+        by_user = defaultdict(list)
+        for row in rows:
+            by_user[row['user_id']].append(row)
+
+        for user_id, user_rows in by_user.items():
+            state = self._users.get(user_id)
+            if state is None:
+                state = self._users[user_id] = _UserState(self.min_samples)
+
+            for row in user_rows:
+                at = row['timestamp']
+                state.actions.append(at)
+                while state.actions and at - state.actions[0] > self.window:
+                    state.actions.popleft()
+                if len(state.actions) > self.threshold:
+                    flags[row['id']] = 'rate'
+                    if len(state.actions) >= self.threshold * self.ban_factor:
+                        bans.add(user_id)
+
+                # A late-committed row can be older than the last tap seen; it adds no gap
+                if row['action'] == 'tap' and (state.last_tap is None or at >= state.last_tap):
+                    if state.last_tap is not None:
+                        state.gaps.append((at - state.last_tap).total_seconds())
+                    state.last_tap = at
+                elif row['action'] in WIN_PROBABILITY:
+                    state.plays[row['action']].append((row['payout'] or 0) > row['amount'])
+
+            # Distribution checks once per user per batch, over the rows just seen
+            reason = self._rhythm(state) or self._luck(state)
+            if reason:
+                for row in user_rows:
+                    flags.setdefault(row['id'], reason)
+
+        self.rows_seen += len(rows)
+        for reason in flags.values():
+            self.flagged[reason] += 1
+        return flags, bans
+
+    def _rhythm(self, state):
+        if len(state.gaps) < self.min_samples:
+            return None
+        mean = statistics.fmean(state.gaps)
+        if mean <= 0:
+            return None
+        return 'rhythm' if statistics.pstdev(state.gaps) / mean < self.min_interval_cv else None
+
+    def _luck(self, state):
+        for action, plays in state.plays.items():
+            n = len(plays)
+            if n < self.min_samples:
+                continue
+            p = WIN_PROBABILITY[action]
+            z = (sum(plays) - n * p) / math.sqrt(n * p * (1 - p))
+            if z > self.win_z:
+                return 'luck'
+        return None
+
+    def forget_idle(self, now):
+        """Drop users with nothing left in the window"""
+        for user_id in [user_id for user_id, state in self._users.items()
+                        if not state.actions or now - state.actions[-1] > self.window]:
+            del self._users[user_id]
+
+    @property
+    def active_users(self):
+        return len(self._users)
+
+def load_checkpoint(database):
+    row = database.fetch_one(CHECKPOINT_QUERY, (CHECKPOINT,))
+    return (row['last_id'], row['last_timestamp']) if row else (0, None)
+
+def warm_up(database, analyzer, last_id, last_timestamp, batch_size):
+    """Rebuild the window from rows just before the checkpoint without flagging them"""
+    if last_timestamp is None:
+        return
+    row = database.fetch_one(WARMUP_START_QUERY, (last_timestamp - analyzer.window,))
+    if not row or row['id'] is None:
+        return
+    cursor_id = row['id'] - 1
+    while cursor_id < last_id:
+        rows = [r for r in database.fetch_all(ROWS_QUERY, (cursor_id, batch_size)) if r['id'] <= last_id]
+        if not rows:
+            break
+        analyzer.observe(rows)
+        cursor_id = rows[-1]['id']
+    analyzer.flagged.clear()
+    analyzer.rows_seen = 0
+
+class ActionCursor:
+    """Position in game_actions: every id up to last_id is done, plus the `seen` ids above it"""
+
+    def __init__(self, last_id, settle_ids):
+        self.last_id = last_id
+        self.settle_ids = settle_ids
+        self.seen = set()
+        self.last_timestamp = None
+
+    def unseen(self, rows):
+        return [row for row in rows if row['id'] not in self.seen]
+
+    def advance(self, rows):
+        """Record processed rows and move last_id up to settle_ids below the newest"""
+        for row in rows:
+            self.seen.add(row['id'])
+            if self.last_timestamp is None or row['timestamp'] > self.last_timestamp:
+                self.last_timestamp = row['timestamp']
+        if self.seen:
+            self.last_id = max(self.last_id, max(self.seen) - self.settle_ids)
+            self.seen = {action_id for action_id in self.seen if action_id > self.last_id}
+
+def propagate_bans(bans, user_cache, leaderboard):
+    """Drop newly banned users from the shared cache and leaderboard"""
+    if user_cache:
+        user_cache.invalidate(*bans)
+    if leaderboard:
+        for telegram_id in bans:
+            leaderboard.remove(telegram_id)
+
+def process_batch(database, analyzer, cursor, batch_size, auto_ban, dry_run, user_cache=None, leaderboard=None):
+    """Analyze the rows after the cursor not yet seen and persist flags, bans and the checkpoint
+
+    Returns (rows read, rows processed).
+    """
+    scanned = database.fetch_all(ROWS_QUERY, (cursor.last_id, batch_size))
+    rows = cursor.unseen(scanned)
+    if not rows:
+        return len(scanned), 0
+
+    flags, bans = analyzer.observe(rows)
+    if not auto_ban:
+        bans = set()
+    cursor.advance(rows)
+
+    if not dry_run:
+        with database.transaction() as transaction:
+            if flags:
+                ids = list(flags)
+                transaction.execute(FLAG_QUERY.format(", ".join(["%s"] * len(ids))), ids)
+            if bans:
+                users = list(bans)
+                transaction.execute(BAN_QUERY.format(", ".join(["%s"] * len(users))), users)
+            transaction.execute(SAVE_CHECKPOINT_QUERY, (CHECKPOINT, cursor.last_id, cursor.last_timestamp))
+        if bans:
+            propagate_bans(bans, user_cache, leaderboard)
+
+    if flags:
+        print(f"🚩 Flagged {len(flags)} actions by {len({row['user_id'] for row in rows if row['id'] in flags})} users")
+    if bans:
+        print(f"⛔ Banned users: {', '.join(str(user) for user in sorted(bans))}")
+    analyzer.forget_idle(cursor.last_timestamp)
+    return len(scanned), len(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Tail game_actions and flag suspicious activity")
+    parser.add_argument("--once", action="store_true", help="Stop once caught up")
+    parser.add_argument("--from-id", type=int, help="Replay from this game_actions id instead of the checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="Report only; no flags, bans or checkpoint")
+    args = parser.parse_args()
+
+    database = create_database("keze_anticheat", 2)
+    if not database:
+        sys.exit(1)
+
+    analyzer = AntiCheatAnalyzer(
+        window=Config.ANTICHEAT_WINDOW,
+        threshold=Config.SUSPICIOUS_ACTION_THRESHOLD,
+        min_samples=Config.ANTICHEAT_MIN_SAMPLES,
+        min_interval_cv=Config.ANTICHEAT_MIN_INTERVAL_CV,
+        win_z=Config.ANTICHEAT_WIN_Z,
+        ban_factor=Config.ANTICHEAT_BAN_FACTOR
+    )
+
+    if args.from_id is not None:
+        last_id = args.from_id
+    else:
+        last_id, last_timestamp = load_checkpoint(database)
+        warm_up(database, analyzer, last_id, last_timestamp, Config.ANTICHEAT_BATCH_SIZE)
+    print(f"🔎 Anti-cheat analyzer starting after game_actions id {last_id}")
+
+    # Each read re-covers the open range, so it must leave room for new rows
+    cursor = ActionCursor(last_id, min(Config.ANTICHEAT_SETTLE_IDS, Config.ANTICHEAT_BATCH_SIZE // 2))
+
+    # Memory caches and leaderboards live inside each worker; only shared ones can be reached from here
+    user_cache = leaderboard = None
+    if Config.ANTICHEAT_AUTO_BAN and not args.dry_run:
+        if Config.USER_CACHE_BACKEND == 'redis':
+            from user_cache import create_user_cache
+            user_cache = create_user_cache('redis', url=Config.USER_CACHE_URL, projections=queries.USER_QUERIES)
+        if Config.LEADERBOARD_ENABLED and Config.LEADERBOARD_BACKEND == 'redis':
+            from leaderboard import RedisLeaderboard
+            leaderboard = RedisLeaderboard(
+                fetch=lambda query, params: database.fetch_all(query, params), url=Config.LEADERBOARD_URL
+            )
+
+    started = time.monotonic()
+    try:
+        while True:
+            scanned, _ = process_batch(
+                database, analyzer, cursor, Config.ANTICHEAT_BATCH_SIZE, Config.ANTICHEAT_AUTO_BAN,
+                args.dry_run, user_cache, leaderboard
+            )
+            if scanned < Config.ANTICHEAT_BATCH_SIZE:
+                if args.once:
+                    break
+                time.sleep(Config.ANTICHEAT_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Analyzed {analyzer.rows_seen} actions ({analyzer.rows_seen / max(elapsed, 1e-9):.0f}/s), "
+          f"flagged {dict(analyzer.flagged)}, last id {cursor.last_id}")
+
+if __name__ == '__main__':
+    main()
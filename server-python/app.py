@@ -1,4 +1,5 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -7,51 +8,85 @@ from mysql.connector import Error
 from datetime import datetime, timedelta
 import os
 import time
-import random
 import math
-import json
 from dotenv import load_dotenv
 import logging
 import threading
+from config import Config
+from audit_log import audit_row
+from db import create_database
+from rate_limit import ACTION_LIMIT, ACTION_PERIOD, create_tap_gate
+from user_state import UserState
+import energy
+import games
+import queries
+import retention
+import serializer
+import tap_journal
 
 # Load environment variables
 load_dotenv()
 
+# Refuse to serve games with a missing or published outcome key
+games.require_secret()
+
+class FastJSONProvider(JSONProvider):
+    """Route jsonify and request.get_json through serializer (orjson when installed)"""
+
+    def dumps(self, obj, **kwargs):
+        return serializer.dumps_str(obj)
+
+    def loads(self, s, **kwargs):
+        return serializer.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(serializer.dumps(obj), mimetype="application/json")
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app, origins=[os.getenv('FRONTEND_URL', 'http://localhost:3000')])
 
-# Initialize rate limiter
+def rate_limit_key():
+    """Limit per player where the request names one, per client address otherwise"""
+    telegram_id = (request.view_args or {}).get('telegram_id')
+    if telegram_id is None:
+        data = request.get_json(silent=True)
+        telegram_id = data.get('telegramId') if isinstance(data, dict) else None
+    return f"user:{telegram_id}" if telegram_id else get_remote_address()
+
+# Initialize rate limiter (shared between workers when the storage URL is redis://)
 limiter = Limiter(
     app=app,
-    key_func=get_remote_address,
-    default_limits=["100 per 15 minutes"]
+    key_func=rate_limit_key,
+    default_limits=["100 per 15 minutes"],
+    storage_uri=Config.RATELIMIT_STORAGE_URL
 )
 
-# MySQL connection configuration
-db_config = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'database': os.getenv('DB_NAME', 'keze_tap_game'),
-    'user': os.getenv('DB_USER', 'root'),
-    'password': os.getenv('DB_PASSWORD', ''),
-    'port': int(os.getenv('DB_PORT', 3306)),
-    'autocommit': True,
-    'charset': 'utf8mb4'
-}
+# Per-player "tapping too fast" gate, in the same store
+try:
+    tap_gate = create_tap_gate(Config.RATELIMIT_STORAGE_URL, Config.MIN_TAP_INTERVAL, Config.TAP_GATE_BURST)
+except ValueError as e:
+    print(f"❌ {e}, using in-process tap gate")
+    tap_gate = create_tap_gate('memory://', Config.MIN_TAP_INTERVAL, Config.TAP_GATE_BURST)
 
 # Database connection pool
+database = create_database("keze_pool", Config.DB_POOL_SIZE)
+
+# User cache
+user_cache = None
 try:
-    from mysql.connector import pooling
-    connection_pool = pooling.MySQLConnectionPool(
-        pool_name="keze_pool",
-        pool_size=10,
-        pool_reset_session=True,
-        **db_config
+    from user_cache import create_user_cache
+    user_cache = create_user_cache(
+        Config.USER_CACHE_BACKEND,
+        url=Config.USER_CACHE_URL,
+        ttl=Config.USER_CACHE_TTL,
+        max_entries=Config.USER_CACHE_MAX_ENTRIES,
+        projections=queries.USER_QUERIES
     )
-    print("✅ Connected to MySQL successfully")
-except Error as e:
-    print(f"❌ MySQL connection failed: {e}")
-    connection_pool = None
+except Exception as e:
+    print(f"❌ User cache initialization failed: {e}")
 
 # Telegram Bot Setup (Optional - can be run separately)
 telegram_bot = None
@@ -66,221 +101,294 @@ if os.getenv('TELEGRAM_BOT_TOKEN'):
         print(f"❌ Telegram bot initialization failed: {e}")
 
 # Helper Functions
-def get_db_connection():
-    """Get database connection from pool"""
-    if not connection_pool:
-        return None
-    try:
-        return connection_pool.get_connection()
-    except Error as e:
-        print(f"Error getting connection: {e}")
+def execute_query(query, params=None, fetch=False, prepared=False):
+    """Execute SQL query with error handling; prepared=True for hot statements"""
+    if not database:
         return None
+    return database.execute_query(query, params, fetch, prepared)
 
-def execute_query(query, params=None, fetch=False):
-    """Execute SQL query with error handling"""
-    if not connection_pool:
-        return None
-
-    connection = None
-    try:
-        connection = get_db_connection()
-        if not connection:
-            return None
-
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute(query, params or ())
+def db_transaction(prepared=False):
+    """Check out one pooled connection and yield a cursor inside a single transaction"""
+    if not database:
+        raise Error(msg="Database not connected")
+    return database.transaction(prepared)
 
-        if fetch:
-            result = cursor.fetchall()
-        else:
-            result = cursor.rowcount
-
-        connection.commit()
-        cursor.close()
-        return result
-
-    except Error as e:
-        print(f"Database error: {e}")
-        if connection:
-            connection.rollback()
+def load_user_row(telegram_id, projection='full'):
+    """Load one projection of a user row straight from the database"""
+    if not database:
         return None
-    finally:
-        if connection and connection.is_connected():
-            connection.close()
-
-def get_user_by_telegram_id(telegram_id):
-    """Get user from database by Telegram ID"""
-    query = "SELECT * FROM users WHERE telegram_id = %s"
-    result = execute_query(query, (telegram_id,), fetch=True)
+    result = database.execute_query(
+        queries.USER_QUERIES[projection], (telegram_id,), fetch=True, prepared=True, row_type=UserState
+    )
     return result[0] if result else None
 
-def create_user(telegram_id, username=None, first_name=None, last_name=None, referred_by=None):
-    """Create new user in database"""
-    user_data = {
-        'telegram_id': telegram_id,
-        'username': username,
-        'first_name': first_name,
-        'last_name': last_name,
-        'coins': 500 if referred_by else 0,
-        'ton_coins': 0,
-        'level': 1,
-        'experience': 0,
-        'taps_count': 0,
-        'energy': 1000,
-        'last_energy_update': datetime.now(),
-        'referral_code': str(telegram_id),
-        'referred_by': referred_by,
-        'daily_streak': 0,
-        'last_login_date': datetime.now(),
-        'total_earnings': 500 if referred_by else 0,
-        'spins_won': 0,
-        'treasures_found': 0,
-        'coins_flipped': 0,
-        'total_staked': 0,
-        'banned': False,
-        'last_action_time': datetime.now(),
-        'created_at': datetime.now(),
-        'updated_at': datetime.now()
-    }
+def get_user_by_telegram_id(telegram_id, projection='full'):
+    """Get user by Telegram ID (only the projection's columns), through the user cache when enabled"""
+    if user_cache:
+        user = user_cache.get(telegram_id, load_user_row, projection)
+    else:
+        user = load_user_row(telegram_id, projection)
+    # Taps still in the write-behind buffer are not in the row yet
+    if tap_buffer:
+        user = tap_buffer.merge(telegram_id, user)
+    return user
 
-    query = """
-    INSERT INTO users (
-        telegram_id, username, first_name, last_name, coins, ton_coins, level,
-        experience, taps_count, energy, last_energy_update, referral_code,
-        referred_by, daily_streak, last_login_date, total_earnings,
-        spins_won, treasures_found, coins_flipped, total_staked, banned,
-        last_action_time, created_at, updated_at
-    ) VALUES (
-        %(telegram_id)s, %(username)s, %(first_name)s, %(last_name)s, %(coins)s,
-        %(ton_coins)s, %(level)s, %(experience)s, %(taps_count)s, %(energy)s,
-        %(last_energy_update)s, %(referral_code)s, %(referred_by)s, %(daily_streak)s,
-        %(last_login_date)s, %(total_earnings)s, %(spins_won)s, %(treasures_found)s,
-        %(coins_flipped)s, %(total_staked)s, %(banned)s, %(last_action_time)s,
-        %(created_at)s, %(updated_at)s
-    )
-    """
+def invalidate_user(*telegram_ids):
+    """Drop cached user rows after a write"""
+    if user_cache:
+        user_cache.invalidate(*telegram_ids)
 
-    result = execute_query(query, user_data)
-    if result:
-        return get_user_by_telegram_id(telegram_id)
-    return None
+def create_user(telegram_id, username=None, first_name=None, last_name=None, referred_by=None):
+    """Create a user and credit its referrer exactly once; returns (user, rewarded)
 
-def update_user_energy(user):
-    """Update user energy based on time passed"""
-    if not user:
-        return user
+    rewarded says whether referred_by got its bonus. When the user already
+    exists nothing is written and (None, False) is returned.
+    """
+    user_data = queries.new_user_row(telegram_id, username, first_name, last_name, referred_by)
+
+    with db_transaction() as cursor:
+        cursor.execute(queries.CREATE_USER_QUERY, user_data)
+        if cursor.rowcount != 1:
+            return None, False
+        user = UserState.from_mapping(queries.created_user_row(user_data, cursor.lastrowid))
+        rewarded = False
+        if referred_by:
+            cursor.execute(queries.RECORD_REFERRAL_QUERY, (telegram_id, referred_by, user_data['created_at']))
+            rewarded = cursor.rowcount == 1
+            if rewarded:
+                cursor.execute(queries.REFERRAL_BONUS_QUERY, (user_data['created_at'], referred_by))
+
+    invalidate_user(telegram_id, referred_by)
+    return user, rewarded
 
+def log_game_action(user_id, action, amount, result, verified=True):
+    """Log game action for anti-cheat monitoring"""
+    if audit_log:
+        audit_log.log(user_id, action, amount, result, verified)
+        return
+    execute_query(queries.LOG_GAME_ACTION_QUERY, audit_row(user_id, action, amount, result, datetime.now(), verified),
+                  prepared=True)
+
+def apply_taps(telegram_id, taps):
+    """Apply a tap burst in one transaction; returns (user, level_up, error)"""
     now = datetime.now()
-    last_update = user.get('last_energy_update', now)
 
-    # Calculate time difference in minutes
-    if isinstance(last_update, str):
-        last_update = datetime.fromisoformat(last_update.replace('Z', '+00:00'))
+    with db_transaction(prepared=True) as session:
+        applied = session.execute(queries.TAP_UPDATE_QUERY, {"taps": taps, "now": now, "telegram_id": telegram_id}) == 1
+        user = session.fetch_one(queries.TAP_RESULT_QUERY, (telegram_id,), row_type=UserState)
 
-    time_diff = (now - last_update).total_seconds() / 60
-    max_energy = 1000 + (user.get('level', 1) - 1) * 100
-    energy_to_add = int(time_diff * 2)  # 2 energy per minute
+    if applied:
+        invalidate_user(telegram_id)
+        # Experience only reads 0 after a tap when that tap levelled the user up
+        level_up = user["experience"] == 0
+        level_before = user["level"] - 1 if level_up else user["level"]
+        user["coins_earned"] = taps * (math.floor(level_before / 3) + 1)
+        return user, level_up, None
 
-    new_energy = min(max_energy, user.get('energy', 0) + energy_to_add)
+    # Nothing was written: work out which guard rejected the tap
+    if not user or user.get("banned", False):
+        return None, False, ("User not found or banned", 404)
 
-    # Update in database
-    query = "UPDATE users SET energy = %s, last_energy_update = %s WHERE telegram_id = %s"
-    execute_query(query, (new_energy, now, user['telegram_id']))
+    return None, False, ("Insufficient energy", 400)
 
-    user['energy'] = new_energy
-    user['max_energy'] = max_energy
-    return user
+def apply_tap_batch(telegram_id, bursts, now):
+    """Replay a journal received at `now` under a row lock and write the result once; returns (user, accepted, level_up, error)"""
 
-def log_game_action(user_id, action, amount, result, verified=True):
-    """Log game action for anti-cheat monitoring"""
-    query = """
-    INSERT INTO game_actions (user_id, action, amount, result, timestamp, verified)
-    VALUES (%s, %s, %s, %s, %s, %s)
-    """
-    execute_query(query, (user_id, action, amount, json.dumps(result), datetime.now(), verified))
-
-def check_level_up(user):
-    """Check if user should level up and apply changes"""
-    experience_to_next = user.get('level', 1) * 1000
+    with db_transaction(prepared=True) as session:
+        user = session.fetch_one(queries.TAP_BATCH_LOCK_QUERY, (telegram_id,), row_type=UserState)
+        if not user or user.get("banned", False):
+            return None, 0, False, ("User not found or banned", 404)
 
-    if user.get('experience', 0) >= experience_to_next:
-        new_level = user.get('level', 1) + 1
-        new_max_energy = 1000 + (new_level - 1) * 100
+        try:
+            accepted, coins_earned, level_up = tap_journal.replay(user, bursts, Config.MIN_TAP_INTERVAL, now)
+        except tap_journal.JournalError as e:
+            return None, 0, False, e
+
+        session.execute(queries.TAP_BATCH_UPDATE_QUERY, {
+            "coins": user.coins,
+            "total_earnings": user.total_earnings,
+            "taps_count": user.taps_count,
+            "level": user.level,
+            "experience": user.experience,
+            "energy": user.energy,
+            "last_energy_update": user.last_energy_update,
+            "last_action_time": user.last_action_time,
+            "updated_at": now,
+            "telegram_id": telegram_id
+        })
+
+    invalidate_user(telegram_id)
+    user.coins_earned = coins_earned
+    return user, accepted, level_up, None
+
+def settle_game(telegram_id, action, stake, result):
+    """Debit the stake and credit the outcome in one guarded UPDATE; returns (user, error)"""
+    params = games.settlement(telegram_id, action, stake, result, datetime.now())
+
+    with db_transaction(prepared=True) as session:
+        settled = session.execute(queries.GAME_SETTLE_QUERY, params) == 1
+        user = session.fetch_one(queries.USER_QUERIES['game'], (telegram_id,), row_type=UserState)
+
+    if settled:
+        invalidate_user(telegram_id)
+        return user, None
+    if not user or user.get("banned", False):
+        return None, ("User not found or banned", 404)
+    return None, ("Insufficient coins", 400)
+
+# Asynchronous audit log writer
+audit_log = None
+if Config.AUDIT_LOG_ASYNC and database:
+    from audit_log import AuditLogWriter
+    audit_log = AuditLogWriter(
+        transaction=db_transaction,
+        queue_size=Config.AUDIT_LOG_QUEUE_SIZE,
+        batch_size=Config.AUDIT_LOG_BATCH_SIZE,
+        flush_interval=Config.AUDIT_LOG_FLUSH_INTERVAL,
+        full_policy=Config.AUDIT_LOG_FULL_POLICY,
+        shutdown_policy=Config.AUDIT_LOG_SHUTDOWN_POLICY
+    )
+    audit_log.start()
+
+# Write-behind tap buffer (optional)
+def forget_banned(*telegram_ids):
+    """Drop users banned elsewhere (found by a tap buffer flush) from the cache and leaderboard"""
+    invalidate_user(*telegram_ids)
+    if leaderboard:
+        for telegram_id in telegram_ids:
+            leaderboard.remove(telegram_id)
+
+tap_buffer = None
+if Config.TAP_BUFFER_ENABLED and database:
+    from tap_buffer import TapBuffer
+    tap_buffer = TapBuffer(
+        load_user=lambda telegram_id: get_user_by_telegram_id(telegram_id, 'tap'),
+        transaction=db_transaction,
+        journal_dir=Config.TAP_BUFFER_JOURNAL_DIR,
+        flush_interval=Config.TAP_BUFFER_FLUSH_INTERVAL,
+        max_pending=Config.TAP_BUFFER_MAX_PENDING,
+        min_tap_interval=Config.MIN_TAP_INTERVAL,
+        on_flush=invalidate_user,
+        on_banned=forget_banned
+    )
+    try:
+        tap_buffer.start()
+        print("✅ Tap buffer enabled")
+    except Exception as e:
+        print(f"❌ Tap buffer failed to start: {e}")
+        tap_buffer = None
 
-        query = """
-        UPDATE users SET level = %s, experience = 0, energy = %s, updated_at = %s
-        WHERE telegram_id = %s
-        """
-        execute_query(query, (new_level, new_max_energy, datetime.now(), user['telegram_id']))
-
-        return True
-    return False
-
-def get_referrals_count(telegram_id):
-    """Get count of users referred by this user"""
-    query = "SELECT COUNT(*) as count FROM users WHERE referred_by = %s"
-    result = execute_query(query, (telegram_id,), fetch=True)
-    return result[0]['count'] if result else 0
-
-def add_referral(referrer_id, new_user_id):
-    """Add referral relationship and give bonus"""
-    query = """
-    UPDATE users SET coins = coins + 1000, total_earnings = total_earnings + 1000, updated_at = %s
-    WHERE telegram_id = %s
-    """
-    execute_query(query, (datetime.now(), referrer_id))
+# Push bus for WebSocket clients of the ASGI server (optional)
+push_publisher = None
+if Config.PUSH_BUS_URL:
+    from push import PushPublisher
+    try:
+        push_publisher = PushPublisher(Config.PUSH_BUS_URL)
+    except Exception as e:
+        print(f"❌ Push bus unavailable: {e}")
+
+def publish_update(telegram_id, user):
+    """Push a user's changed balance/level/energy to open sockets"""
+    if push_publisher and user:
+        from push import changed_columns
+        push_publisher.publish(telegram_id, changed_columns(user))
+
+# Admin stats rollups
+stats_rollup = None
+if Config.STATS_ROLLUP_ENABLED and database:
+    from stats_rollup import StatsRollup
+    stats_rollup = StatsRollup(
+        execute=execute_query,
+        transaction=db_transaction,
+        flush_interval=Config.STATS_FLUSH_INTERVAL,
+        reconcile_interval=Config.STATS_RECONCILE_INTERVAL
+    )
+    try:
+        stats_rollup.start()
+    except Exception as e:
+        print(f"❌ Stats rollups failed to start: {e}")
+        stats_rollup = None
+
+def record_stats(**counters):
+    """Count activity towards the admin stats rollups"""
+    if stats_rollup:
+        stats_rollup.record(**counters)
+
+# Leaderboard window, updated on every write
+leaderboard = None
+if Config.LEADERBOARD_ENABLED and database:
+    from leaderboard import create_leaderboard
+    leaderboard = create_leaderboard(
+        Config.LEADERBOARD_BACKEND,
+        fetch=lambda query, params: execute_query(query, params, fetch=True),
+        url=Config.LEADERBOARD_URL,
+        resync_interval=Config.LEADERBOARD_RESYNC_INTERVAL,
+        size=Config.LEADERBOARD_SIZE
+    )
+    try:
+        leaderboard.start()
+    except Exception as e:
+        print(f"❌ Leaderboard failed to load: {e}")
+        leaderboard = None
+
+def record_earnings(user, telegram_id):
+    """Push a user's new total into the leaderboard after a write"""
+    if leaderboard and user:
+        leaderboard.update(telegram_id, user.get("total_earnings", 0), user.get("level", 1))
+
+def player_rank(telegram_id):
+    """A user's rank from the leaderboard window, or from MySQL when below it"""
+    rank = leaderboard.rank(telegram_id) if leaderboard else None
+    if rank:
+        return rank
+    rows = execute_query(queries.USER_RANK_QUERY, (telegram_id,), fetch=True)
+    if not rows:
+        return None
+    row = rows[0]
+    return {
+        "rank": row['ahead'] + 1,
+        "totalEarnings": row['total_earnings'],
+        "totalPlayers": row['players']
+    }
 
 # API Routes
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    db_status = "connected" if connection_pool else "disconnected"
+    db_status = "connected" if database else "disconnected"
     return jsonify({
         "status": "OK",
         "timestamp": datetime.now().isoformat(),
         "database": db_status,
-        "telegram_bot": "configured" if telegram_bot else "not configured"
+        "database_pool": database.health() if database else "disabled",
+        "telegram_bot": "configured" if telegram_bot else "not configured",
+        "tap_buffer": tap_buffer.stats() if tap_buffer else "disabled",
+        "tap_gate": tap_gate.stats(),
+        "audit_log": audit_log.stats() if audit_log else "synchronous",
+        "user_cache": user_cache.stats() if user_cache else "disabled"
     })
 
 @app.route('/api/user/<int:telegram_id>', methods=['GET'])
 def get_user(telegram_id):
     """Get user data"""
     try:
-        user = get_user_by_telegram_id(telegram_id)
+        user = get_user_by_telegram_id(telegram_id, 'profile')
 
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        # Update energy
-        user = update_user_energy(user)
-
-        response_data = {
-            "coins": user.get("coins", 0),
-            "tonCoins": user.get("ton_coins", 0),
-            "level": user.get("level", 1),
-            "experience": user.get("experience", 0),
-            "energy": user.get("energy", 1000),
-            "maxEnergy": user.get("max_energy", 1000),
-            "tapsCount": user.get("taps_count", 0),
-            "totalEarnings": user.get("total_earnings", 0),
-            "referrals": get_referrals_count(telegram_id),
-            "gameStats": {
-                "spinsWon": user.get("spins_won", 0),
-                "treasuresFound": user.get("treasures_found", 0),
-                "coinsFlipped": user.get("coins_flipped", 0),
-                "totalStaked": user.get("total_staked", 0)
-            }
-        }
+        # Energy is derived on read; nothing is written here
+        user = energy.with_current_energy(user)
 
-        return jsonify(response_data)
+        return jsonify(user.to_profile())
 
     except Exception as e:
         app.logger.error(f"Get user error: {e}")
         return jsonify({"error": "Server error"}), 500
 
 @app.route('/api/tap', methods=['POST'])
-@limiter.limit("30 per minute")
+@limiter.limit(f"{ACTION_LIMIT} per {ACTION_PERIOD} seconds")
 def tap_action():
     """Handle tap action with anti-cheat measures"""
     try:
@@ -291,77 +399,84 @@ def tap_action():
         if not telegram_id or not isinstance(taps, int) or taps < 1 or taps > 10:
             return jsonify({"error": "Invalid tap data"}), 400
 
-        user = get_user_by_telegram_id(telegram_id)
-        if not user or user.get("banned", False):
-            return jsonify({"error": "User not found or banned"}), 404
-
-        # Update energy first
-        user = update_user_energy(user)
-
-        if user["energy"] < taps:
-            return jsonify({"error": "Insufficient energy"}), 400
+        if not tap_gate.allow(telegram_id):
+            return jsonify({"error": "Tapping too fast"}), 429
 
-        # Anti-cheat: Check time between actions
-        now = datetime.now()
-        last_action = user.get("last_action_time", now)
-        if isinstance(last_action, str):
-            last_action = datetime.fromisoformat(last_action.replace('Z', '+00:00'))
+        if tap_buffer:
+            updated_user, level_up, error = tap_buffer.tap(telegram_id, taps)
+        else:
+            updated_user, level_up, error = apply_taps(telegram_id, taps)
+        if error:
+            message, status = error
+            return jsonify({"error": message}), status
 
-        time_since_last = (now - last_action).total_seconds()
+        log_game_action(telegram_id, "tap", taps, {"coinsEarned": updated_user["coins_earned"]})
+        record_earnings(updated_user, telegram_id)
+        record_stats(taps=taps, coins_earned=updated_user["coins_earned"])
+        publish_update(telegram_id, updated_user)
 
-        if time_since_last < 0.1:  # Minimum 100ms between taps
-            return jsonify({"error": "Tapping too fast"}), 429
+        return app.response_class(updated_user.to_tap_response_bytes(level_up), mimetype="application/json")
 
-        # Calculate rewards
-        coins_per_tap = math.floor(user.get("level", 1) / 3) + 1
-        coins_earned = taps * coins_per_tap
-
-        # Update user data
-        query = """
-        UPDATE users SET
-            coins = coins + %s,
-            taps_count = taps_count + %s,
-            experience = experience + %s,
-            total_earnings = total_earnings + %s,
-            energy = energy - %s,
-            last_action_time = %s,
-            updated_at = %s
-        WHERE telegram_id = %s
-        """
+    except Exception as e:
+        app.logger.error(f"Tap error: {e}")
+        return jsonify({"error": "Server error"}), 500
 
-        execute_query(query, (
-            coins_earned, taps, taps, coins_earned, taps, now, now, telegram_id
-        ))
-
-        # Log action
-        log_game_action(telegram_id, "tap", taps, {"coinsEarned": coins_earned})
-
-        # Get updated user and check level up
-        updated_user = get_user_by_telegram_id(telegram_id)
-        level_up = check_level_up(updated_user)
-
-        response = {
-            "success": True,
-            "coins": updated_user["coins"],
-            "level": updated_user["level"],
-            "experience": updated_user["experience"],
-            "energy": updated_user["energy"],
-            "tapsCount": updated_user["taps_count"],
-            "levelUp": level_up
-        }
+@app.route('/api/tap/batch', methods=['POST'])
+@limiter.limit(f"{ACTION_LIMIT} per {ACTION_PERIOD} seconds")
+def tap_batch_action():
+    """Apply a client journal of tap bursts in one write (see tap_journal.py)"""
+    try:
+        data = request.get_json()
+        telegram_id = data.get('telegramId')
+        if not telegram_id:
+            return jsonify({"error": "Invalid tap data"}), 400
 
+        received = datetime.now()
+        try:
+            bursts = tap_journal.parse(
+                data.get('journal'), data.get('ageMs', 0), received,
+                max_bursts=Config.TAP_BATCH_MAX_BURSTS,
+                max_taps=Config.MAX_TAPS_PER_REQUEST,
+                min_interval=Config.MIN_TAP_INTERVAL,
+                max_span=Config.TAP_BATCH_MAX_SPAN
+            )
+        except tap_journal.JournalError as e:
+            error = e
+        else:
+            if tap_buffer:
+                updated_user, accepted, level_up, error = tap_buffer.tap_batch(telegram_id, bursts, received)
+            else:
+                updated_user, accepted, level_up, error = apply_tap_batch(telegram_id, bursts, received)
+
+        if isinstance(error, tap_journal.JournalError):
+            if error.suspicious:
+                log_game_action(telegram_id, "tap", 0, {"coinsEarned": 0, "rejected": error.message}, verified=False)
+            return jsonify({"error": error.message}), error.status
+        if error:
+            message, status = error
+            return jsonify({"error": message}), status
+
+        coins_earned = updated_user["coins_earned"]
+        log_game_action(telegram_id, "tap", accepted, {"coinsEarned": coins_earned, "bursts": len(bursts)})
+        record_earnings(updated_user, telegram_id)
+        record_stats(taps=accepted, coins_earned=coins_earned)
+        publish_update(telegram_id, updated_user)
+
+        response = updated_user.to_tap_response(level_up)
+        response["acceptedTaps"] = accepted
+        response["coinsEarned"] = coins_earned
         return jsonify(response)
 
     except Exception as e:
-        app.logger.error(f"Tap error: {e}")
+        app.logger.error(f"Tap batch error: {e}")
         return jsonify({"error": "Server error"}), 500
 
 @app.route('/api/game/<action>', methods=['POST'])
-@limiter.limit("30 per minute")
+@limiter.limit(f"{ACTION_LIMIT} per {ACTION_PERIOD} seconds")
 def game_action(action):
     """Handle game actions (spin, treasure, flip)"""
     try:
-        if action not in ['spin', 'treasure', 'flip']:
+        if action not in games.GAMES:
             return jsonify({"error": "Invalid game action"}), 400
 
         data = request.get_json()
@@ -372,96 +487,26 @@ def game_action(action):
         if not telegram_id or not isinstance(stake, int) or stake < 100:
             return jsonify({"error": "Invalid game data"}), 400
 
-        user = get_user_by_telegram_id(telegram_id)
-        if not user or user.get("banned", False):
-            return jsonify({"error": "User not found or banned"}), 404
-
-        if user.get("coins", 0) < stake:
-            return jsonify({"error": "Insufficient coins"}), 400
-
-        # Game logic
-        result = {"coins": 0, "won": False}
-
-        if action == "spin":
-            random_val = random.random()
-            if random_val < 0.02:  # 2% TON coins
-                result = {
-                    "coins": stake * 10,
-                    "tonCoins": max(1, stake // 1000),
-                    "won": True
-                }
-                # Update TON coins
-                query = "UPDATE users SET ton_coins = ton_coins + %s WHERE telegram_id = %s"
-                execute_query(query, (result["tonCoins"], telegram_id))
-            elif random_val < 0.1:  # 8% big win
-                result = {"coins": stake * 5, "tonCoins": 0, "won": True}
-            elif random_val < 0.3:  # 20% good win
-                result = {"coins": stake * 2, "tonCoins": 0, "won": True}
-            elif random_val < 0.5:  # 20% small win
-                result = {"coins": int(stake * 1.5), "tonCoins": 0, "won": True}
-            elif random_val < 0.7:  # 20% break even
-                result = {"coins": stake, "tonCoins": 0, "won": False}
-            # 30% chance to lose (coins: 0)
-
-            if result["won"]:
-                query = "UPDATE users SET spins_won = spins_won + 1 WHERE telegram_id = %s"
-                execute_query(query, (telegram_id,))
-
-        elif action == "treasure":
-            random_val = random.random()
-            if random_val < 0.4:  # 40% find treasure
-                multiplier = 10 if random.random() < 0.1 else (5 if random.random() < 0.3 else 3)
-                result = {"coins": stake * multiplier, "won": True}
-                query = "UPDATE users SET treasures_found = treasures_found + 1 WHERE telegram_id = %s"
-                execute_query(query, (telegram_id,))
-
-        elif action == "flip":
-            flip_result = "heads" if random.random() < 0.5 else "tails"
-            won = flip_result == choice
-            result = {
-                "coins": stake * 2 if won else 0,
-                "won": won,
-                "flip": flip_result,
-                "choice": choice
-            }
-            if won:
-                query = "UPDATE users SET coins_flipped = coins_flipped + 1 WHERE telegram_id = %s"
-                execute_query(query, (telegram_id,))
-
-        # Update user coins and stats
-        coin_change = result["coins"] - stake
-        earnings_change = max(0, coin_change)
-
-        query = """
-        UPDATE users SET
-            coins = coins + %s,
-            total_staked = total_staked + %s,
-            total_earnings = total_earnings + %s,
-            updated_at = %s
-        WHERE telegram_id = %s
-        """
-        execute_query(query, (coin_change, stake, earnings_change, datetime.now(), telegram_id))
+        # The stake is checked against the row, so this user's buffered tap earnings must be in it first
+        if tap_buffer:
+            tap_buffer.flush_user(telegram_id)
+
+        # Draw the outcome first; the settlement only applies it if the balance covers the stake
+        result = games.play(action, stake, choice)
+        updated_user, error = settle_game(telegram_id, action, stake, result)
+        if error:
+            message, status = error
+            return jsonify({"error": message}), status
+        if tap_buffer:
+            tap_buffer.discard(telegram_id)
+            updated_user = tap_buffer.merge(telegram_id, updated_user)
 
-        # Log action
         log_game_action(telegram_id, action, stake, result)
+        record_earnings(updated_user, telegram_id)
+        record_stats(games=1, coins_earned=max(0, result["coins"] - stake))
+        publish_update(telegram_id, updated_user)
 
-        # Get updated user data
-        updated_user = get_user_by_telegram_id(telegram_id)
-
-        response = {
-            "success": True,
-            "result": result,
-            "coins": updated_user["coins"],
-            "tonCoins": updated_user.get("ton_coins", 0),
-            "gameStats": {
-                "spinsWon": updated_user.get("spins_won", 0),
-                "treasuresFound": updated_user.get("treasures_found", 0),
-                "coinsFlipped": updated_user.get("coins_flipped", 0),
-                "totalStaked": updated_user.get("total_staked", 0)
-            }
-        }
-
-        return jsonify(response)
+        return jsonify(updated_user.to_game_response(games.public_result(result)))
 
     except Exception as e:
         app.logger.error(f"Game action error: {e}")
@@ -481,25 +526,21 @@ def create_user_endpoint():
         if not telegram_id:
             return jsonify({"error": "Telegram ID required"}), 400
 
-        # Check if user already exists
-        existing_user = get_user_by_telegram_id(telegram_id)
-        if existing_user:
-            return jsonify({"error": "User already exists"}), 400
-
-        # Handle referral
+        # Handle referral; the bonus is credited with the insert, once
         referred_by = None
         if referral_code and referral_code != str(telegram_id):
-            referrer = get_user_by_telegram_id(int(referral_code))
+            referrer = get_user_by_telegram_id(int(referral_code), 'exists')
             if referrer:
                 referred_by = int(referral_code)
-                # Give referrer bonus
-                add_referral(referred_by, telegram_id)
 
-        # Create user
-        user = create_user(telegram_id, username, first_name, last_name, referred_by)
+        # Create user (an upsert, so an existing user is detected by the insert itself)
+        user, rewarded = create_user(telegram_id, username, first_name, last_name, referred_by)
         if not user:
-            return jsonify({"error": "Failed to create user"}), 500
+            return jsonify({"error": "User already exists"}), 400
+        record_earnings(user, telegram_id)
+        record_stats(new_users=1, coins_earned=queries.signup_coins(referred_by, rewarded))
 
+        # Raw row, datetimes included; serializer writes them as ISO 8601
         return jsonify({"success": True, "user": user}), 201
 
     except Exception as e:
@@ -508,40 +549,70 @@ def create_user_endpoint():
 
 @app.route('/api/leaderboard', methods=['GET'])
 def get_leaderboard():
-    """Get top players leaderboard"""
+    """Get top players leaderboard (paged, optionally with the caller's rank)"""
     try:
-        query = """
-        SELECT first_name, last_name, username, total_earnings, level
-        FROM users
-        WHERE banned = FALSE
-        ORDER BY total_earnings DESC
-        LIMIT 10
-        """
-        top_users = execute_query(query, fetch=True)
+        page = max(1, request.args.get('page', 1, type=int))
+        size = min(Config.LEADERBOARD_MAX_PAGE_SIZE, max(1, request.args.get('size', 10, type=int)))
+        telegram_id = request.args.get('telegramId', type=int)
+
+        if leaderboard:
+            response = {"leaderboard": leaderboard.page(page, size)}
+            if telegram_id:
+                response["me"] = player_rank(telegram_id)
+            return jsonify(response)
 
-        leaderboard = []
+        top_users = execute_query(queries.LEADERBOARD_QUERY, (size, (page - 1) * size), fetch=True)
+
+        leaderboard_entries = []
         for i, user in enumerate(top_users or []):
             name = user.get("first_name") or user.get("username") or "Anonymous"
-            leaderboard.append({
-                "rank": i + 1,
+            leaderboard_entries.append({
+                "rank": (page - 1) * size + i + 1,
                 "name": name,
                 "totalEarnings": user.get("total_earnings", 0),
                 "level": user.get("level", 1)
             })
 
-        return jsonify({"leaderboard": leaderboard})
+        return jsonify({"leaderboard": leaderboard_entries})
 
     except Exception as e:
         app.logger.error(f"Leaderboard error: {e}")
         return jsonify({"error": "Server error"}), 500
 
+@app.route('/api/leaderboard/rank/<int:telegram_id>', methods=['GET'])
+def get_leaderboard_rank(telegram_id):
+    """Get one player's rank"""
+    try:
+        if not database:
+            return jsonify({"error": "Database not connected"}), 500
+
+        rank = player_rank(telegram_id)
+        if not rank:
+            return jsonify({"error": "User not ranked"}), 404
+        return jsonify(rank)
+
+    except Exception as e:
+        app.logger.error(f"Leaderboard rank error: {e}")
+        return jsonify({"error": "Server error"}), 500
+
 @app.route('/api/admin/stats', methods=['GET'])
 def admin_stats():
     """Get admin statistics"""
     try:
-        if not connection_pool:
+        if not database:
             return jsonify({"error": "Database not connected"}), 500
 
+        # Rollup totals: one row instead of three full-table aggregates
+        totals = stats_rollup.totals() if stats_rollup else None
+        if totals:
+            return jsonify({
+                "totalUsers": totals['total_users'],
+                "activeUsers": totals['active_users'],
+                "totalCoinsEarned": totals['total_coins'],
+                "totalTaps": totals['total_taps'],
+                "reconciledAt": totals['reconciled_at'].isoformat()
+            })
+
         # Get total users
         result = execute_query("SELECT COUNT(*) as count FROM users", fetch=True)
         total_users = result[0]['count'] if result else 0
@@ -576,6 +647,36 @@ def admin_stats():
         app.logger.error(f"Admin stats error: {e}")
         return jsonify({"error": "Server error"}), 500
 
+@app.route('/api/admin/stats/series', methods=['GET'])
+def admin_stats_series():
+    """Get hourly or daily activity buckets, e.g. taps per hour over the last week"""
+    try:
+        if not stats_rollup:
+            return jsonify({"error": "Stats rollups not enabled"}), 503
+
+        granularity = request.args.get('granularity', 'hour')
+        if granularity not in ('hour', 'day'):
+            return jsonify({"error": "Invalid granularity"}), 400
+
+        until = datetime.now()
+        since = until - timedelta(days=min(366, max(1, request.args.get('days', 7, type=int))))
+        rows = stats_rollup.series(granularity, since, until)
+
+        return jsonify({
+            "granularity": granularity,
+            "series": [{
+                "bucketStart": row['bucket_start'].isoformat(),
+                "taps": row['taps'],
+                "coinsEarned": row['coins_earned'],
+                "games": row['games'],
+                "newUsers": row['new_users']
+            } for row in rows]
+        })
+
+    except Exception as e:
+        app.logger.error(f"Admin stats series error: {e}")
+        return jsonify({"error": "Server error"}), 500
+
 # Database initialization
 def init_database():
     """Initialize database tables"""
@@ -596,6 +697,7 @@ def init_database():
                 last_energy_update DATETIME DEFAULT CURRENT_TIMESTAMP,
                 referral_code VARCHAR(50) UNIQUE,
                 referred_by BIGINT,
+                referral_count INT DEFAULT 0,
                 daily_streak INT DEFAULT 0,
                 last_login_date DATETIME DEFAULT CURRENT_TIMESTAMP,
                 total_earnings BIGINT DEFAULT 0,
@@ -607,23 +709,59 @@ def init_database():
                 last_action_time DATETIME DEFAULT CURRENT_TIMESTAMP,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                INDEX idx_telegram_id (telegram_id),
+                INDEX idx_telegram_banned (telegram_id, banned),
                 INDEX idx_total_earnings (total_earnings),
-                INDEX idx_last_action (last_action_time)
+                INDEX idx_last_action (last_action_time),
+                INDEX idx_referred_by (referred_by)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         """,
-        'game_actions': """
-            CREATE TABLE IF NOT EXISTS game_actions (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id BIGINT NOT NULL,
-                action VARCHAR(50) NOT NULL,
-                amount INT NOT NULL,
-                result TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                verified BOOLEAN DEFAULT TRUE,
-                INDEX idx_user_id (user_id),
-                INDEX idx_timestamp (timestamp),
-                INDEX idx_action (action)
+        # One row per invited user; the key that makes referral bonuses idempotent
+        'referrals': """
+            CREATE TABLE IF NOT EXISTS referrals (
+                referred_id BIGINT PRIMARY KEY,
+                referrer_id BIGINT NOT NULL,
+                created_at DATETIME NOT NULL,
+                INDEX idx_referrer_id (referrer_id)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """,
+        # Partitioned by timestamp; manage.py rotate-game-actions keeps partitions current
+        'game_actions': retention.create_table_sql(
+            datetime.now(), Config.GAME_ACTIONS_PARTITION_BY, Config.GAME_ACTIONS_PARTITIONS_AHEAD
+        ),
+        'stats_totals': """
+            CREATE TABLE IF NOT EXISTS stats_totals (
+                id TINYINT PRIMARY KEY,
+                total_users BIGINT DEFAULT 0,
+                active_users BIGINT DEFAULT 0,
+                total_coins BIGINT DEFAULT 0,
+                total_taps BIGINT DEFAULT 0,
+                reconciled_at DATETIME NOT NULL
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """,
+        'stats_buckets': """
+            CREATE TABLE IF NOT EXISTS stats_buckets (
+                granularity ENUM('hour', 'day') NOT NULL,
+                bucket_start DATETIME NOT NULL,
+                taps BIGINT DEFAULT 0,
+                coins_earned BIGINT DEFAULT 0,
+                games INT DEFAULT 0,
+                new_users INT DEFAULT 0,
+                PRIMARY KEY (granularity, bucket_start)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """,
+        'tap_buffer_flushes': """
+            CREATE TABLE IF NOT EXISTS tap_buffer_flushes (
+                segment VARCHAR(255) PRIMARY KEY,
+                flushed_at DATETIME NOT NULL,
+                INDEX idx_flushed_at (flushed_at)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """,
+        'anticheat_checkpoints': """
+            CREATE TABLE IF NOT EXISTS anticheat_checkpoints (
+                name VARCHAR(50) PRIMARY KEY,
+                last_id INT NOT NULL,
+                last_timestamp DATETIME NOT NULL,
+                updated_at DATETIME NOT NULL
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
         """
     }
@@ -635,6 +773,41 @@ def init_database():
         except Exception as e:
             print(f"❌ Error creating table '{table_name}': {e}")
 
+    # Columns and indexes added after the first release, for existing databases
+    ensure_column('users', 'referral_count', "INT DEFAULT 0 AFTER referred_by")
+    ensure_index('users', 'idx_referred_by', "(referred_by)")
+    # Serves every telegram_id lookup and covers the 'exists' projection
+    ensure_index('users', 'idx_telegram_banned', "(telegram_id, banned)")
+    # Typed audit columns; older rows are moved over by manage.py migrate-audit-results
+    ensure_column('game_actions', 'payout', "BIGINT DEFAULT NULL AFTER amount")
+    ensure_column('game_actions', 'ton_coins', "INT NOT NULL DEFAULT 0 AFTER payout")
+    ensure_column('game_actions', 'outcome', "TINYINT UNSIGNED DEFAULT NULL AFTER ton_coins")
+    ensure_column('game_actions', 'choice', "ENUM('heads', 'tails') DEFAULT NULL AFTER outcome")
+    ensure_column('game_actions', 'rng_stream', "BINARY(8) DEFAULT NULL AFTER choice")
+    ensure_column('game_actions', 'rng_offset', "INT UNSIGNED DEFAULT NULL AFTER rng_stream")
+
+def ensure_column(table, column, definition):
+    """Add a column to an existing table if it is missing"""
+    result = execute_query(
+        "SELECT COUNT(*) as count FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+        (table, column), fetch=True
+    )
+    if result and result[0]['count'] == 0:
+        execute_query(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        print(f"✅ Added column '{table}.{column}'")
+
+def ensure_index(table, index, columns):
+    """Add an index to an existing table if it is missing"""
+    result = execute_query(
+        "SELECT COUNT(*) as count FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+        (table, index), fetch=True
+    )
+    if result and result[0]['count'] == 0:
+        execute_query(f"ALTER TABLE {table} ADD INDEX {index} {columns}")
+        print(f"✅ Added index '{table}.{index}'")
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -686,6 +859,6 @@ if __name__ == '__main__':
     print(f"🚀 Keze Tap Game MySQL server starting on port {available_port}")
     print(f"🔗 API URL: http://localhost:{available_port}/api")
     print(f"🤖 Telegram bot: {'configured' if telegram_bot else 'not configured'}")
-    print(f"💾 Database: {'connected' if connection_pool else 'not connected'}")
+    print(f"💾 Database: {'connected' if database else 'not connected'}")
 
     app.run(host='0.0.0.0', port=available_port, debug=debug)
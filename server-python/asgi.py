@@ -0,0 +1,689 @@
+#!/usr/bin/env python3
+"""
+ASGI entry point for Keze Tap Game
+Serves the same /api/* routes as app.py on an async MySQL pool (aiomysql),
+so a worker can keep many requests in flight while they wait on the database.
+Writes have the same side effects as in app.py: the shared user cache is
+invalidated (when USER_CACHE_BACKEND is redis; memory caches belong to the
+Flask workers), and the leaderboard, stats rollups and push bus are updated.
+The Flask limiter's per-player limits are applied as token buckets in the
+RATELIMIT_STORAGE_URL store. There is no tap buffer here, so do not route a
+user to both this server and Flask workers running TAP_BUFFER_ENABLED.
+
+Run with: uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import logging
+import math
+import sys
+import os
+from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from config import Config
+from async_db import AsyncDatabase
+from audit_log import FULL_POLICIES, audit_row
+from db import create_database
+from leaderboard import create_leaderboard
+import energy
+import games
+import queries
+import serializer
+import tap_journal
+from push import PushHub, changed_columns
+from rate_limit import create_request_limits, create_tap_gate
+from stats_rollup import SERIES_QUERY, GRANULARITIES, StatsRollup, bucket_start
+from user_cache import create_user_cache
+from user_state import UserState
+
+logger = logging.getLogger(__name__)
+
+# Refuse to serve games with a missing or published outcome key
+games.require_secret()
+
+class JSONResponse(StarletteJSONResponse):
+    """JSONResponse rendered by serializer (orjson when installed, ISO datetimes)"""
+
+    def render(self, content):
+        return serializer.dumps(content)
+
+db = AsyncDatabase()
+
+class AsyncAuditLog:
+    """Batches game_actions rows on the event loop, off the request path"""
+
+    def __init__(self, database, queue_size, batch_size, flush_interval, full_policy='sync'):
+        if full_policy not in FULL_POLICIES:
+            raise ValueError(f"full_policy must be one of {FULL_POLICIES}")
+
+        self._db = database
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._full_policy = full_policy
+        self._task = None
+        self.dropped = 0
+        self.sync_writes = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._write(batch)
+
+    async def log(self, user_id, action, amount, result, verified=True):
+        """Queue one audit record; a full queue writes it inline or drops it per full_policy"""
+        record = (user_id, action, amount, result, datetime.now(), verified)
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            if self._full_policy != 'sync':
+                self.dropped += 1
+                return
+            try:
+                await self._db.execute(queries.LOG_GAME_ACTION_QUERY, audit_row(*record))
+                self.sync_writes += 1
+            except Exception as e:
+                logger.error(f"Audit log write of 1 record failed: {e}")
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + self._flush_interval
+            while len(batch) < self._batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write(batch)
+
+    async def _write(self, batch):
+        rows = [audit_row(*record) for record in batch]
+        try:
+            await self._db.executemany(queries.LOG_GAME_ACTION_QUERY, rows)
+        except Exception as e:
+            logger.error(f"Audit log write of {len(rows)} records failed: {e}")
+
+audit_log = None
+leaderboard = None
+stats_rollup = None
+push_hub = PushHub(Config.PUSH_BUS_URL, queue_size=Config.PUSH_QUEUE_SIZE)
+tap_gate = create_tap_gate(Config.RATELIMIT_STORAGE_URL, Config.MIN_TAP_INTERVAL, Config.TAP_GATE_BURST)
+action_limit, request_limit = create_request_limits(Config.RATELIMIT_STORAGE_URL)
+
+# Only a shared cache can hold rows this server changes
+user_cache = None
+if Config.USER_CACHE_BACKEND == 'redis':
+    user_cache = create_user_cache('redis', url=Config.USER_CACHE_URL, projections=queries.USER_QUERIES)
+
+@asynccontextmanager
+async def lifespan(app):
+    global audit_log, leaderboard, stats_rollup
+    try:
+        await db.connect()
+        print("✅ Connected to MySQL successfully (async pool)")
+    except Exception as e:
+        print(f"❌ MySQL connection failed: {e}")
+
+    audit_log = AsyncAuditLog(
+        db,
+        queue_size=Config.AUDIT_LOG_QUEUE_SIZE,
+        batch_size=Config.AUDIT_LOG_BATCH_SIZE,
+        flush_interval=Config.AUDIT_LOG_FLUSH_INTERVAL,
+        full_policy=Config.AUDIT_LOG_FULL_POLICY
+    )
+    if db.connected:
+        audit_log.start()
+
+    try:
+        await push_hub.start()
+    except Exception as e:
+        print(f"❌ Push bus unavailable, pushing to local sockets only: {e}")
+
+    # The leaderboard and stats rollups work from background threads, so they share a small blocking pool
+    blocking_db = None
+    if Config.LEADERBOARD_ENABLED or Config.STATS_ROLLUP_ENABLED:
+        blocking_db = create_database("keze_asgi_blocking", 2)
+    if blocking_db and Config.LEADERBOARD_ENABLED:
+        leaderboard = create_leaderboard(
+            Config.LEADERBOARD_BACKEND,
+            fetch=lambda query, params: blocking_db.execute_query(query, params, fetch=True),
+            url=Config.LEADERBOARD_URL,
+            resync_interval=Config.LEADERBOARD_RESYNC_INTERVAL,
+            size=Config.LEADERBOARD_SIZE
+        )
+        try:
+            await asyncio.to_thread(leaderboard.start)
+        except Exception as e:
+            print(f"❌ Leaderboard failed to load: {e}")
+            leaderboard = None
+    if blocking_db and Config.STATS_ROLLUP_ENABLED:
+        stats_rollup = StatsRollup(
+            execute=blocking_db.execute_query,
+            transaction=blocking_db.transaction,
+            flush_interval=Config.STATS_FLUSH_INTERVAL,
+            reconcile_interval=Config.STATS_RECONCILE_INTERVAL
+        )
+        try:
+            await asyncio.to_thread(stats_rollup.start)
+        except Exception as e:
+            print(f"❌ Stats rollups failed to start: {e}")
+            stats_rollup = None
+
+    yield
+
+    if leaderboard:
+        leaderboard.stop()
+    if stats_rollup:
+        await asyncio.to_thread(stats_rollup.stop)
+    await push_hub.close()
+    if db.connected:
+        await audit_log.close()
+    await db.close()
+
+def error(message, status):
+    return JSONResponse({"error": message}, status_code=status)
+
+async def read_json(request):
+    try:
+        data = serializer.loads(await request.body())
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+async def get_user_by_telegram_id(telegram_id, projection='full'):
+    return UserState.from_mapping(await db.fetch_one(queries.USER_QUERIES[projection], (telegram_id,)))
+
+async def record_write(telegram_id, user, *also_changed, **counters):
+    """What every write does after committing, as in app.py: cache, leaderboard, stats and push"""
+    if user_cache:
+        await asyncio.to_thread(user_cache.invalidate, telegram_id, *also_changed)
+    if leaderboard and user:
+        # Off the event loop: the redis backend makes a round trip
+        await asyncio.to_thread(leaderboard.update, telegram_id, user.get("total_earnings", 0), user.get("level", 1))
+    if stats_rollup:
+        stats_rollup.record(**counters)
+    push_hub.publish(telegram_id, changed_columns(user))
+
+def limit_key(request, data=None):
+    """Per player where the request names one, per client address otherwise (as app.rate_limit_key)"""
+    telegram_id = request.path_params.get('telegram_id') or (data or {}).get('telegramId')
+    if telegram_id:
+        return f"user:{telegram_id}"
+    return request.client.host if request.client else "unknown"
+
+def limited(bucket):
+    """Reject requests over `bucket` with 429 before the endpoint runs"""
+    def decorate(endpoint):
+        async def wrapper(request):
+            data = await read_json(request) if request.method == 'POST' else None
+            if not await bucket.allow_async(limit_key(request, data)):
+                return error("Rate limit exceeded", 429)
+            return await endpoint(request)
+        wrapper.__name__ = endpoint.__name__
+        wrapper.__doc__ = endpoint.__doc__
+        return wrapper
+    return decorate
+
+async def player_rank(telegram_id):
+    """A user's rank from the leaderboard window, or from MySQL when below it"""
+    rank = await asyncio.to_thread(leaderboard.rank, telegram_id) if leaderboard else None
+    if rank:
+        return rank
+    row = await db.fetch_one(queries.USER_RANK_QUERY, (telegram_id,))
+    if not row:
+        return None
+    return {
+        "rank": row['ahead'] + 1,
+        "totalEarnings": row['total_earnings'],
+        "totalPlayers": row['players']
+    }
+
+# API Routes
+
+async def health_check(request):
+    """Health check endpoint"""
+    return JSONResponse({
+        "status": "OK",
+        "timestamp": datetime.now().isoformat(),
+        "database": "connected" if db.connected else "disconnected",
+        "server": "asgi",
+        "audit_log": {"queueDepth": audit_log._queue.qsize(), "dropped": audit_log.dropped,
+                      "syncWrites": audit_log.sync_writes} if audit_log else None,
+        "push": {"connections": push_hub.connections, "dropped": push_hub.dropped},
+        "tap_gate": tap_gate.stats()
+    })
+
+async def get_user(request):
+    """Get user data"""
+    try:
+        telegram_id = request.path_params['telegram_id']
+        user = await get_user_by_telegram_id(telegram_id, 'profile')
+        if not user:
+            return error("User not found", 404)
+
+        user = energy.with_current_energy(user)
+
+        return JSONResponse(user.to_profile())
+
+    except Exception as e:
+        logger.error(f"Get user error: {e}")
+        return error("Server error", 500)
+
+async def apply_taps(telegram_id, taps):
+    """Apply a tap burst (HTTP or socket), log and push it; returns (user, level_up, error)"""
+    if not isinstance(taps, int) or taps < 1 or taps > Config.MAX_TAPS_PER_REQUEST:
+        return None, False, ("Invalid tap data", 400)
+    if not await tap_gate.allow_async(telegram_id):
+        return None, False, ("Tapping too fast", 429)
+
+    now = datetime.now()
+    async with db.transaction() as cursor:
+        await cursor.execute(queries.TAP_UPDATE_QUERY, {"taps": taps, "now": now, "telegram_id": telegram_id})
+        applied = cursor.rowcount == 1
+        await cursor.execute(queries.TAP_RESULT_QUERY, (telegram_id,))
+        user = UserState.from_mapping(await cursor.fetchone())
+
+    if not applied:
+        if not user or user.get("banned", False):
+            return None, False, ("User not found or banned", 404)
+        return None, False, ("Insufficient energy", 400)
+
+    # Experience only reads 0 after a tap when that tap levelled the user up
+    level_up = user["experience"] == 0
+    level_before = user["level"] - 1 if level_up else user["level"]
+    coins_earned = taps * (math.floor(level_before / 3) + 1)
+    await audit_log.log(telegram_id, "tap", taps, {"coinsEarned": coins_earned})
+    await record_write(telegram_id, user, taps=taps, coins_earned=coins_earned)
+    return user, level_up, None
+
+async def tap_action(request):
+    """Handle tap action with anti-cheat measures"""
+    try:
+        data = await read_json(request)
+        telegram_id = data.get('telegramId') if data else None
+        if not telegram_id:
+            return error("Invalid tap data", 400)
+
+        user, level_up, failure = await apply_taps(telegram_id, data.get('taps', 1))
+        if failure:
+            return error(*failure)
+
+        return Response(user.to_tap_response_bytes(level_up), media_type="application/json")
+
+    except Exception as e:
+        logger.error(f"Tap error: {e}")
+        return error("Server error", 500)
+
+async def tap_batch_action(request):
+    """Apply a client journal of tap bursts in one write (see tap_journal.py)"""
+    try:
+        data = await read_json(request)
+        telegram_id = data.get('telegramId') if data else None
+        if not telegram_id:
+            return error("Invalid tap data", 400)
+
+        now = datetime.now()
+        try:
+            bursts = tap_journal.parse(
+                data.get('journal'), data.get('ageMs', 0), now,
+                max_bursts=Config.TAP_BATCH_MAX_BURSTS,
+                max_taps=Config.MAX_TAPS_PER_REQUEST,
+                min_interval=Config.MIN_TAP_INTERVAL,
+                max_span=Config.TAP_BATCH_MAX_SPAN
+            )
+            async with db.transaction() as cursor:
+                await cursor.execute(queries.TAP_BATCH_LOCK_QUERY, (telegram_id,))
+                user = UserState.from_mapping(await cursor.fetchone())
+                if not user or user.get("banned", False):
+                    return error("User not found or banned", 404)
+
+                accepted, coins_earned, level_up = tap_journal.replay(user, bursts, Config.MIN_TAP_INTERVAL, now)
+                await cursor.execute(queries.TAP_BATCH_UPDATE_QUERY, {
+                    "coins": user.coins,
+                    "total_earnings": user.total_earnings,
+                    "taps_count": user.taps_count,
+                    "level": user.level,
+                    "experience": user.experience,
+                    "energy": user.energy,
+                    "last_energy_update": user.last_energy_update,
+                    "last_action_time": user.last_action_time,
+                    "updated_at": now,
+                    "telegram_id": telegram_id
+                })
+        except tap_journal.JournalError as e:
+            if e.suspicious:
+                await audit_log.log(telegram_id, "tap", 0, {"coinsEarned": 0, "rejected": e.message}, verified=False)
+            return error(e.message, e.status)
+
+        await audit_log.log(telegram_id, "tap", accepted, {"coinsEarned": coins_earned, "bursts": len(bursts)})
+        await record_write(telegram_id, user, taps=accepted, coins_earned=coins_earned)
+
+        response = user.to_tap_response(level_up)
+        response["acceptedTaps"] = accepted
+        response["coinsEarned"] = coins_earned
+        return JSONResponse(response)
+
+    except Exception as e:
+        logger.error(f"Tap batch error: {e}")
+        return error("Server error", 500)
+
+async def game_action(request):
+    """Handle game actions (spin, treasure, flip)"""
+    try:
+        action = request.path_params['action']
+        if action not in games.GAMES:
+            return error("Invalid game action", 400)
+
+        data = await read_json(request)
+        telegram_id = data.get('telegramId') if data else None
+        stake = data.get('stake', 0) if data else None
+        choice = data.get('choice') if data else None
+
+        if not telegram_id or not isinstance(stake, int) or stake < 100:
+            return error("Invalid game data", 400)
+
+        # Draw the outcome first; the settlement only applies it if the balance covers the stake
+        result = games.play(action, stake, choice)
+        params = games.settlement(telegram_id, action, stake, result, datetime.now())
+
+        async with db.transaction() as cursor:
+            await cursor.execute(queries.GAME_SETTLE_QUERY, params)
+            settled = cursor.rowcount == 1
+            await cursor.execute(queries.USER_QUERIES['game'], (telegram_id,))
+            updated_user = UserState.from_mapping(await cursor.fetchone())
+
+        if not settled:
+            if not updated_user or updated_user.get("banned", False):
+                return error("User not found or banned", 404)
+            return error("Insufficient coins", 400)
+
+        await audit_log.log(telegram_id, action, stake, result)
+        await record_write(telegram_id, updated_user, games=1, coins_earned=max(0, result["coins"] - stake))
+
+        return JSONResponse(updated_user.to_game_response(games.public_result(result)))
+
+    except Exception as e:
+        logger.error(f"Game action error: {e}")
+        return error("Server error", 500)
+
+async def create_user_endpoint(request):
+    """Create new user (called by Telegram bot or frontend)"""
+    try:
+        data = await read_json(request)
+        telegram_id = data.get('telegramId') if data else None
+        if not telegram_id:
+            return error("Telegram ID required", 400)
+
+        referral_code = data.get('referralCode')
+        referred_by = None
+        if referral_code and referral_code != str(telegram_id):
+            if await get_user_by_telegram_id(int(referral_code), 'exists'):
+                referred_by = int(referral_code)
+
+        # Upsert, then record the referral; its key pays each bonus once
+        user_data = queries.new_user_row(
+            telegram_id, data.get('username'), data.get('firstName'), data.get('lastName'), referred_by
+        )
+        rewarded = False
+        async with db.transaction() as cursor:
+            await cursor.execute(queries.CREATE_USER_QUERY, user_data)
+            if cursor.rowcount != 1:
+                return error("User already exists", 400)
+            user = UserState.from_mapping(queries.created_user_row(user_data, cursor.lastrowid))
+            if referred_by:
+                await cursor.execute(
+                    queries.RECORD_REFERRAL_QUERY, (telegram_id, referred_by, user_data['created_at'])
+                )
+                rewarded = cursor.rowcount == 1
+                if rewarded:
+                    await cursor.execute(queries.REFERRAL_BONUS_QUERY, (user_data['created_at'], referred_by))
+
+        await record_write(
+            telegram_id, user, *([referred_by] if rewarded else []),
+            new_users=1, coins_earned=queries.signup_coins(referred_by, rewarded)
+        )
+
+        return JSONResponse({"success": True, "user": user}, status_code=201)
+
+    except Exception as e:
+        logger.error(f"Create user error: {e}")
+        return error("Server error", 500)
+
+async def get_leaderboard(request):
+    """Get top players leaderboard (paged, optionally with the caller's rank)"""
+    try:
+        page = max(1, int(request.query_params.get('page', 1)))
+        size = min(Config.LEADERBOARD_MAX_PAGE_SIZE, max(1, int(request.query_params.get('size', 10))))
+        telegram_id = request.query_params.get('telegramId', '')
+        telegram_id = int(telegram_id) if telegram_id.isdigit() else None
+
+        if leaderboard:
+            response = {"leaderboard": await asyncio.to_thread(leaderboard.page, page, size)}
+            if telegram_id:
+                response["me"] = await player_rank(telegram_id)
+            return JSONResponse(response)
+
+        top_users = await db.fetch_all(queries.LEADERBOARD_QUERY, (size, (page - 1) * size))
+
+        return JSONResponse({"leaderboard": [{
+            "rank": (page - 1) * size + i + 1,
+            "name": user.get("first_name") or user.get("username") or "Anonymous",
+            "totalEarnings": user.get("total_earnings", 0),
+            "level": user.get("level", 1)
+        } for i, user in enumerate(top_users)]})
+
+    except Exception as e:
+        logger.error(f"Leaderboard error: {e}")
+        return error("Server error", 500)
+
+async def get_leaderboard_rank(request):
+    """Get one player's rank"""
+    try:
+        rank = await player_rank(request.path_params['telegram_id'])
+        if not rank:
+            return error("User not ranked", 404)
+        return JSONResponse(rank)
+
+    except Exception as e:
+        logger.error(f"Leaderboard rank error: {e}")
+        return error("Server error", 500)
+
+async def admin_stats(request):
+    """Get admin statistics"""
+    try:
+        totals = await db.fetch_one(
+            "SELECT total_users, active_users, total_coins, total_taps, reconciled_at FROM stats_totals WHERE id = 1"
+        )
+        if totals and totals['reconciled_at'] > datetime(1970, 1, 1):
+            return JSONResponse({
+                "totalUsers": totals['total_users'],
+                "activeUsers": totals['active_users'],
+                "totalCoinsEarned": totals['total_coins'],
+                "totalTaps": totals['total_taps'],
+                "reconciledAt": totals['reconciled_at'].isoformat()
+            })
+
+        stats = await db.fetch_one(
+            "SELECT COUNT(*) as total_users, SUM(last_action_time >= %s) as active_users, "
+            "SUM(total_earnings) as total_coins, SUM(taps_count) as total_taps FROM users",
+            (datetime.now() - timedelta(days=1),)
+        )
+        return JSONResponse({
+            "totalUsers": stats['total_users'] or 0,
+            "activeUsers": int(stats['active_users'] or 0),
+            "totalCoinsEarned": int(stats['total_coins'] or 0),
+            "totalTaps": int(stats['total_taps'] or 0)
+        })
+
+    except Exception as e:
+        logger.error(f"Admin stats error: {e}")
+        return error("Server error", 500)
+
+async def admin_stats_series(request):
+    """Get hourly or daily activity buckets, e.g. taps per hour over the last week"""
+    try:
+        granularity = request.query_params.get('granularity', 'hour')
+        if granularity not in GRANULARITIES:
+            return error("Invalid granularity", 400)
+
+        until = datetime.now()
+        since = until - timedelta(days=min(366, max(1, int(request.query_params.get('days', 7)))))
+        rows = await db.fetch_all(SERIES_QUERY, (granularity, bucket_start(since, granularity), until))
+
+        return JSONResponse({
+            "granularity": granularity,
+            "series": [{
+                "bucketStart": row['bucket_start'].isoformat(),
+                "taps": row['taps'],
+                "coinsEarned": row['coins_earned'],
+                "games": row['games'],
+                "newUsers": row['new_users']
+            } for row in rows]
+        })
+
+    except Exception as e:
+        logger.error(f"Admin stats series error: {e}")
+        return error("Server error", 500)
+
+async def push_socket(websocket):
+    """Stream energy ticks, balance changes, level-ups and rank for one user; accepts taps"""
+    telegram_id = websocket.path_params['telegram_id']
+    await websocket.accept()
+
+    user = await get_user_by_telegram_id(telegram_id, 'profile')
+    if not user:
+        await websocket.close(code=4404)
+        return
+
+    sent = {"energy": None, "rank": None}
+    rank_due = [True]
+
+    async def send(event, **payload):
+        await websocket.send_text(serializer.dumps_str({"type": event, **payload}))
+
+    async def send_energy():
+        current = energy.current_energy(user.energy, user.last_energy_update, user.level)
+        if current != sent["energy"]:
+            sent["energy"] = current
+            await send("energy", energy=current, maxEnergy=energy.max_energy(user.level))
+
+    async def send_rank():
+        if leaderboard:
+            # Order-statistics lookup; None once the user is below the leaderboard window
+            position = await asyncio.to_thread(leaderboard.rank, telegram_id)
+            rank = position["rank"] if position else None
+        else:
+            row = await db.fetch_one(queries.RANK_QUERY, (user.get("total_earnings", 0),))
+            rank = row["ahead"] + 1 if row else None
+        if rank != sent["rank"]:
+            sent["rank"] = rank
+            await send("rank", rank=rank)
+
+    async def ticks():
+        # Energy is derived from the last checkpoint, so ticks cost no queries
+        elapsed = 0.0
+        while True:
+            await asyncio.sleep(Config.PUSH_ENERGY_TICK)
+            await send_energy()
+            elapsed += Config.PUSH_ENERGY_TICK
+            if rank_due[0] and elapsed >= Config.PUSH_RANK_INTERVAL:
+                rank_due[0] = False
+                elapsed = 0.0
+                await send_rank()
+
+    async def updates(queue):
+        while True:
+            columns = await queue.get()
+            level_before = user.get("level", 1)
+            coins_before = (user.get("coins"), user.get("ton_coins"), user.get("total_earnings"))
+            user.update(columns)
+            if (user.get("coins"), user.get("ton_coins"), user.get("total_earnings")) != coins_before:
+                await send("coins", coins=user.get("coins", 0), tonCoins=user.get("ton_coins", 0),
+                           totalEarnings=user.get("total_earnings", 0))
+                rank_due[0] = True
+            if user.get("level", 1) > level_before:
+                await send("levelUp", level=user.level, maxEnergy=energy.max_energy(user.level))
+            await send_energy()
+
+    async def commands():
+        while True:
+            try:
+                message = serializer.loads(await websocket.receive_text())
+            except ValueError:
+                await send("error", message="Invalid message", status=400)
+                continue
+            if not isinstance(message, dict) or message.get("type") != "tap":
+                await send("error", message="Unknown message type", status=400)
+                continue
+            # Same per-player limit as POST /api/tap, under the key limited() uses
+            if not await action_limit.allow_async(f"user:{telegram_id}"):
+                await send("error", message="Rate limit exceeded", status=429)
+                continue
+            # The result reaches this socket through push_hub like any other write
+            _, level_up, failure = await apply_taps(telegram_id, message.get("taps", 1))
+            if failure:
+                await send("error", message=failure[0], status=failure[1])
+
+    queue = push_hub.subscribe(telegram_id)
+    tasks = [asyncio.create_task(coroutine) for coroutine in (ticks(), updates(queue), commands())]
+    try:
+        await send("state", **energy.with_current_energy(user.copy()).to_profile())
+        await send_rank()
+        rank_due[0] = False
+        sent["energy"] = energy.current_energy(user.energy, user.last_energy_update, user.level)
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Push socket error for {telegram_id}: {e}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        push_hub.unsubscribe(telegram_id, queue)
+
+routes = [
+    Route('/api/health', limited(request_limit)(health_check), methods=['GET']),
+    Route('/api/user/create', limited(request_limit)(create_user_endpoint), methods=['POST']),
+    Route('/api/user/{telegram_id:int}', limited(request_limit)(get_user), methods=['GET']),
+    Route('/api/tap', limited(action_limit)(tap_action), methods=['POST']),
+    Route('/api/tap/batch', limited(action_limit)(tap_batch_action), methods=['POST']),
+    Route('/api/game/{action}', limited(action_limit)(game_action), methods=['POST']),
+    Route('/api/leaderboard', limited(request_limit)(get_leaderboard), methods=['GET']),
+    Route('/api/leaderboard/rank/{telegram_id:int}', limited(request_limit)(get_leaderboard_rank), methods=['GET']),
+    Route('/api/admin/stats', limited(request_limit)(admin_stats), methods=['GET']),
+    Route('/api/admin/stats/series', limited(request_limit)(admin_stats_series), methods=['GET']),
+    WebSocketRoute('/api/ws/{telegram_id:int}', push_socket)
+]
+
+application = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=[Config.FRONTEND_URL], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(application, host=Config.HOST, port=Config.PORT)
@@ -0,0 +1,79 @@
+"""
+Async MySQL access for Keze Tap Game (aiomysql)
+Used by the ASGI server; queries are shared with the sync code via queries.py
+"""
+
+import logging
+from contextlib import asynccontextmanager
+import aiomysql
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class AsyncDatabase:
+    """aiomysql pool with the same fetch/execute helpers as execute_query"""
+
+    def __init__(self, minsize=None, maxsize=None):
+        self.minsize = minsize or Config.ASYNC_DB_POOL_MIN
+        self.maxsize = maxsize or Config.ASYNC_DB_POOL_MAX
+        self.pool = None
+
+    async def connect(self):
+        self.pool = await aiomysql.create_pool(
+            host=Config.DB_HOST,
+            port=Config.DB_PORT,
+            user=Config.DB_USER,
+            password=Config.DB_PASSWORD,
+            db=Config.DB_NAME,
+            charset='utf8mb4',
+            autocommit=True,
+            minsize=self.minsize,
+            maxsize=self.maxsize
+        )
+
+    async def close(self):
+        if self.pool:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+    @property
+    def connected(self):
+        return self.pool is not None
+
+    async def fetch_one(self, query, params=None):
+        async with self.pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query, params or ())
+                return await cursor.fetchone()
+
+    async def fetch_all(self, query, params=None):
+        async with self.pool.acquire() as connection:
+            async with connection.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query, params or ())
+                return await cursor.fetchall()
+
+    async def execute(self, query, params=None):
+        async with self.pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, params or ())
+                return cursor.rowcount
+
+    async def executemany(self, query, rows):
+        async with self.pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.executemany(query, rows)
+                return cursor.rowcount
+
+    @asynccontextmanager
+    async def transaction(self):
+        """One pooled connection, one transaction, a dict cursor"""
+        async with self.pool.acquire() as connection:
+            await connection.begin()
+            try:
+                async with connection.cursor(aiomysql.DictCursor) as cursor:
+                    yield cursor
+                await connection.commit()
+            except Exception:
+                await connection.rollback()
+                raise
@@ -0,0 +1,189 @@
+"""
+Asynchronous game_actions audit log writer for Keze Tap Game
+
+Request handlers enqueue audit records into a bounded queue; a background
+worker drains it and writes multi-row INSERT batches. When the queue is full
+the record is either written synchronously by the caller or dropped, and on
+shutdown whatever is still queued is either flushed or dropped.
+
+Records are stored in typed columns (see encode_result); the result TEXT
+column only keeps the rare keys that have no column of their own.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+from datetime import datetime
+import games
+import queries
+import serializer
+
+logger = logging.getLogger(__name__)
+
+FLIP_SIDES = tuple(outcome.flip for outcome in games.PAYOUT_TABLES['flip'])
+
+# Result keys held in typed columns, or derivable from them: won is
+# payout > amount for every game, flip is the flip outcome row
+TYPED_KEYS = frozenset(('coins', 'coinsEarned', 'tonCoins', 'outcome', 'rng', 'won', 'flip'))
+
+def encode_result(result):
+    """Split a tap/game result dict into game_actions columns
+
+    Returns (payout, ton_coins, outcome, choice, rng_stream, rng_offset, extras JSON or None).
+    """
+    outcome = result.get('outcome')
+    if outcome is None and result.get('flip') in FLIP_SIDES:
+        outcome = FLIP_SIDES.index(result['flip'])
+
+    rng_stream = rng_offset = None
+    if result.get('rng'):
+        stream, offset = result['rng'].rsplit(':', 1)
+        rng_stream, rng_offset = bytes.fromhex(stream), int(offset)
+
+    choice = result.get('choice')
+    extras = {key: value for key, value in result.items() if key not in TYPED_KEYS and key != 'choice'}
+    if choice is not None and choice not in FLIP_SIDES:
+        # Whatever the client sent that the enum cannot hold
+        extras['choice'] = choice
+        choice = None
+
+    return (
+        result.get('coinsEarned', result.get('coins', 0)), result.get('tonCoins', 0), outcome, choice,
+        rng_stream, rng_offset, serializer.dumps_str(extras) if extras else None
+    )
+
+def audit_row(user_id, action, amount, result, timestamp, verified):
+    """Parameters for queries.LOG_GAME_ACTION_QUERY"""
+    return (user_id, action, amount) + encode_result(result) + (timestamp, verified)
+
+FULL_POLICIES = ('sync', 'drop')
+SHUTDOWN_POLICIES = ('flush', 'drop')
+
+class AuditLogWriter:
+    """Bounded queue of audit records drained by a batching worker thread"""
+
+    def __init__(self, transaction, queue_size=10000, batch_size=500, flush_interval=0.5,
+                 full_policy='sync', shutdown_policy='flush'):
+        if full_policy not in FULL_POLICIES:
+            raise ValueError(f"full_policy must be one of {FULL_POLICIES}")
+        if shutdown_policy not in SHUTDOWN_POLICIES:
+            raise ValueError(f"shutdown_policy must be one of {SHUTDOWN_POLICIES}")
+
+        self._transaction = transaction
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._full_policy = full_policy
+        self._shutdown_policy = shutdown_policy
+        self._stopping = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.sync_writes = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    def start(self):
+        """Start the worker thread and register the shutdown hook"""
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the worker, flushing or dropping queued records per the shutdown policy"""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=self._flush_interval * 10)
+
+        remaining = self._drain(self._queue.qsize())
+        if self._shutdown_policy == 'flush':
+            while remaining:
+                self._write(remaining[:self._batch_size])
+                remaining = remaining[self._batch_size:]
+        elif remaining:
+            logger.warning(f"Dropping {len(remaining)} queued audit records on shutdown")
+            self._count('dropped', len(remaining))
+
+    def log(self, user_id, action, amount, result, verified=True):
+        """Queue one audit record; never blocks the request"""
+        record = (user_id, action, amount, result, datetime.now(), verified)
+
+        if self._stopping.is_set():
+            self._write([record], sync=True)
+            return
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self._full_policy == 'sync':
+                self._write([record], sync=True)
+            else:
+                self._count('dropped', 1)
+            return
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self.enqueued += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self._flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first] + self._drain(self._batch_size - 1)
+            self._write(batch)
+
+    def _drain(self, limit):
+        records = []
+        while len(records) < limit:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def _write(self, records, sync=False):
+        rows = [audit_row(*record) for record in records]
+        try:
+            with self._transaction() as cursor:
+                # mysql.connector rewrites this into a single multi-row INSERT
+                cursor.executemany(queries.LOG_GAME_ACTION_QUERY, rows)
+        except Exception as e:
+            logger.error(f"Audit log write of {len(rows)} records failed: {e}")
+            self._count('failed', len(rows))
+            return
+
+        with self._stats_lock:
+            self.written += len(rows)
+            self.batches += 1
+            if sync:
+                self.sync_writes += len(rows)
+
+    def _count(self, name, amount):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def stats(self):
+        """Backpressure and throughput counters"""
+        with self._stats_lock:
+            return {
+                "queueDepth": self._queue.qsize(),
+                "queueCapacity": self._queue.maxsize,
+                "maxDepth": self.max_depth,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "syncWrites": self.sync_writes,
+                "dropped": self.dropped,
+                "failed": self.failed
+            }
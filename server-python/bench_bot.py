@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Bot handler throughput check
+Replays /stats updates against the real handlers with a simulated MySQL
+round trip and compares updates/sec when the query blocks the event loop
+(the old behaviour) with the bounded executor used by telegram_bot.run_db.
+
+    python bench_bot.py --updates 200 --latency-ms 20 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+import telegram_bot
+
+def fake_user_lookup(latency):
+    """Stand-in for get_user_by_telegram_id that holds the calling thread like a query would"""
+    def lookup(telegram_id):
+        time.sleep(latency)
+        return {
+            "telegram_id": telegram_id, "first_name": "Bench", "coins": 0, "ton_coins": 0,
+            "level": 1, "experience": 0, "taps_count": 0, "total_earnings": 0,
+            "daily_streak": 0, "referral_count": 0
+        }
+    return lookup
+
+def fake_update(telegram_id):
+    async def reply_text(*args, **kwargs):
+        return None
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=telegram_id, username=None, first_name="Bench", last_name=None),
+        message=SimpleNamespace(reply_text=reply_text)
+    )
+
+async def blocking_run_db(func, *args):
+    return func(*args)
+
+async def replay(updates, concurrency):
+    """Dispatch updates the way Application does with concurrent_updates=N"""
+    semaphore = asyncio.Semaphore(concurrency)
+    context = SimpleNamespace(args=[], bot=None)
+
+    async def handle(telegram_id):
+        async with semaphore:
+            await telegram_bot.stats_command(fake_update(telegram_id), context)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[handle(900000000 + i) for i in range(updates)])
+    return updates / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bot updates/sec with blocking vs pooled DB calls")
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20, help="Simulated query round trip")
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    telegram_bot.get_user_by_telegram_id = fake_user_lookup(args.latency_ms / 1000)
+    pooled_run_db = telegram_bot.run_db
+
+    results = {}
+    for mode, run_db in (("blocking", blocking_run_db), ("executor", pooled_run_db)):
+        telegram_bot.run_db = run_db
+        results[mode] = asyncio.run(replay(args.updates, args.concurrency))
+
+    print(f"{'mode':<10}{'updates/s':>12}")
+    for mode, rate in results.items():
+        print(f"{mode:<10}{rate:>12.1f}")
+    print(f"speedup: {results['executor'] / results['blocking']:.1f}x "
+          f"(executor bounded at {telegram_bot.DB_POOL_SIZE} threads)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+JSON encoding micro-benchmark
+Builds and encodes a representative body for each API endpoint with the
+stdlib encoder Flask's default provider uses, with serializer.dumps (orjson
+when installed) and, for the tap response, with the pre-encoded template.
+Prints encodes/sec.
+
+    python bench_json.py --seconds 0.5
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime
+import serializer
+from user_state import UserState
+
+def sample_user():
+    now = datetime.now()
+    return UserState(
+        id=1, telegram_id=900000001, username="keze_fan", first_name="Keze", last_name="Player",
+        coins=125000, ton_coins=3, level=12, experience=480, taps_count=98211, energy=840,
+        last_energy_update=now, referral_code="900000001", referred_by=None, referral_count=4,
+        daily_streak=6, last_login_date=now, total_earnings=240000, spins_won=31,
+        treasures_found=12, coins_flipped=40, total_staked=88000, banned=False,
+        last_action_time=now, created_at=now, updated_at=now, max_energy=2100
+    )
+
+def payloads():
+    user = sample_user()
+    result = {"coins": 2000, "tonCoins": 0, "won": True}
+    return {
+        "profile": lambda: user.to_profile(),
+        "tap": lambda: user.to_tap_response(False),
+        "game": lambda: user.to_game_response(result),
+        "create_user": lambda: {"success": True, "user": user},
+        "leaderboard": lambda: {"leaderboard": [
+            {"rank": i + 1, "name": f"Player {i}", "totalEarnings": 1000000 - i * 37, "level": 40 - i // 5}
+            for i in range(100)
+        ], "page": 1, "size": 100},
+        "admin_stats": lambda: {
+            "totalUsers": 184233, "activeUsers": 9120, "totalCoinsEarned": 8812349123,
+            "totalTaps": 412398812, "reconciledAt": datetime.now()
+        }
+    }
+
+def flask_default(obj):
+    """Roughly what flask.json.provider.DefaultJSONProvider does"""
+    return json.dumps(obj, default=lambda o: o.as_dict() if hasattr(o, 'as_dict') else str(o),
+                      sort_keys=True, ensure_ascii=True).encode()
+
+def rate(func, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    started = time.perf_counter()
+    while time.perf_counter() < deadline:
+        for _ in range(200):
+            func()
+        count += 200
+    return count / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSON encoders per endpoint payload")
+    parser.add_argument("--seconds", type=float, default=0.5, help="Time per measurement")
+    args = parser.parse_args()
+
+    user = sample_user()
+    print(f"serializer backend: {serializer.BACKEND}")
+    print(f"{'endpoint':<14}{'stdlib/s':>12}{'serializer/s':>14}{'template/s':>12}")
+    for name, build in payloads().items():
+        # Building the body from UserState is part of the per-request cost
+        stdlib = rate(lambda: flask_default(build()), args.seconds)
+        fast = rate(lambda: serializer.dumps(build()), args.seconds)
+        template = ""
+        if name == "tap":
+            template = f"{rate(lambda: user.to_tap_response_bytes(False), args.seconds):>12.0f}"
+        print(f"{name:<14}{stdlib:>12.0f}{fast:>14.0f}{template:>12}")
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,10 @@
 Configuration settings for Keze Tap Game Python Backend
 """
 
+import importlib.util
 import os
 from dotenv import load_dotenv
+from rate_limit import action_ceiling
 
 # Load environment variables
 load_dotenv()
@@ -12,7 +14,8 @@ class Config:
     """Base configuration class"""
 
     # Flask settings
-    SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
+    DEFAULT_SECRET_KEY = 'dev-secret-key-change-in-production'
+    SECRET_KEY = os.getenv('SECRET_KEY', DEFAULT_SECRET_KEY)
     DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
 
     # Server settings
@@ -21,27 +24,109 @@ class Config:
 
     # Database settings
     MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/keze-tap-game')
+    DB_HOST = os.getenv('DB_HOST', 'localhost')
+    DB_NAME = os.getenv('DB_NAME', 'keze_tap_game')
+    DB_USER = os.getenv('DB_USER', 'root')
+    DB_PASSWORD = os.getenv('DB_PASSWORD', '')
+    DB_PORT = int(os.getenv('DB_PORT', 3306))
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))  # API process
+    BOT_DB_POOL_SIZE = int(os.getenv('BOT_DB_POOL_SIZE', 5))  # Telegram bot process
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))  # seconds to wait for a free connection
+    DB_POOL_IDLE_CHECK = float(os.getenv('DB_POOL_IDLE_CHECK', 30))  # ping connections idle longer than this
+    DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 32))  # prepared statements per connection
+    ASYNC_DB_POOL_MIN = int(os.getenv('ASYNC_DB_POOL_MIN', 2))
+    ASYNC_DB_POOL_MAX = int(os.getenv('ASYNC_DB_POOL_MAX', 20))
 
     # Telegram settings
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+    BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', 64))
+    BOT_SIGNUP_WINDOW = float(os.getenv('BOT_SIGNUP_WINDOW', 0.02))  # seconds /start calls are coalesced
+    BOT_SIGNUP_BATCH = int(os.getenv('BOT_SIGNUP_BATCH', 200))  # registrations per provisioning transaction
 
     # URLs
     FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:3000')
     GAME_URL = os.getenv('GAME_URL', 'http://localhost:3000')
 
     # Rate limiting
-    RATELIMIT_STORAGE_URL = os.getenv('RATELIMIT_STORAGE_URL', 'memory://')
+    RATELIMIT_STORAGE_URL = os.getenv('RATELIMIT_STORAGE_URL', 'memory://')  # also holds the tap gate buckets
 
     # Game settings
-    MAX_ENERGY = int(os.getenv('MAX_ENERGY', 1000))
+    MAX_ENERGY = int(os.getenv('MAX_ENERGY', 1000))  # at level 1
+    ENERGY_PER_LEVEL = int(os.getenv('ENERGY_PER_LEVEL', 100))
     ENERGY_REGEN_RATE = int(os.getenv('ENERGY_REGEN_RATE', 2))  # per minute
     REFERRAL_BONUS = int(os.getenv('REFERRAL_BONUS', 1000))
     NEW_USER_BONUS = int(os.getenv('NEW_USER_BONUS', 500))
+    GAME_RNG_SECRET = os.getenv('GAME_RNG_SECRET')  # required; keys outcome streams and replays plays
+    GAME_RNG_BATCH = int(os.getenv('GAME_RNG_BATCH', 1024))  # outcomes precomputed per stream
 
     # Anti-cheat settings
     MIN_TAP_INTERVAL = float(os.getenv('MIN_TAP_INTERVAL', 0.1))  # seconds
+    TAP_GATE_BURST = int(os.getenv('TAP_GATE_BURST', 1))  # taps allowed back-to-back before MIN_TAP_INTERVAL applies
+
+    # Streaming anti-cheat analyzer (anticheat.py); SUSPICIOUS_ACTION_THRESHOLD is actions per window
+    ANTICHEAT_WINDOW = float(os.getenv('ANTICHEAT_WINDOW', 60))  # seconds
+    ANTICHEAT_BATCH_SIZE = int(os.getenv('ANTICHEAT_BATCH_SIZE', 5000))  # game_actions rows per read
+    ANTICHEAT_POLL_INTERVAL = float(os.getenv('ANTICHEAT_POLL_INTERVAL', 1.0))  # seconds when caught up
+    ANTICHEAT_SETTLE_IDS = int(os.getenv('ANTICHEAT_SETTLE_IDS', 1000))  # ids below the newest re-read for late commits
+    ANTICHEAT_MIN_SAMPLES = int(os.getenv('ANTICHEAT_MIN_SAMPLES', 30))  # before rhythm/luck checks apply
+    ANTICHEAT_MIN_INTERVAL_CV = float(os.getenv('ANTICHEAT_MIN_INTERVAL_CV', 0.05))  # tap gaps more regular are bot-like
+    ANTICHEAT_WIN_Z = float(os.getenv('ANTICHEAT_WIN_Z', 4.0))  # wins this many std devs above expected
+    ANTICHEAT_AUTO_BAN = os.getenv('ANTICHEAT_AUTO_BAN', 'False').lower() == 'true'
+    ANTICHEAT_BAN_FACTOR = float(os.getenv('ANTICHEAT_BAN_FACTOR', 3))  # ban at this multiple of the threshold
     MAX_TAPS_PER_REQUEST = int(os.getenv('MAX_TAPS_PER_REQUEST', 10))
-    SUSPICIOUS_ACTION_THRESHOLD = int(os.getenv('SUSPICIOUS_ACTION_THRESHOLD', 50))
+    # Default: the most actions the per-route rate limits let through in one window
+    SUSPICIOUS_ACTION_THRESHOLD = int(os.getenv('SUSPICIOUS_ACTION_THRESHOLD', action_ceiling(ANTICHEAT_WINDOW)))
+    TAP_BATCH_MAX_BURSTS = int(os.getenv('TAP_BATCH_MAX_BURSTS', 300))  # bursts per /api/tap/batch journal
+    TAP_BATCH_MAX_SPAN = float(os.getenv('TAP_BATCH_MAX_SPAN', 120))  # seconds a journal may reach back
+
+    # Write-behind tap buffer (requires user-sticky routing when running several workers)
+    TAP_BUFFER_ENABLED = os.getenv('TAP_BUFFER_ENABLED', 'False').lower() == 'true'
+    TAP_BUFFER_JOURNAL_DIR = os.getenv('TAP_BUFFER_JOURNAL_DIR', os.path.join(os.path.dirname(__file__), 'tap_journal'))
+    TAP_BUFFER_FLUSH_INTERVAL = float(os.getenv('TAP_BUFFER_FLUSH_INTERVAL', 1.0))  # seconds
+    TAP_BUFFER_MAX_PENDING = int(os.getenv('TAP_BUFFER_MAX_PENDING', 500))  # users before an early flush
+
+    # Push channel (ASGI WebSocket at /api/ws/<telegram_id>)
+    PUSH_BUS_URL = os.getenv('PUSH_BUS_URL')  # redis:// URL to relay updates between processes
+    PUSH_ENERGY_TICK = float(os.getenv('PUSH_ENERGY_TICK', 60 / ENERGY_REGEN_RATE))  # seconds
+    PUSH_RANK_INTERVAL = float(os.getenv('PUSH_RANK_INTERVAL', 30))  # min seconds between rank lookups
+    PUSH_QUEUE_SIZE = int(os.getenv('PUSH_QUEUE_SIZE', 64))  # pending updates per socket
+
+    # Response/audit JSON encoding
+    JSON_ENCODER = os.getenv('JSON_ENCODER', 'auto')  # auto (orjson if installed) | orjson | json
+
+    # User cache (memory is per process; redis is shared by all workers and the bot)
+    USER_CACHE_BACKEND = os.getenv('USER_CACHE_BACKEND', 'memory')  # memory | redis | none
+    USER_CACHE_URL = os.getenv('USER_CACHE_URL', 'redis://localhost:6379/0')
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 5.0))  # seconds
+    USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', 10000))
+
+    # Leaderboard window (top LEADERBOARD_SIZE users); redis shares one ranking across workers
+    LEADERBOARD_ENABLED = os.getenv('LEADERBOARD_ENABLED', 'True').lower() == 'true'
+    LEADERBOARD_BACKEND = os.getenv('LEADERBOARD_BACKEND', 'memory')  # memory | redis
+    LEADERBOARD_URL = os.getenv('LEADERBOARD_URL', os.getenv('USER_CACHE_URL', 'redis://localhost:6379/0'))
+    LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', 10000))  # users held
+    LEADERBOARD_RESYNC_INTERVAL = float(os.getenv('LEADERBOARD_RESYNC_INTERVAL', 300))  # seconds
+    LEADERBOARD_MAX_PAGE_SIZE = int(os.getenv('LEADERBOARD_MAX_PAGE_SIZE', 100))
+
+    # Admin stats rollups
+    STATS_ROLLUP_ENABLED = os.getenv('STATS_ROLLUP_ENABLED', 'True').lower() == 'true'
+    STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', 5.0))  # seconds
+    STATS_RECONCILE_INTERVAL = float(os.getenv('STATS_RECONCILE_INTERVAL', 300))  # seconds
+
+    # Asynchronous game_actions audit log
+    AUDIT_LOG_ASYNC = os.getenv('AUDIT_LOG_ASYNC', 'True').lower() == 'true'
+    AUDIT_LOG_QUEUE_SIZE = int(os.getenv('AUDIT_LOG_QUEUE_SIZE', 10000))
+    AUDIT_LOG_BATCH_SIZE = int(os.getenv('AUDIT_LOG_BATCH_SIZE', 500))
+    AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv('AUDIT_LOG_FLUSH_INTERVAL', 0.5))  # seconds
+    AUDIT_LOG_FULL_POLICY = os.getenv('AUDIT_LOG_FULL_POLICY', 'sync')  # sync | drop
+    AUDIT_LOG_SHUTDOWN_POLICY = os.getenv('AUDIT_LOG_SHUTDOWN_POLICY', 'flush')  # flush | drop
+
+    # game_actions partitions and retention (manage.py rotate-game-actions)
+    GAME_ACTIONS_PARTITION_BY = os.getenv('GAME_ACTIONS_PARTITION_BY', 'month')  # month | day
+    GAME_ACTIONS_PARTITIONS_AHEAD = int(os.getenv('GAME_ACTIONS_PARTITIONS_AHEAD', 2))  # empty future partitions kept
+    GAME_ACTIONS_RETENTION = int(os.getenv('GAME_ACTIONS_RETENTION', 6))  # periods kept before archiving
+    GAME_ACTIONS_ARCHIVE_DIR = os.getenv('GAME_ACTIONS_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'archive'))
+    GAME_ACTIONS_ARCHIVE_FORMAT = os.getenv('GAME_ACTIONS_ARCHIVE_FORMAT', 'auto')  # auto (parquet if pyarrow) | parquet | csv
 
     # CORS settings
     CORS_ORIGINS = [FRONTEND_URL] if FRONTEND_URL else ['*']
@@ -57,10 +142,25 @@ class Config:
         if not Config.TELEGRAM_BOT_TOKEN:
             errors.append("TELEGRAM_BOT_TOKEN is required for bot functionality")
 
-        if not Config.SECRET_KEY or Config.SECRET_KEY == 'dev-secret-key-change-in-production':
+        if not Config.SECRET_KEY or Config.SECRET_KEY == Config.DEFAULT_SECRET_KEY:
             if not Config.DEBUG:
                 errors.append("SECRET_KEY must be set in production")
 
+        if not Config.GAME_RNG_SECRET or Config.GAME_RNG_SECRET == Config.DEFAULT_SECRET_KEY:
+            errors.append("GAME_RNG_SECRET must be set to a private value")
+
+        # Shared backends (rate limits, push bus, user cache, leaderboard) need redis-py
+        redis_settings = [
+            name for name, url in (
+                ('RATELIMIT_STORAGE_URL', Config.RATELIMIT_STORAGE_URL),
+                ('PUSH_BUS_URL', Config.PUSH_BUS_URL),
+                ('USER_CACHE_URL', Config.USER_CACHE_URL if Config.USER_CACHE_BACKEND == 'redis' else None),
+                ('LEADERBOARD_URL', Config.LEADERBOARD_URL if Config.LEADERBOARD_BACKEND == 'redis' else None)
+            ) if url and url.startswith(('redis://', 'rediss://'))
+        ]
+        if redis_settings and importlib.util.find_spec('redis') is None:
+            errors.append(f"{', '.join(redis_settings)} use Redis but the redis package is not installed (pip install redis)")
+
         return errors
 
 class DevelopmentConfig(Config):
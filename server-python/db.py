@@ -0,0 +1,369 @@
+"""
+MySQL data access for Keze Tap Game
+One connection pool per process, shared by the Flask API, the Telegram bot and
+manage.py. Connections are only pinged after sitting idle, reads are not
+committed, and each connection keeps a small cache of prepared statements.
+
+Queries run with prepared=True go over the binary protocol as server-side
+prepared statements (prepared once per connection, then only executed) and
+return Row objects: one __slots__ class per result shape instead of a dict
+per row, or instances of a caller-supplied row_type (e.g. UserState). Named
+%(param)s placeholders are rewritten to positional ones.
+"""
+
+import logging
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from contextlib import contextmanager
+import mysql.connector
+from mysql.connector import Error
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def connect(**overrides):
+    """Open one autocommit connection using the Config database settings"""
+    settings = {
+        'host': Config.DB_HOST,
+        'database': Config.DB_NAME,
+        'user': Config.DB_USER,
+        'password': Config.DB_PASSWORD,
+        'port': Config.DB_PORT,
+        'autocommit': True,
+        'charset': 'utf8mb4'
+    }
+    settings.update(overrides)
+    return mysql.connector.connect(**settings)
+
+class Row:
+    """Base for generated row classes; supports the dict access callers already use"""
+    __slots__ = ('_extra',)
+    _columns = ()
+    _fields = frozenset()
+
+    def __init__(self, *values):
+        for column, value in zip(self._columns, values):
+            setattr(self, column, value)
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        extra = getattr(self, '_extra', None)
+        if extra is not None and key in extra:
+            return extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            setattr(self, key, value)
+            return
+        # Derived values (max_energy, coins_earned...) go in a lazily created dict
+        try:
+            self._extra[key] = value
+        except AttributeError:
+            self._extra = {key: value}
+
+    def __contains__(self, key):
+        return key in self._fields or key in (getattr(self, '_extra', None) or ())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._columns) + list(getattr(self, '_extra', None) or ())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"Row({self.as_dict()!r})"
+
+@lru_cache(maxsize=256)
+def row_class(columns):
+    """Slots class for one result shape; Row.__init__ fills it positionally"""
+    if not all(column.isidentifier() for column in columns):
+        raise ValueError(f"Cannot build a row class for columns {columns}")
+    return type('Row', (Row,), {
+        '__slots__': columns,
+        '_columns': columns,
+        '_fields': frozenset(columns)
+    })
+
+NAMED_PARAM = re.compile(r"%\((\w+)\)s")
+
+@lru_cache(maxsize=256)
+def positional(query):
+    """Rewrite %(name)s placeholders to %s; returns (query, names or None)"""
+    names = tuple(NAMED_PARAM.findall(query))
+    if not names:
+        return query, None
+    return NAMED_PARAM.sub("%s", query), names
+
+def bind(query, params):
+    """Statement text and positional parameters for a prepared execution"""
+    query, names = positional(query)
+    if names is not None and isinstance(params, dict):
+        return query, tuple(params[name] for name in names)
+    return query, params or ()
+
+def decode(cursor, rows, row_type=None):
+    """Turn a prepared cursor's tuples into Row objects, or row_type instances"""
+    if not rows:
+        return []
+    columns = tuple(cursor.column_names)
+    if row_type is not None:
+        make = row_type.decoder(columns)
+        return [make(values) for values in rows]
+    cls = row_class(columns)
+    return [cls(*values) for values in rows]
+
+class PreparedSession:
+    """Prepared-statement access to one connection inside a transaction"""
+
+    def __init__(self, database, connection):
+        self._database = database
+        self._connection = connection
+
+    def _run(self, query, params):
+        query, params = bind(query, params)
+        cursor = self._database.cursor(self._connection, query, prepared=True)
+        cursor.execute(query, params)
+        return cursor
+
+    def execute(self, query, params=None):
+        return self._run(query, params).rowcount
+
+    def fetch_all(self, query, params=None, row_type=None):
+        cursor = self._run(query, params)
+        return decode(cursor, cursor.fetchall(), row_type)
+
+    def fetch_one(self, query, params=None, row_type=None):
+        rows = self.fetch_all(query, params, row_type)
+        return rows[0] if rows else None
+
+class PooledConnection:
+    """A pooled connection plus its prepared statement cache"""
+    __slots__ = ('raw', 'statements', 'last_used', 'broken')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.statements = OrderedDict()
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    def prepared(self, query, cache_size):
+        """Cursor holding `query` as a server-side prepared statement, reused while cached"""
+        cursor = self.statements.get(query)
+        if cursor is not None:
+            self.statements.move_to_end(query)
+            return cursor
+
+        cursor = self.raw.cursor(prepared=True)
+        self.statements[query] = cursor
+        if len(self.statements) > cache_size:
+            _, evicted = self.statements.popitem(last=False)
+            evicted.close()  # deallocates the statement on the server
+        return cursor
+
+    def close(self):
+        for cursor in self.statements.values():
+            try:
+                cursor.close()
+            except Error:
+                pass
+        self.statements.clear()
+        try:
+            self.raw.close()
+        except Error:
+            pass
+
+class Database:
+    """Fixed-size MySQL pool with health checks on idle connections"""
+
+    def __init__(self, name, size=None, checkout_timeout=None, idle_check=None, statement_cache_size=None):
+        self.name = name
+        self.size = size or Config.DB_POOL_SIZE
+        self.checkout_timeout = checkout_timeout or Config.DB_POOL_TIMEOUT
+        self.idle_check = Config.DB_POOL_IDLE_CHECK if idle_check is None else idle_check
+        self.statement_cache_size = statement_cache_size or Config.DB_STATEMENT_CACHE_SIZE
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._reconnects = 0
+
+    def connect(self):
+        """Open the first connection so a bad configuration fails at startup"""
+        self._release(self._new_connection())
+
+    def _new_connection(self):
+        with self._lock:
+            self._open += 1
+        try:
+            return PooledConnection(connect())
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+
+    def _discard(self, connection):
+        connection.close()
+        with self._lock:
+            self._open -= 1
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._open < self.size
+                if can_open:
+                    return self._new_connection()
+                if time.monotonic() >= deadline:
+                    raise Error(msg=f"Connection pool '{self.name}' exhausted")
+                # Short waits so a slot freed by a discarded connection is noticed
+                try:
+                    connection = self._idle.get(timeout=0.05)
+                except queue.Empty:
+                    continue
+
+            # Only connections that sat idle long enough for the server or a
+            # proxy to have dropped them are pinged before reuse
+            if time.monotonic() - connection.last_used < self.idle_check:
+                return connection
+            try:
+                connection.raw.ping(reconnect=False)
+                return connection
+            except Error:
+                logger.warning(f"Dropping stale connection from pool '{self.name}'")
+                self._reconnects += 1
+                self._discard(connection)
+
+    def _release(self, connection):
+        if connection.broken:
+            self._discard(connection)
+            return
+        connection.last_used = time.monotonic()
+        self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        """Check out one pooled connection; it is dropped instead of reused if it fails"""
+        connection = self._acquire()
+        try:
+            yield connection
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            connection.broken = True
+            raise
+        finally:
+            self._release(connection)
+
+    def cursor(self, connection, query, prepared=False):
+        if prepared:
+            return connection.prepared(query, self.statement_cache_size)
+        return connection.raw.cursor(dictionary=True)
+
+    def fetch_all(self, query, params=None, prepared=False, row_type=None):
+        with self.connection() as connection:
+            if prepared:
+                return PreparedSession(self, connection).fetch_all(query, params, row_type)
+            cursor = self.cursor(connection, query)
+            try:
+                cursor.execute(query, params or ())
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def fetch_one(self, query, params=None, prepared=False, row_type=None):
+        rows = self.fetch_all(query, params, prepared, row_type)
+        return rows[0] if rows else None
+
+    def execute(self, query, params=None, prepared=False):
+        """Run a write on an autocommit connection; returns the affected row count"""
+        with self.connection() as connection:
+            if prepared:
+                return PreparedSession(self, connection).execute(query, params)
+            cursor = self.cursor(connection, query)
+            try:
+                cursor.execute(query, params or ())
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    def execute_query(self, query, params=None, fetch=False, prepared=False, row_type=None):
+        """Same contract as the old per-module helper: rows or rowcount, None on error"""
+        try:
+            if fetch:
+                return self.fetch_all(query, params, prepared, row_type)
+            return self.execute(query, params, prepared)
+        except Error as e:
+            print(f"Database error: {e}")
+            return None
+
+    @contextmanager
+    def transaction(self, prepared=False):
+        """Check out one pooled connection and yield a cursor inside a single transaction
+
+        With prepared=True a PreparedSession is yielded instead of a dict cursor.
+        """
+        with self.connection() as connection:
+            connection.raw.start_transaction()
+            cursor = None if prepared else connection.raw.cursor(dictionary=True)
+            try:
+                yield PreparedSession(self, connection) if prepared else cursor
+                connection.raw.commit()
+            except Exception:
+                connection.raw.rollback()
+                raise
+            finally:
+                if cursor:
+                    cursor.close()
+
+    def health(self):
+        """Pool occupancy plus a live round trip on one connection"""
+        started = time.perf_counter()
+        try:
+            with self.connection() as connection:
+                connection.raw.ping(reconnect=False)
+            status = "ok"
+        except Error as e:
+            connection_error = str(e)
+            status = "error"
+        stats = {
+            "status": status,
+            "size": self.size,
+            "open": self._open,
+            "idle": self._idle.qsize(),
+            "reconnects": self._reconnects,
+            "pingMs": round((time.perf_counter() - started) * 1000, 2)
+        }
+        if status == "error":
+            stats["error"] = connection_error
+        return stats
+
+def create_database(name, size=None):
+    """Build and open a pool, or return None (and log why) when MySQL is unreachable"""
+    database = Database(name, size)
+    try:
+        database.connect()
+        print("✅ Connected to MySQL successfully")
+        return database
+    except Error as e:
+        print(f"❌ MySQL connection failed: {e}")
+        return None
@@ -0,0 +1,52 @@
+"""
+Energy model for Keze Tap Game
+
+Energy is never regenerated by a write. The stored (energy, last_energy_update)
+pair is a checkpoint and the current value is derived from it and the user's
+level whenever it is read; the checkpoint only moves when energy is spent
+or reset on level-up. The SQL helpers render the same formula for the
+conditional tap UPDATE so both sides always agree.
+"""
+
+from datetime import datetime
+from config import Config
+
+BASE_MAX_ENERGY = Config.MAX_ENERGY
+ENERGY_PER_LEVEL = Config.ENERGY_PER_LEVEL
+REGEN_PER_MINUTE = Config.ENERGY_REGEN_RATE
+
+def max_energy(level):
+    """Energy cap for a level"""
+    return BASE_MAX_ENERGY + (level - 1) * ENERGY_PER_LEVEL
+
+def current_energy(stored_energy, last_update, level, now=None):
+    """Energy available now, given the last stored checkpoint"""
+    now = now or datetime.now()
+    if last_update is None:
+        last_update = now
+    elif isinstance(last_update, str):
+        last_update = datetime.fromisoformat(last_update.replace('Z', '+00:00'))
+
+    minutes = max(0.0, (now - last_update).total_seconds() / 60)
+    return min(max_energy(level), stored_energy + int(minutes * REGEN_PER_MINUTE))
+
+def with_current_energy(user, now=None):
+    """Fill in a user row's derived energy and max_energy without writing anything"""
+    if not user:
+        return user
+
+    level = user.get('level', 1)
+    user['energy'] = current_energy(user.get('energy', 0), user.get('last_energy_update'), level, now)
+    user['max_energy'] = max_energy(level)
+    return user
+
+def max_energy_sql(level_expr="level"):
+    """SQL expression for the energy cap of a level expression"""
+    return f"({BASE_MAX_ENERGY} + (({level_expr}) - 1) * {ENERGY_PER_LEVEL})"
+
+def current_energy_sql(now_param):
+    """SQL expression for current energy from the energy/last_energy_update columns"""
+    return (
+        f"LEAST({max_energy_sql()}, energy + FLOOR("
+        f"TIMESTAMPDIFF(MICROSECOND, last_energy_update, {now_param}) / 60000000 * {REGEN_PER_MINUTE}))"
+    )
@@ -0,0 +1,201 @@
+"""
+Game outcomes for Keze Tap Game (spin, treasure, flip)
+
+Each game is a payout table and every play takes one uniform draw from an
+outcome stream. A stream is a random id; position n of it is
+BLAKE2b keyed with GAME_RNG_SECRET over "game:stream:n", so with the secret any logged
+"stream:offset" reference reproduces its outcome exactly, and without it
+the next outcome cannot be predicted. Streams are expanded GAME_RNG_BATCH
+outcomes at a time on a background thread, one batch ahead of the plays,
+and handed out in order.
+
+The reference stays on the server: it goes to the audit columns and
+`manage.py replay-game`, and public_result() strips it from responses. No
+outcome is drawn while GAME_RNG_SECRET is unset or the published default.
+"""
+
+import bisect
+import hashlib
+import secrets
+import threading
+from collections import namedtuple
+from config import Config
+
+GAMES = ('spin', 'treasure', 'flip')
+
+# Per-game win counter on users
+GAME_STAT_COLUMNS = {
+    'spin': 'spins_won',
+    'treasure': 'treasures_found',
+    'flip': 'coins_flipped'
+}
+
+# multiplier applies to the stake; ton_coins pays max(1, stake // 1000) TON
+Outcome = namedtuple('Outcome', 'probability multiplier won ton_coins flip', defaults=(False, None))
+
+PAYOUT_TABLES = {
+    'spin': (
+        Outcome(0.02, 10, True, ton_coins=True),
+        Outcome(0.08, 5, True),    # big win
+        Outcome(0.20, 2, True),    # good win
+        Outcome(0.20, 1.5, True),  # small win
+        Outcome(0.20, 1, False),   # break even
+        Outcome(0.30, 0, False)
+    ),
+    'treasure': (
+        Outcome(0.04, 10, True),   # 40% find treasure, 10% of finds x10,
+        Outcome(0.108, 5, True),   # 30% of the rest x5,
+        Outcome(0.252, 3, True),   # the others x3
+        Outcome(0.60, 0, False)
+    ),
+    # won is decided by the player's choice; multiplier applies when it matches
+    'flip': (
+        Outcome(0.5, 2, None, flip="heads"),
+        Outcome(0.5, 2, None, flip="tails")
+    )
+}
+
+def _thresholds(table):
+    """Cumulative upper bounds for bisecting a draw into a table row"""
+    total = 0.0
+    bounds = []
+    for outcome in table:
+        total += outcome.probability
+        bounds.append(total)
+    bounds[-1] = 1.0  # absorb float rounding so every draw lands in a row
+    return bounds
+
+THRESHOLDS = {action: _thresholds(table) for action, table in PAYOUT_TABLES.items()}
+
+# Result keys kept out of API responses
+SERVER_KEYS = frozenset(('rng',))
+
+def require_secret():
+    """The configured GAME_RNG_SECRET; raises when it is missing or the published default"""
+    secret = Config.GAME_RNG_SECRET
+    if not secret or secret == Config.DEFAULT_SECRET_KEY:
+        raise RuntimeError("GAME_RNG_SECRET must be set to a private value; with a known key outcomes are predictable")
+    return secret
+
+def _key(secret):
+    # BLAKE2b keys are at most 64 bytes; any secret length works through a digest
+    return hashlib.sha256(secret.encode()).digest()
+
+def _uniform(key, message):
+    digest = hashlib.blake2b(message.encode(), key=key, digest_size=8).digest()
+    return (int.from_bytes(digest, 'big') >> 11) / (1 << 53)
+
+def draw(action, stream, offset, secret=None):
+    """The uniform [0, 1) value at one position of an outcome stream"""
+    return _uniform(_key(secret or require_secret()), f"{action}:{stream}:{offset}")
+
+def outcome_index(action, value):
+    return bisect.bisect_right(THRESHOLDS[action], value)
+
+class OutcomeStream:
+    """Precomputed outcome rows of one game, handed out in stream order
+
+    While one batch is handed out, the next is expanded on a background
+    thread; a play only expands a batch itself if that one is not ready yet.
+    """
+
+    def __init__(self, action, batch_size):
+        self.action = action
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._next = None
+        self._prefetching = False
+        self.stream, self._rows = self._expand()
+        self.offset = 0
+
+    def _expand(self):
+        stream = secrets.token_hex(8)
+        bounds = THRESHOLDS[self.action]
+        key = _key(require_secret())
+        prefix = f"{self.action}:{stream}:"
+        return stream, [
+            bisect.bisect_right(bounds, _uniform(key, f"{prefix}{offset}")) for offset in range(self.batch_size)
+        ]
+
+    def _prefetch(self):
+        batch = None
+        try:
+            batch = self._expand()
+        finally:
+            with self._lock:
+                self._next = batch
+                self._prefetching = False
+
+    def next(self):
+        """Returns (table row index, "stream:offset" reference)"""
+        with self._lock:
+            if self.offset >= self.batch_size:
+                batch, self._next = self._next, None
+                self.stream, self._rows = batch or self._expand()
+                self.offset = 0
+            if self._next is None and not self._prefetching:
+                self._prefetching = True
+                threading.Thread(target=self._prefetch, name=f"keze-rng-{self.action}", daemon=True).start()
+            offset = self.offset
+            self.offset += 1
+            return self._rows[offset], f"{self.stream}:{offset}"
+
+_streams = {}
+_streams_lock = threading.Lock()
+
+def _stream(action):
+    stream = _streams.get(action)
+    if stream is None:
+        with _streams_lock:
+            stream = _streams.setdefault(action, OutcomeStream(action, Config.GAME_RNG_BATCH))
+    return stream
+
+def result_for(action, stake, choice, index, reference):
+    """The API result dict for a drawn table row"""
+    outcome = PAYOUT_TABLES[action][index]
+
+    if action == "flip":
+        won = outcome.flip == choice
+        return {
+            "coins": stake * outcome.multiplier if won else 0,
+            "won": won,
+            "flip": outcome.flip,
+            "choice": choice,
+            "outcome": index,
+            "rng": reference
+        }
+
+    result = {"coins": int(stake * outcome.multiplier), "won": outcome.won, "outcome": index, "rng": reference}
+    if action == "spin":
+        result["tonCoins"] = max(1, stake // 1000) if outcome.ton_coins else 0
+    return result
+
+def public_result(result):
+    """A play result as sent to the client, without the stream reference"""
+    return {key: value for key, value in result.items() if key not in SERVER_KEYS}
+
+def play(action, stake, choice=None):
+    """Draw an outcome for one play; returns the API result dict"""
+    index, reference = _stream(action).next()
+    return result_for(action, stake, choice, index, reference)
+
+def replay(action, reference, stake, choice=None, secret=None):
+    """Recompute a logged play from its "stream:offset" reference"""
+    stream, offset = reference.rsplit(":", 1)
+    index = outcome_index(action, draw(action, stream, int(offset), secret))
+    return result_for(action, stake, choice, index, reference)
+
+def settlement(telegram_id, action, stake, result, now):
+    """Parameters for queries.GAME_SETTLE_QUERY for one played game"""
+    won_column = GAME_STAT_COLUMNS[action] if result["won"] else None
+    params = {
+        "telegram_id": telegram_id,
+        "stake": stake,
+        "payout": result["coins"],
+        "earnings": max(0, result["coins"] - stake),
+        "ton_coins": result.get("tonCoins", 0),
+        "now": now
+    }
+    for column in GAME_STAT_COLUMNS.values():
+        params[column] = 1 if column == won_column else 0
+    return params
@@ -23,6 +23,7 @@ CREATE TABLE `users` (
   `last_energy_update` datetime DEFAULT CURRENT_TIMESTAMP,
   `referral_code` varchar(50) UNIQUE DEFAULT NULL,
   `referred_by` bigint DEFAULT NULL,
+  `referral_count` int DEFAULT 0,
   `daily_streak` int DEFAULT 0,
   `last_login_date` datetime DEFAULT CURRENT_TIMESTAMP,
   `total_earnings` bigint DEFAULT 0,
@@ -36,28 +37,95 @@ CREATE TABLE `users` (
   `updated_at` datetime DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
 
   -- Indexes for better performance
-  INDEX `idx_telegram_id` (`telegram_id`),
+  INDEX `idx_telegram_banned` (`telegram_id`, `banned`),
   INDEX `idx_total_earnings` (`total_earnings`),
   INDEX `idx_last_action` (`last_action_time`),
-  INDEX `idx_referral_code` (`referral_code`)
+  INDEX `idx_referral_code` (`referral_code`),
+  INDEX `idx_referred_by` (`referred_by`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- One row per invited user; recording it is what credits the referral bonus,
+-- so the bonus is paid at most once per user
+DROP TABLE IF EXISTS `referrals`;
+CREATE TABLE `referrals` (
+  `referred_id` bigint PRIMARY KEY,
+  `referrer_id` bigint NOT NULL,
+  `created_at` datetime NOT NULL,
+  INDEX `idx_referrer_id` (`referrer_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Create game_actions table for monitoring and anti-cheat
 DROP TABLE IF EXISTS `game_actions`;
+-- Range partitioned on timestamp (the partitioning column must be part of the
+-- primary key). Everything starts in pmax; run `python manage.py
+-- rotate-game-actions` once after import and then daily to split out
+-- monthly partitions and archive/drop expired ones.
 CREATE TABLE `game_actions` (
-  `id` int AUTO_INCREMENT PRIMARY KEY,
+  `id` int AUTO_INCREMENT,
   `user_id` bigint NOT NULL,
   `action` varchar(50) NOT NULL,
   `amount` int NOT NULL,
+  -- Typed audit record; payout is NULL only on rows not yet migrated
+  -- (manage.py migrate-audit-results)
+  `payout` bigint DEFAULT NULL,
+  `ton_coins` int NOT NULL DEFAULT 0,
+  `outcome` tinyint unsigned DEFAULT NULL,
+  `choice` enum('heads', 'tails') DEFAULT NULL,
+  `rng_stream` binary(8) DEFAULT NULL,
+  `rng_offset` int unsigned DEFAULT NULL,
+  -- JSON for the rare keys without a column of their own
   `result` text DEFAULT NULL,
-  `timestamp` datetime DEFAULT CURRENT_TIMESTAMP,
+  `timestamp` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `verified` boolean DEFAULT TRUE,
+  PRIMARY KEY (`id`, `timestamp`),
 
   -- Indexes for monitoring queries
   INDEX `idx_user_id` (`user_id`),
   INDEX `idx_timestamp` (`timestamp`),
   INDEX `idx_action` (`action`),
   INDEX `idx_user_action` (`user_id`, `action`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE COLUMNS(`timestamp`) (
+  PARTITION `pmax` VALUES LESS THAN (MAXVALUE)
+);
+
+-- Create admin statistics rollup tables
+DROP TABLE IF EXISTS `stats_totals`;
+CREATE TABLE `stats_totals` (
+  `id` tinyint PRIMARY KEY,
+  `total_users` bigint DEFAULT 0,
+  `active_users` bigint DEFAULT 0,
+  `total_coins` bigint DEFAULT 0,
+  `total_taps` bigint DEFAULT 0,
+  `reconciled_at` datetime NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+DROP TABLE IF EXISTS `stats_buckets`;
+CREATE TABLE `stats_buckets` (
+  `granularity` enum('hour', 'day') NOT NULL,
+  `bucket_start` datetime NOT NULL,
+  `taps` bigint DEFAULT 0,
+  `coins_earned` bigint DEFAULT 0,
+  `games` int DEFAULT 0,
+  `new_users` int DEFAULT 0,
+  PRIMARY KEY (`granularity`, `bucket_start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Journal segments already applied by the write-behind tap buffer
+DROP TABLE IF EXISTS `tap_buffer_flushes`;
+CREATE TABLE `tap_buffer_flushes` (
+  `segment` varchar(255) PRIMARY KEY,
+  `flushed_at` datetime NOT NULL,
+  INDEX `idx_flushed_at` (`flushed_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Last game_actions row processed by the anti-cheat analyzer (anticheat.py)
+DROP TABLE IF EXISTS `anticheat_checkpoints`;
+CREATE TABLE `anticheat_checkpoints` (
+  `name` varchar(50) PRIMARY KEY,
+  `last_id` int NOT NULL,
+  `last_timestamp` datetime NOT NULL,
+  `updated_at` datetime NOT NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Create tasks table (optional - for future expansion)
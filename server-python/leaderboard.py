@@ -0,0 +1,421 @@
+"""
+Leaderboard for Keze Tap Game
+
+Holds the top LEADERBOARD_SIZE non-banned users by total_earnings, which is
+everything the leaderboard pages, the bot's /leaderboard and rank lookups
+inside the top serve. It is updated incrementally from the tap and game
+write paths and re-synced periodically from the idx_total_earnings index
+(one LIMIT-ed range read); users below the window are not held, and rank()
+returns None for them so callers can fall back to MySQL.
+
+The memory backend is an order-statistics structure (a blocked sorted list)
+per process: each process only sees its own writes, so workers agree again
+after a resync. The redis backend keeps one sorted set shared by every
+worker and the bot; writes from any process are seen by all, and only one
+process per interval runs the resync.
+"""
+
+import logging
+import threading
+from bisect import bisect_left, insort
+
+
+logger = logging.getLogger(__name__)
+
+RESYNC_QUERY = """
+SELECT telegram_id, first_name, username, total_earnings, level
+FROM users
+WHERE banned = FALSE
+ORDER BY total_earnings DESC
+LIMIT %s
+"""
+
+PLAYERS_QUERY = "SELECT COUNT(*) AS players FROM users WHERE banned = FALSE"
+
+PROFILE_QUERY = "SELECT telegram_id, first_name, username, level FROM users WHERE telegram_id IN ({})"
+
+class SortedKeys:
+    """Sorted list split into blocks so inserts, removals and rank lookups stay cheap"""
+
+    def __init__(self, keys=(), load=512):
+        self._load = load
+        keys = sorted(keys)
+        self._blocks = [keys[i:i + load] for i in range(0, len(keys), load)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def add(self, key):
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+        else:
+            i = self._block_for(key)
+            block = self._blocks[i]
+            insort(block, key)
+            self._maxes[i] = block[-1]
+            if len(block) > self._load * 2:
+                halves = [block[:self._load], block[self._load:]]
+                self._blocks[i:i + 1] = halves
+                self._maxes[i:i + 1] = [half[-1] for half in halves]
+        self._len += 1
+
+    def remove(self, key):
+        i = self._block_for(key)
+        block = self._blocks[i]
+        j = bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            raise KeyError(key)
+        del block[j]
+        self._trimmed(i)
+
+    def pop(self):
+        """Remove and return the largest key"""
+        key = self._blocks[-1].pop()
+        self._trimmed(len(self._blocks) - 1)
+        return key
+
+    def _trimmed(self, i):
+        if self._blocks[i]:
+            self._maxes[i] = self._blocks[i][-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+        self._len -= 1
+
+    def index(self, key):
+        """Zero-based position of key"""
+        if self._blocks:
+            i = self._block_for(key)
+            block = self._blocks[i]
+            j = bisect_left(block, key)
+            if j < len(block) and block[j] == key:
+                return sum(len(earlier) for earlier in self._blocks[:i]) + j
+        raise KeyError(key)
+
+    def slice(self, start, stop):
+        """Keys in positions [start, stop)"""
+        result = []
+        position = 0
+        for block in self._blocks:
+            if position + len(block) > start:
+                result.extend(block[max(0, start - position):stop - position])
+                if position + len(block) >= stop:
+                    break
+            position += len(block)
+        return result
+
+    def _block_for(self, key):
+        # First block whose largest key is >= key, or the last block
+        return min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+
+class Leaderboard:
+    """Ranks the top `size` users by total earnings, highest first, in this process"""
+
+    def __init__(self, fetch, resync_interval=300.0, size=10000):
+        self._fetch = fetch
+        self._resync_interval = resync_interval
+        self._size = size
+        self._players = 0
+        self._lock = threading.Lock()
+        self._keys = SortedKeys()
+        self._earnings = {}
+        self._profiles = {}
+        self._resyncing = None
+        self._stopping = threading.Event()
+        self._thread = None
+        self.synced = False
+
+    def start(self):
+        """Load the initial snapshot and keep it re-synced in the background"""
+        self.resync()
+        self._thread = threading.Thread(target=self._run, name="leaderboard-resync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.wait(self._resync_interval):
+            try:
+                self.resync()
+            except Exception as e:
+                logger.error(f"Leaderboard resync failed: {e}")
+
+    def resync(self):
+        """Rebuild the index from MySQL, keeping updates that raced with the load"""
+        with self._lock:
+            self._resyncing = {}
+
+        rows = self._fetch(RESYNC_QUERY, (self._size,))
+        players = self._fetch(PLAYERS_QUERY, ())
+        if rows is None or not players:
+            with self._lock:
+                self._resyncing = None
+            raise RuntimeError("leaderboard resync query failed")
+
+        earnings = {}
+        profiles = {}
+        for row in rows:
+            telegram_id = row['telegram_id']
+            earnings[telegram_id] = row['total_earnings'] or 0
+            profiles[telegram_id] = (row['first_name'] or row['username'] or "Anonymous", row['level'])
+
+        with self._lock:
+            for telegram_id, (total_earnings, level) in self._resyncing.items():
+                if total_earnings > earnings.get(telegram_id, -1):
+                    earnings[telegram_id] = total_earnings
+                    if telegram_id in profiles:
+                        profiles[telegram_id] = (profiles[telegram_id][0], level)
+            self._resyncing = None
+            self._earnings = earnings
+            self._profiles = profiles
+            self._keys = SortedKeys((-total, telegram_id) for telegram_id, total in earnings.items())
+            self._players = players[0]['players']
+            self._trim()
+            self.synced = True
+
+    def update(self, telegram_id, total_earnings, level):
+        """Record a user's new total after a tap or game write"""
+        with self._lock:
+            if self._resyncing is not None:
+                self._resyncing[telegram_id] = (total_earnings, level)
+
+            old = self._earnings.get(telegram_id)
+            if old is not None:
+                if old == total_earnings:
+                    self._set_level(telegram_id, level)
+                    return
+                self._keys.remove((-old, telegram_id))
+            self._earnings[telegram_id] = total_earnings
+            self._keys.add((-total_earnings, telegram_id))
+            self._set_level(telegram_id, level)
+            self._trim()
+
+    def _trim(self):
+        # Keep the window bounded; whoever falls out is below everyone held
+        while len(self._keys) > self._size:
+            _, telegram_id = self._keys.pop()
+            self._earnings.pop(telegram_id, None)
+            self._profiles.pop(telegram_id, None)
+
+    def _set_level(self, telegram_id, level):
+        profile = self._profiles.get(telegram_id)
+        if profile is not None and profile[1] != level:
+            self._profiles[telegram_id] = (profile[0], level)
+
+    def remove(self, telegram_id):
+        """Drop a user, e.g. after a ban"""
+        with self._lock:
+            old = self._earnings.pop(telegram_id, None)
+            if old is not None:
+                self._keys.remove((-old, telegram_id))
+            self._profiles.pop(telegram_id, None)
+
+    def page(self, page=1, size=10):
+        """One page of the ranking as API-shaped dicts"""
+        start = (page - 1) * size
+        with self._lock:
+            keys = self._keys.slice(start, start + size)
+            missing = [telegram_id for _, telegram_id in keys if telegram_id not in self._profiles]
+
+        if missing:
+            self._load_profiles(missing)
+
+        entries = []
+        with self._lock:
+            for offset, (negative_total, telegram_id) in enumerate(keys):
+                name, level = self._profiles.get(telegram_id, ("Anonymous", 1))
+                entries.append({
+                    "rank": start + offset + 1,
+                    "name": name,
+                    "totalEarnings": -negative_total,
+                    "level": level
+                })
+        return entries
+
+    def top(self, limit=10):
+        return self.page(1, limit)
+
+    def rank(self, telegram_id):
+        """1-based rank and total for a user, or None when outside the window"""
+        with self._lock:
+            total = self._earnings.get(telegram_id)
+            if total is None:
+                return None
+            return {
+                "rank": self._keys.index((-total, telegram_id)) + 1,
+                "totalEarnings": total,
+                "totalPlayers": max(self._players, len(self._keys))
+            }
+
+    def size(self):
+        return len(self._keys)
+
+    def _load_profiles(self, telegram_ids):
+        # Users who first earned since the last resync
+        placeholders = ", ".join(["%s"] * len(telegram_ids))
+        rows = self._fetch(PROFILE_QUERY.format(placeholders), tuple(telegram_ids)) or []
+        with self._lock:
+            for row in rows:
+                self._profiles[row['telegram_id']] = (row['first_name'] or row['username'] or "Anonymous", row['level'])
+
+# KEYS[1] ranking, KEYS[2] levels, KEYS[3] names; ARGV telegram_id, total_earnings, level, size.
+# GT keeps the highest total when writes from several processes race.
+UPDATE_SCRIPT = """
+redis.call('ZADD', KEYS[1], 'GT', ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+local extra = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[4])
+if extra > 0 then
+    local dropped = redis.call('ZRANGE', KEYS[1], 0, extra - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, extra - 1)
+    redis.call('HDEL', KEYS[2], unpack(dropped))
+    redis.call('HDEL', KEYS[3], unpack(dropped))
+end
+"""
+
+class RedisLeaderboard:
+    """Ranks the top `size` users by total earnings in a sorted set shared by every process"""
+
+    def __init__(self, fetch, url, resync_interval=300.0, size=10000, prefix="keze:leaderboard"):
+        import redis
+        self._fetch = fetch
+        self._client = redis.Redis.from_url(url)
+        self._update = self._client.register_script(UPDATE_SCRIPT)
+        self._resync_interval = resync_interval
+        self._size = size
+        self._ranking = prefix
+        self._names = prefix + ":names"
+        self._levels = prefix + ":levels"
+        self._players = prefix + ":players"
+        self._resync_lock = prefix + ":resync"
+        self._stopping = threading.Event()
+        self._thread = None
+        self.synced = False
+
+    def start(self):
+        """Resync unless another process just did, and keep doing so in the background"""
+        self.resync()
+        self._thread = threading.Thread(target=self._run, name="leaderboard-resync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self):
+        while not self._stopping.wait(self._resync_interval):
+            try:
+                self.resync()
+            except Exception as e:
+                logger.error(f"Leaderboard resync failed: {e}")
+
+    def resync(self):
+        """Rebuild the shared set from MySQL; only one process per interval does the work"""
+        claimed = self._client.set(self._resync_lock, 1, nx=True, ex=max(1, int(self._resync_interval * 0.9)))
+        if not claimed:
+            self.synced = self.synced or bool(self._client.exists(self._ranking))
+            return
+
+        rows = self._fetch(RESYNC_QUERY, (self._size,))
+        players = self._fetch(PLAYERS_QUERY, ())
+        if rows is None or not players:
+            self._client.delete(self._resync_lock)
+            raise RuntimeError("leaderboard resync query failed")
+
+        # Built under temporary keys and renamed into place, so readers never
+        # see a partial set; writes racing the load land on the next update
+        pipe = self._client.pipeline(transaction=True)
+        staged = [key + ":staging" for key in (self._ranking, self._names, self._levels)]
+        pipe.delete(*staged)
+        if rows:
+            pipe.zadd(staged[0], {row['telegram_id']: row['total_earnings'] or 0 for row in rows})
+            pipe.hset(staged[1], mapping={
+                row['telegram_id']: row['first_name'] or row['username'] or "Anonymous" for row in rows
+            })
+            pipe.hset(staged[2], mapping={row['telegram_id']: row['level'] for row in rows})
+            for key, target in zip(staged, (self._ranking, self._names, self._levels)):
+                pipe.rename(key, target)
+        else:
+            pipe.delete(self._ranking, self._names, self._levels)
+        pipe.set(self._players, players[0]['players'])
+        pipe.execute()
+        self.synced = True
+
+    def update(self, telegram_id, total_earnings, level):
+        """Record a user's new total after a tap or game write"""
+        self._update(keys=[self._ranking, self._levels, self._names], args=[telegram_id, total_earnings, level, self._size])
+
+    def remove(self, telegram_id):
+        """Drop a user, e.g. after a ban"""
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zrem(self._ranking, telegram_id)
+        pipe.hdel(self._names, telegram_id)
+        pipe.hdel(self._levels, telegram_id)
+        pipe.execute()
+
+    def page(self, page=1, size=10):
+        """One page of the ranking as API-shaped dicts"""
+        start = (page - 1) * size
+        entries = self._client.zrevrange(self._ranking, start, start + size - 1, withscores=True)
+        if not entries:
+            return []
+        ids = [int(member) for member, _ in entries]
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hmget(self._names, ids)
+        pipe.hmget(self._levels, ids)
+        names, levels = pipe.execute()
+
+        missing = [telegram_id for telegram_id, name in zip(ids, names) if name is None]
+        if missing:
+            loaded = self._load_profiles(missing)
+            names = [name if name is not None else loaded.get(telegram_id, (None,))[0]
+                     for telegram_id, name in zip(ids, names)]
+            levels = [level if level is not None else loaded.get(telegram_id, (None, None))[1]
+                      for telegram_id, level in zip(ids, levels)]
+
+        return [{
+            "rank": start + offset + 1,
+            "name": name.decode() if isinstance(name, bytes) else (name or "Anonymous"),
+            "totalEarnings": int(score),
+            "level": int(level) if level is not None else 1
+        } for offset, ((_, score), name, level) in enumerate(zip(entries, names, levels))]
+
+    def top(self, limit=10):
+        return self.page(1, limit)
+
+    def rank(self, telegram_id):
+        """1-based rank and total for a user, or None when outside the window"""
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zrevrank(self._ranking, telegram_id)
+        pipe.zscore(self._ranking, telegram_id)
+        pipe.zcard(self._ranking)
+        pipe.get(self._players)
+        position, score, held, players = pipe.execute()
+        if position is None:
+            return None
+        return {
+            "rank": position + 1,
+            "totalEarnings": int(score),
+            "totalPlayers": max(int(players or 0), held)
+        }
+
+    def size(self):
+        return self._client.zcard(self._ranking)
+
+    def _load_profiles(self, telegram_ids):
+        # Users who first entered the window since the last resync
+        placeholders = ", ".join(["%s"] * len(telegram_ids))
+        rows = self._fetch(PROFILE_QUERY.format(placeholders), tuple(telegram_ids)) or []
+        profiles = {row['telegram_id']: (row['first_name'] or row['username'] or "Anonymous", row['level'])
+                    for row in rows}
+        if profiles:
+            self._client.hset(self._names, mapping={telegram_id: name for telegram_id, (name, _) in profiles.items()})
+        return profiles
+
+def create_leaderboard(backend, fetch, url=None, resync_interval=300.0, size=10000):
+    """Build a leaderboard from config values"""
+    if backend == 'redis':
+        return RedisLeaderboard(fetch, url, resync_interval, size)
+    return Leaderboard(fetch, resync_interval, size)
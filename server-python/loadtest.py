@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Load test for the Keze Tap Game API
+Drives the Flask (WSGI) and ASGI servers with the same request mix at several
+concurrency levels and prints throughput and latency percentiles side by side.
+Uses only the standard library (asyncio keep-alive HTTP/1.1 connections).
+
+Example, against the same database:
+    gunicorn -w 4 --threads 4 -b 0.0.0.0:5000 wsgi:application
+    uvicorn asgi:application --workers 4 --port 5001
+    python loadtest.py --target flask=http://localhost:5000 --target asgi=http://localhost:5001 \\
+        --concurrency 16,64,256 --duration 20 --users 1000 --seed
+
+The Flask app rate-limits taps and games per client address, so the default
+"profile" mix only reads; 429 responses are reported separately either way.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+MIXES = {
+    # (weight, method, path template, body template)
+    'profile': [
+        (80, 'GET', '/api/user/{user}', None),
+        (20, 'GET', '/api/leaderboard', None)
+    ],
+    'tap': [
+        (60, 'GET', '/api/user/{user}', None),
+        (30, 'POST', '/api/tap', {"telegramId": "{user}", "taps": 5}),
+        (10, 'GET', '/api/leaderboard', None)
+    ]
+}
+
+async def http_request(reader, writer, host, method, path, body=None):
+    """Send one request on a keep-alive connection and return the status code"""
+    payload = json.dumps(body).encode() if body is not None else b""
+    head = (
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n"
+    )
+    writer.write(head.encode() + payload)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+
+    length = 0
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+        elif name.lower() == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+def pick(mix):
+    weights = [weight for weight, *_ in mix]
+    return random.choices(mix, weights=weights)[0]
+
+def fill(template, user):
+    if template is None:
+        return None
+    return {key: (user if value == "{user}" else value) for key, value in template.items()}
+
+async def worker(base_url, mix, users, deadline, latencies, statuses):
+    parts = urlsplit(base_url)
+    host = parts.hostname
+    port = parts.port or 80
+    connection = None
+
+    while time.perf_counter() < deadline:
+        if connection is None:
+            connection = await asyncio.open_connection(host, port)
+        _, method, path, body = pick(mix)
+        user = random.choice(users)
+
+        started = time.perf_counter()
+        try:
+            status = await http_request(*connection, parts.netloc, method,
+                                        path.format(user=user), fill(body, user))
+        except (ConnectionError, asyncio.IncompleteReadError, OSError):
+            connection[1].close()
+            connection = None
+            statuses['conn_error'] = statuses.get('conn_error', 0) + 1
+            continue
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    if connection:
+        connection[1].close()
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def run_level(base_url, mix, users, concurrency, duration):
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        worker(base_url, mix, users, deadline, latencies, statuses) for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p90": percentile(latencies, 0.90) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "ok": sum(count for status, count in statuses.items() if isinstance(status, int) and status < 400),
+        "limited": statuses.get(429, 0),
+        "errors": sum(count for status, count in statuses.items()
+                      if not isinstance(status, int) or (status >= 400 and status != 429))
+    }
+
+async def seed_users(base_url, users):
+    parts = urlsplit(base_url)
+    connection = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    for user in users:
+        await http_request(*connection, parts.netloc, 'POST', '/api/user/create',
+                           {"telegramId": user, "firstName": f"Load {user}"})
+    connection[1].close()
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare API servers under load")
+    parser.add_argument("--target", action="append", required=True, help="name=http://host:port (repeatable)")
+    parser.add_argument("--concurrency", default="16,64,256", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per level")
+    parser.add_argument("--users", type=int, default=1000, help="Number of distinct users")
+    parser.add_argument("--user-id-start", type=int, default=900000000, help="First Telegram ID used")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="profile")
+    parser.add_argument("--seed", action="store_true", help="Create the test users first")
+    args = parser.parse_args()
+
+    targets = [target.split("=", 1) for target in args.target]
+    users = list(range(args.user_id_start, args.user_id_start + args.users))
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    if args.seed:
+        await seed_users(targets[0][1], users)
+
+    print(f"{'target':<10}{'conc':>6}{'req/s':>10}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'ok':>9}{'429':>7}{'err':>7}")
+    for concurrency in levels:
+        for name, base_url in targets:
+            r = await run_level(base_url, MIXES[args.mix], users, concurrency, args.duration)
+            print(f"{name:<10}{concurrency:>6}{r['rps']:>10.1f}{r['p50']:>9.1f}{r['p90']:>9.1f}"
+                  f"{r['p99']:>9.1f}{r['ok']:>9}{r['limited']:>7}{r['errors']:>7}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
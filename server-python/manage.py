@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Keze Tap Game maintenance commands
+Run from the server-python directory, e.g. `python manage.py reconcile-referrals`
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+from mysql.connector import Error
+from dotenv import load_dotenv
+from config import Config
+from audit_log import encode_result
+import db
+import games
+import retention
+import serializer
+
+# Load environment variables
+load_dotenv()
+
+def get_connection():
+    """Open a dedicated connection for a maintenance job"""
+    return db.connect()
+
+RECONCILE_REFERRALS_QUERY = """
+UPDATE users u
+LEFT JOIN (
+    SELECT referred_by, COUNT(*) AS referrals
+    FROM users
+    WHERE referred_by IS NOT NULL
+    GROUP BY referred_by
+) r ON r.referred_by = u.telegram_id
+SET u.referral_count = COALESCE(r.referrals, 0)
+WHERE u.referral_count <> COALESCE(r.referrals, 0)
+"""
+
+# Referrals made before the referrals table existed, so they cannot be credited again
+BACKFILL_REFERRALS_QUERY = """
+INSERT INTO referrals (referred_id, referrer_id, created_at)
+SELECT telegram_id, referred_by, COALESCE(created_at, NOW())
+FROM users
+WHERE referred_by IS NOT NULL
+ON DUPLICATE KEY UPDATE referred_id = referred_id
+"""
+
+def reconcile_referrals(args):
+    """Backfill referrals from referred_by and recompute users.referral_count in one pass"""
+    connection = get_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(BACKFILL_REFERRALS_QUERY)
+        print(f"✅ Backfilled {cursor.rowcount} referrals")
+        cursor.execute(RECONCILE_REFERRALS_QUERY)
+        print(f"✅ Reconciled referral counts ({cursor.rowcount} users corrected)")
+        cursor.close()
+    finally:
+        connection.close()
+
+BUCKET_FORMATS = {
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d 00:00:00'
+}
+
+REBUILD_ACTIVITY_QUERY = """
+INSERT INTO stats_buckets (granularity, bucket_start, taps, coins_earned, games, new_users)
+SELECT %s, bucket, SUM(taps), SUM(coins), SUM(games), 0
+FROM (
+    SELECT
+        DATE_FORMAT(timestamp, %s) AS bucket,
+        IF(action = 'tap', amount, 0) AS taps,
+        IF(action = 'tap',
+           COALESCE(payout, JSON_EXTRACT(result, '$.coinsEarned'), 0),
+           GREATEST(0, COALESCE(payout, JSON_EXTRACT(result, '$.coins'), 0) - amount)) AS coins,
+        IF(action = 'tap', 0, 1) AS games
+    FROM game_actions
+    WHERE timestamp >= %s AND timestamp < %s
+) activity
+GROUP BY bucket
+ON DUPLICATE KEY UPDATE
+    taps = VALUES(taps),
+    coins_earned = VALUES(coins_earned),
+    games = VALUES(games)
+"""
+
+REBUILD_SIGNUPS_QUERY = """
+INSERT INTO stats_buckets (granularity, bucket_start, new_users)
+SELECT %s, DATE_FORMAT(created_at, %s), COUNT(*)
+FROM users
+WHERE created_at >= %s AND created_at < %s
+GROUP BY DATE_FORMAT(created_at, %s)
+ON DUPLICATE KEY UPDATE new_users = VALUES(new_users)
+"""
+
+def rebuild_rollups(args):
+    """Backfill stats_buckets from game_actions and users for the last N days
+
+    Only complete buckets are rebuilt so live increments for the current
+    hour and day are left alone. Referral bonuses are not in game_actions and
+    so are not part of a rebuilt coins_earned figure.
+    """
+    now = datetime.now()
+    since = (now - timedelta(days=args.days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    current_bucket = {
+        'hour': now.replace(minute=0, second=0, microsecond=0),
+        'day': now.replace(hour=0, minute=0, second=0, microsecond=0)
+    }
+
+    connection = get_connection()
+    try:
+        cursor = connection.cursor()
+        for granularity, bucket_format in BUCKET_FORMATS.items():
+            until = current_bucket[granularity]
+            cursor.execute(REBUILD_ACTIVITY_QUERY, (granularity, bucket_format, since, until))
+            cursor.execute(REBUILD_SIGNUPS_QUERY, (granularity, bucket_format, since, until, bucket_format))
+        cursor.close()
+        print(f"✅ Rebuilt hourly and daily rollups since {since}")
+    finally:
+        connection.close()
+
+def partition_game_actions(args):
+    """Convert an unpartitioned game_actions table to timestamp range partitions"""
+    connection = get_connection()
+    try:
+        cursor = connection.cursor(dictionary=True)
+        count = retention.convert_table(
+            cursor, datetime.now(), Config.GAME_ACTIONS_PARTITION_BY, Config.GAME_ACTIONS_PARTITIONS_AHEAD
+        )
+        cursor.close()
+        print(f"✅ Partitioned game_actions into {count} partitions")
+    except retention.RetentionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        connection.close()
+
+def rotate_game_actions(args):
+    """Add upcoming game_actions partitions, archive and drop expired ones"""
+    connection = get_connection()
+    try:
+        summary = retention.rotate(
+            connection, datetime.now(),
+            by=Config.GAME_ACTIONS_PARTITION_BY,
+            ahead=Config.GAME_ACTIONS_PARTITIONS_AHEAD,
+            retention=args.retention,
+            directory=Config.GAME_ACTIONS_ARCHIVE_DIR,
+            archive_format=Config.GAME_ACTIONS_ARCHIVE_FORMAT,
+            dry_run=args.dry_run
+        )
+    except retention.RetentionError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    finally:
+        connection.close()
+
+    if summary["added"]:
+        print(f"✅ Added {summary['added']} game_actions partitions")
+    for name, path, rows in summary["archived"]:
+        if args.dry_run:
+            print(f"Would archive and drop {name} ({rows} rows)")
+        else:
+            print(f"✅ Archived {name} ({rows} rows) to {path} and dropped it")
+    if not summary["archived"]:
+        print("✅ No expired game_actions partitions")
+
+GAME_ACTION_QUERY = """
+SELECT id, user_id, action, amount, payout, choice, LOWER(HEX(rng_stream)) AS rng_stream, rng_offset, timestamp
+FROM game_actions WHERE id = %s
+"""
+
+def replay_game(args):
+    """Recompute a logged game play from its outcome stream reference and compare"""
+    connection = get_connection()
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(GAME_ACTION_QUERY, (args.id,))
+        row = cursor.fetchone()
+        cursor.close()
+    finally:
+        connection.close()
+
+    if not row or row['action'] not in games.GAMES:
+        print(f"❌ No game play with id {args.id}")
+        sys.exit(1)
+    if row['rng_stream'] is None:
+        print(f"❌ Play {args.id} predates outcome streams and cannot be replayed")
+        sys.exit(1)
+
+    reference = f"{row['rng_stream']}:{row['rng_offset']}"
+    result = games.replay(row['action'], reference, row['amount'], row['choice'])
+    print(f"{row['action']} by {row['user_id']} at {row['timestamp']}: stake {row['amount']}, "
+          f"logged payout {row['payout']}, replayed {serializer.dumps_str(result)}")
+    if result['coins'] != row['payout']:
+        print("❌ Replayed payout does not match the log")
+        sys.exit(1)
+    print("✅ Outcome reproduced")
+
+LEGACY_AUDIT_CHUNK_QUERY = """
+SELECT id, timestamp, user_id, action, amount, result, verified
+FROM game_actions
+WHERE id > %s AND payout IS NULL
+ORDER BY id
+LIMIT %s
+"""
+
+# Upsert on the primary key so a whole chunk is rewritten by one multi-row statement
+MIGRATE_AUDIT_QUERY = """
+INSERT INTO game_actions (
+    id, timestamp, user_id, action, amount, payout, ton_coins, outcome, choice,
+    rng_stream, rng_offset, result, verified
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    payout = VALUES(payout),
+    ton_coins = VALUES(ton_coins),
+    outcome = VALUES(outcome),
+    choice = VALUES(choice),
+    rng_stream = VALUES(rng_stream),
+    rng_offset = VALUES(rng_offset),
+    result = VALUES(result)
+"""
+
+def migrate_audit_results(args):
+    """Move JSON game_actions.result blobs into the typed audit columns, chunk by chunk
+
+    Only rows with no payout yet are touched, so the job can be stopped and
+    rerun (or resumed with --start-id) at any point.
+    """
+    connection = get_connection()
+    migrated = 0
+    last_id = args.start_id
+    try:
+        cursor = connection.cursor(dictionary=True)
+        while True:
+            cursor.execute(LEGACY_AUDIT_CHUNK_QUERY, (last_id, args.chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            params = []
+            for row in rows:
+                try:
+                    result = serializer.loads(row['result']) if row['result'] else {}
+                except ValueError:
+                    result = {"legacy": row['result']}
+                if not isinstance(result, dict):
+                    result = {"legacy": result}
+                params.append(
+                    (row['id'], row['timestamp'], row['user_id'], row['action'], row['amount'])
+                    + encode_result(result) + (row['verified'],)
+                )
+            cursor.executemany(MIGRATE_AUDIT_QUERY, params)
+            connection.commit()
+
+            migrated += len(rows)
+            last_id = rows[-1]['id']
+            print(f"Migrated {migrated} rows (last id {last_id})")
+            if args.sleep:
+                time.sleep(args.sleep)
+        cursor.close()
+    finally:
+        connection.close()
+    print(f"✅ Migrated {migrated} game_actions rows to typed audit columns")
+
+def main():
+    parser = argparse.ArgumentParser(description="Keze Tap Game maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser(
+        "reconcile-referrals", help="Backfill referrals and repair users.referral_count"
+    ).set_defaults(func=reconcile_referrals)
+
+    rebuild = subparsers.add_parser(
+        "rebuild-rollups", help="Backfill admin stats buckets from game_actions"
+    )
+    rebuild.add_argument("--days", type=int, default=7, help="How many days back to rebuild")
+    rebuild.set_defaults(func=rebuild_rollups)
+
+    subparsers.add_parser(
+        "partition-game-actions", help="One-off: partition an existing game_actions table by timestamp"
+    ).set_defaults(func=partition_game_actions)
+
+    rotate = subparsers.add_parser(
+        "rotate-game-actions", help="Add future game_actions partitions, archive and drop expired ones (daily)"
+    )
+    rotate.add_argument("--retention", type=int, default=Config.GAME_ACTIONS_RETENTION,
+                        help="Partitions (months or days) to keep before archiving")
+    rotate.add_argument("--dry-run", action="store_true", help="Only list what would be archived")
+    rotate.set_defaults(func=rotate_game_actions)
+
+    migrate = subparsers.add_parser(
+        "migrate-audit-results", help="Rewrite historical game_actions JSON results into typed columns"
+    )
+    migrate.add_argument("--chunk-size", type=int, default=5000, help="Rows per statement")
+    migrate.add_argument("--start-id", type=int, default=0, help="Resume after this game_actions id")
+    migrate.add_argument("--sleep", type=float, default=0.0, help="Seconds to pause between chunks")
+    migrate.set_defaults(func=migrate_audit_results)
+
+    replay = subparsers.add_parser(
+        "replay-game", help="Reproduce a logged game play from its outcome stream reference"
+    )
+    replay.add_argument("id", type=int, help="game_actions id")
+    replay.set_defaults(func=replay_game)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except Error as e:
+        print(f"❌ Database error: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
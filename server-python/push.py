@@ -0,0 +1,135 @@
+"""
+Push channel for Keze Tap Game
+
+Write paths publish a user's changed columns here; every WebSocket open for
+that user in the ASGI server receives them and turns them into client events
+(coins, levelUp, energy ticks, rank). Without PUSH_BUS_URL delivery is limited
+to sockets in the publishing process. With a redis:// URL, events are also
+relayed over Redis pub/sub, so taps handled by Flask workers or bonuses paid
+by the Telegram bot reach sockets held by any ASGI worker.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+import serializer
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "keze:push"
+
+def encode(telegram_id, columns, origin):
+    """Bus message for one user's changed columns"""
+    return serializer.dumps({"id": telegram_id, "user": columns, "origin": origin})
+
+def decode(message):
+    data = serializer.loads(message)
+    columns = data["user"]
+    for key in ('last_energy_update', 'last_action_time'):
+        if isinstance(columns.get(key), str):
+            columns[key] = datetime.fromisoformat(columns[key])
+    return data["id"], columns, data.get("origin")
+
+class PushHub:
+    """Per-process fan-out of user updates to subscribed sockets"""
+
+    def __init__(self, bus_url=None, queue_size=64):
+        self._bus_url = bus_url
+        self._queue_size = queue_size
+        self._subscribers = {}
+        self._origin = f"{socket.gethostname()}-{os.getpid()}"
+        self._redis = None
+        self._task = None
+        self.dropped = 0
+
+    async def start(self):
+        if not self._bus_url:
+            return
+        import redis.asyncio as redis
+        self._redis = redis.Redis.from_url(self._bus_url)
+        self._task = asyncio.create_task(self._relay())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self._redis:
+            await self._redis.close()
+
+    def subscribe(self, telegram_id):
+        queue = asyncio.Queue(maxsize=self._queue_size)
+        self._subscribers.setdefault(telegram_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, telegram_id, queue):
+        queues = self._subscribers.get(telegram_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[telegram_id]
+
+    @property
+    def connections(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def _deliver(self, telegram_id, columns):
+        for queue in self._subscribers.get(telegram_id, ()):
+            if queue.full():
+                # A slow client only needs the latest state; drop the oldest update
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(columns)
+
+    def publish(self, telegram_id, columns):
+        """Send changed user columns to local sockets and, when configured, the bus"""
+        self._deliver(telegram_id, columns)
+        if self._redis:
+            asyncio.create_task(self._publish_bus(telegram_id, columns))
+
+    async def _publish_bus(self, telegram_id, columns):
+        try:
+            await self._redis.publish(CHANNEL, encode(telegram_id, columns, self._origin))
+        except Exception as e:
+            logger.error(f"Push bus publish failed: {e}")
+
+    async def _relay(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.subscribe(CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    telegram_id, columns, origin = decode(message["data"])
+                    if origin != self._origin:
+                        self._deliver(telegram_id, columns)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Push bus relay error, reconnecting: {e}")
+                await asyncio.sleep(1)
+
+class PushPublisher:
+    """Publishes user updates onto the bus from synchronous code (Flask, the bot)"""
+
+    def __init__(self, bus_url):
+        import redis
+        self._redis = redis.Redis.from_url(bus_url)
+        self._origin = f"{socket.gethostname()}-{os.getpid()}"
+
+    def publish(self, telegram_id, columns):
+        try:
+            self._redis.publish(CHANNEL, encode(telegram_id, columns, self._origin))
+        except Exception as e:
+            logger.error(f"Push bus publish failed: {e}")
+
+# Columns each write path publishes; sockets merge them into their copy of the user
+PUSH_COLUMNS = (
+    'coins', 'ton_coins', 'total_earnings', 'taps_count', 'level', 'experience',
+    'energy', 'last_energy_update'
+)
+
+def changed_columns(user):
+    """The push payload for a user row after a write"""
+    return {key: user[key] for key in PUSH_COLUMNS if key in user}
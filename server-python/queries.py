@@ -0,0 +1,250 @@
+"""
+SQL shared by the Flask API, the ASGI API and the Telegram bot
+"""
+
+from datetime import datetime
+import energy
+
+USER_BY_TELEGRAM_ID_QUERY = "SELECT * FROM users WHERE telegram_id = %s"
+
+# Columns each read path needs. "exists" is answered from the
+# idx_telegram_banned index alone; "full" is only used to echo a freshly
+# created user back to the client.
+USER_PROJECTIONS = {
+    'exists': ('telegram_id', 'banned'),
+    'tap': (
+        'telegram_id', 'banned', 'coins', 'total_earnings', 'taps_count', 'level',
+        'experience', 'energy', 'last_energy_update', 'last_action_time'
+    ),
+    'game': (
+        'telegram_id', 'banned', 'coins', 'ton_coins', 'total_earnings', 'level',
+        'spins_won', 'treasures_found', 'coins_flipped', 'total_staked'
+    ),
+    'profile': (
+        'telegram_id', 'coins', 'ton_coins', 'level', 'experience', 'energy',
+        'last_energy_update', 'taps_count', 'total_earnings', 'referral_count',
+        'spins_won', 'treasures_found', 'coins_flipped', 'total_staked'
+    ),
+    'bot': (
+        'telegram_id', 'username', 'first_name', 'last_name', 'referral_code', 'coins',
+        'ton_coins', 'level', 'taps_count', 'total_earnings', 'referral_count',
+        'daily_streak', 'spins_won', 'treasures_found', 'coins_flipped', 'total_staked'
+    )
+}
+
+USER_QUERIES = {
+    name: f"SELECT {', '.join(columns)} FROM users WHERE telegram_id = %s"
+    for name, columns in USER_PROJECTIONS.items()
+}
+USER_QUERIES['full'] = USER_BY_TELEGRAM_ID_QUERY
+
+# An upsert, so creation needs no existence check and concurrent creations
+# of one user (bot and WebApp) cannot fail on the unique key: the row count is
+# 1 when the row was inserted and 0 when it already existed, and lastrowid
+# is the row's id either way.
+CREATE_USER_QUERY = """
+INSERT INTO users (
+    telegram_id, username, first_name, last_name, coins, ton_coins, level,
+    experience, taps_count, energy, last_energy_update, referral_code,
+    referred_by, daily_streak, last_login_date, total_earnings,
+    spins_won, treasures_found, coins_flipped, total_staked, banned,
+    last_action_time, created_at, updated_at
+) VALUES (
+    %(telegram_id)s, %(username)s, %(first_name)s, %(last_name)s, %(coins)s,
+    %(ton_coins)s, %(level)s, %(experience)s, %(taps_count)s, %(energy)s,
+    %(last_energy_update)s, %(referral_code)s, %(referred_by)s, %(daily_streak)s,
+    %(last_login_date)s, %(total_earnings)s, %(spins_won)s, %(treasures_found)s,
+    %(coins_flipped)s, %(total_staked)s, %(banned)s, %(last_action_time)s,
+    %(created_at)s, %(updated_at)s
+)
+ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+"""
+
+# Coins for joining through a referral link, and for the referrer it names
+WELCOME_BONUS = 500
+REFERRAL_BONUS = 1000
+
+def signup_coins(referred, rewarded):
+    """Coins a signup adds to balances, as counted by the stats rollups"""
+    return (WELCOME_BONUS if referred else 0) + (REFERRAL_BONUS if rewarded else 0)
+
+def new_user_row(telegram_id, username=None, first_name=None, last_name=None, referred_by=None):
+    """Column values for a freshly registered user"""
+    now = datetime.now()
+    return {
+        'telegram_id': telegram_id,
+        'username': username,
+        'first_name': first_name,
+        'last_name': last_name,
+        'coins': WELCOME_BONUS if referred_by else 0,
+        'ton_coins': 0,
+        'level': 1,
+        'experience': 0,
+        'taps_count': 0,
+        'energy': energy.max_energy(1),
+        'last_energy_update': now,
+        'referral_code': str(telegram_id),
+        'referred_by': referred_by,
+        'daily_streak': 0,
+        'last_login_date': now,
+        'total_earnings': WELCOME_BONUS if referred_by else 0,
+        'spins_won': 0,
+        'treasures_found': 0,
+        'coins_flipped': 0,
+        'total_staked': 0,
+        'banned': False,
+        'last_action_time': now,
+        'created_at': now,
+        'updated_at': now
+    }
+
+def created_user_row(row, user_id):
+    """The full users row just inserted from new_user_row values, without reading it back"""
+    return dict(row, id=user_id, referral_count=0)
+
+NEW_USER_COLUMNS = tuple(new_user_row(0))
+
+# Bulk /start provisioning (signup_batch.py). Duplicates are left untouched
+# and affect no rows, so the row count says whether every row was inserted.
+CREATE_USERS_QUERY = (
+    f"INSERT INTO users ({', '.join(NEW_USER_COLUMNS)}) VALUES {{}}\n"
+    "ON DUPLICATE KEY UPDATE telegram_id = telegram_id"
+)
+
+USERS_BY_TELEGRAM_IDS_QUERY = (
+    f"SELECT {', '.join(USER_PROJECTIONS['bot'])} FROM users WHERE telegram_id IN ({{}})"
+)
+
+# One row per referrer: (telegram_id, referrals) pairs, then updated_at
+REFERRAL_BONUSES_QUERY = f"""
+UPDATE users u
+JOIN ({{}}) r ON r.telegram_id = u.telegram_id
+SET
+    u.coins = u.coins + {REFERRAL_BONUS} * r.referrals,
+    u.total_earnings = u.total_earnings + {REFERRAL_BONUS} * r.referrals,
+    u.referral_count = u.referral_count + r.referrals,
+    u.updated_at = %s
+"""
+
+# referrals is keyed by the invited user, so each referral is recorded, and
+# its bonus credited, at most once; the row count says whether this call won
+RECORD_REFERRAL_QUERY = """
+INSERT INTO referrals (referred_id, referrer_id, created_at)
+VALUES (%s, %s, %s)
+ON DUPLICATE KEY UPDATE referred_id = referred_id
+"""
+
+RECORD_REFERRALS_QUERY = """
+INSERT INTO referrals (referred_id, referrer_id, created_at)
+VALUES {}
+ON DUPLICATE KEY UPDATE referred_id = referred_id
+"""
+
+REFERRAL_BONUS_QUERY = f"""
+UPDATE users SET
+    coins = coins + {REFERRAL_BONUS},
+    total_earnings = total_earnings + {REFERRAL_BONUS},
+    referral_count = referral_count + 1,
+    updated_at = %s
+WHERE telegram_id = %s
+"""
+
+LOG_GAME_ACTION_QUERY = """
+INSERT INTO game_actions (
+    user_id, action, amount, payout, ton_coins, outcome, choice, rng_stream, rng_offset,
+    result, timestamp, verified
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Energy regen (see energy.py), the energy check, the coin/XP credit and the
+# level-up all happen in this one statement. MySQL evaluates single-table SET
+# assignments left to right and later assignments see the new values of
+# earlier ones, so the order matters: coins are credited before level changes,
+# energy is regenerated before last_energy_update moves, and experience is
+# reset to 0 only on level-up (a tap always adds at least 1 XP) which the
+# level assignment then keys off. The tapping-too-fast gate is checked before
+# this runs (rate_limit.py), so the row is only read for the energy check.
+TAP_UPDATE_QUERY = f"""
+UPDATE users SET
+    coins = coins + %(taps)s * (FLOOR(level / 3) + 1),
+    total_earnings = total_earnings + %(taps)s * (FLOOR(level / 3) + 1),
+    taps_count = taps_count + %(taps)s,
+    energy = {energy.current_energy_sql("%(now)s")} - %(taps)s,
+    last_energy_update = %(now)s,
+    last_action_time = %(now)s,
+    updated_at = %(now)s,
+    experience = experience + %(taps)s,
+    energy = IF(experience >= level * 1000, {energy.max_energy_sql("level + 1")}, energy),
+    experience = IF(experience >= level * 1000, 0, experience),
+    level = IF(experience = 0, level + 1, level)
+WHERE telegram_id = %(telegram_id)s
+    AND banned = FALSE
+    AND {energy.current_energy_sql("%(now)s")} >= %(taps)s
+"""
+
+TAP_RESULT_QUERY = """
+SELECT coins, total_earnings, level, experience, energy, last_energy_update,
+    last_action_time, taps_count, banned
+FROM users WHERE telegram_id = %s
+"""
+
+# /api/tap/batch replays the journal in Python under this row lock and writes
+# the resulting state back in one UPDATE
+TAP_BATCH_LOCK_QUERY = """
+SELECT telegram_id, banned, coins, total_earnings, taps_count, level, experience,
+    energy, last_energy_update, last_action_time
+FROM users WHERE telegram_id = %s FOR UPDATE
+"""
+
+TAP_BATCH_UPDATE_QUERY = """
+UPDATE users SET
+    coins = %(coins)s,
+    total_earnings = %(total_earnings)s,
+    taps_count = %(taps_count)s,
+    level = %(level)s,
+    experience = %(experience)s,
+    energy = %(energy)s,
+    last_energy_update = %(last_energy_update)s,
+    last_action_time = %(last_action_time)s,
+    updated_at = %(updated_at)s
+WHERE telegram_id = %(telegram_id)s
+"""
+
+# Debits the stake, credits the payout, TON coins and win counter of one play
+# (parameters from games.settlement). The balance check is part of the WHERE,
+# so concurrent plays serialize on the row lock and a play that would
+# overdraw matches no row instead of going through.
+GAME_SETTLE_QUERY = """
+UPDATE users SET
+    coins = coins - %(stake)s + %(payout)s,
+    ton_coins = ton_coins + %(ton_coins)s,
+    total_staked = total_staked + %(stake)s,
+    total_earnings = total_earnings + %(earnings)s,
+    spins_won = spins_won + %(spins_won)s,
+    treasures_found = treasures_found + %(treasures_found)s,
+    coins_flipped = coins_flipped + %(coins_flipped)s,
+    updated_at = %(now)s
+WHERE telegram_id = %(telegram_id)s
+    AND banned = FALSE
+    AND coins >= %(stake)s
+"""
+
+# Position for push rank updates: a range count on idx_total_earnings
+RANK_QUERY = "SELECT COUNT(*) AS ahead FROM users WHERE banned = FALSE AND total_earnings > %s"
+
+# Rank for users below the leaderboard window
+USER_RANK_QUERY = """
+SELECT u.total_earnings,
+       (SELECT COUNT(*) FROM users WHERE banned = FALSE AND total_earnings > u.total_earnings) AS ahead,
+       (SELECT COUNT(*) FROM users WHERE banned = FALSE) AS players
+FROM users u
+WHERE u.telegram_id = %s AND u.banned = FALSE
+"""
+
+LEADERBOARD_QUERY = """
+SELECT first_name, username, total_earnings, level
+FROM users
+WHERE banned = FALSE
+ORDER BY total_earnings DESC
+LIMIT %s OFFSET %s
+"""
@@ -0,0 +1,167 @@
+"""
+Per-player token buckets for Keze Tap Game
+
+The tap gate ("tapping too fast") is a token bucket per Telegram ID. It holds
+TAP_GATE_BURST tokens and refills one every MIN_TAP_INTERVAL seconds, so with
+the default burst of 1 it is exactly the old 100 ms last_action_time check,
+without reading the users row. Buckets live in the RATELIMIT_STORAGE_URL
+store: redis:// shares them between every worker and node (refilled
+atomically by a Lua script on the Redis clock), memory:// keeps them in the
+process, which is enough for a single worker and for tests.
+"""
+
+import math
+import threading
+import time
+
+# KEYS[1] bucket; ARGV rate (tokens/s), capacity, cost. Returns 1 when taken.
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or capacity
+local at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+local taken = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    taken = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return taken
+"""
+
+# Per-player limit on each action route (tap, tap batch, games): ACTION_LIMIT per ACTION_PERIOD seconds
+ACTION_LIMIT = 30
+ACTION_PERIOD = 60
+ACTION_ROUTES = 3
+
+def action_ceiling(window):
+    """Most audited actions the action limits let one player make in `window` seconds
+
+    Every route has its own quota under Flask-Limiter, and a quota can be spent
+    back to back at the edge of each period (a fixed window rolling over, or a
+    full bucket), so a window can hold one period's quota more than it spans.
+    """
+    return ACTION_ROUTES * ACTION_LIMIT * (math.ceil(window / ACTION_PERIOD) + 1)
+
+def _refill_ms(rate, capacity):
+    """Time for an empty bucket to fill; a bucket untouched that long can be forgotten"""
+    return math.ceil(capacity / rate * 1000) + 1000
+
+class MemoryBucketStore:
+    """Buckets in this process only"""
+
+    shared = False
+
+    def __init__(self, max_entries=100000):
+        self._max_entries = max_entries
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, capacity, cost):
+        now = time.monotonic()
+        with self._lock:
+            tokens, at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - at) * rate)
+            taken = tokens >= cost
+            if taken:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_entries:
+                self._prune(now, rate, capacity)
+        return taken
+
+    async def take_async(self, key, rate, capacity, cost):
+        return self.take(key, rate, capacity, cost)
+
+    def _prune(self, now, rate, capacity):
+        # Buckets that have refilled are indistinguishable from new ones
+        idle = _refill_ms(rate, capacity) / 1000
+        for key in [key for key, (_, at) in self._buckets.items() if now - at > idle]:
+            del self._buckets[key]
+
+    def size(self):
+        return len(self._buckets)
+
+class RedisBucketStore:
+    """Buckets shared through Redis"""
+
+    shared = True
+
+    def __init__(self, url):
+        self._url = url
+        self._take = None
+        self._take_async = None
+
+    def take(self, key, rate, capacity, cost):
+        if self._take is None:
+            import redis
+            self._take = redis.Redis.from_url(self._url).register_script(TAKE_SCRIPT)
+        return self._take(keys=[key], args=[rate, capacity, cost]) == 1
+
+    async def take_async(self, key, rate, capacity, cost):
+        if self._take_async is None:
+            import redis.asyncio as redis
+            self._take_async = redis.Redis.from_url(self._url).register_script(TAKE_SCRIPT)
+        return await self._take_async(keys=[key], args=[rate, capacity, cost]) == 1
+
+    def size(self):
+        return None
+
+class TokenBucket:
+    """A named family of per-key buckets sharing one rate and capacity"""
+
+    def __init__(self, store, name, interval, capacity=1):
+        self.store = store
+        self.rate = 1 / interval
+        self.capacity = capacity
+        self._prefix = f"keze:bucket:{name}:"
+        self.rejected = 0
+
+    def allow(self, key, cost=1):
+        """Take cost tokens from key's bucket; False when there are not enough"""
+        allowed = self.store.take(self._prefix + str(key), self.rate, self.capacity, cost)
+        if not allowed:
+            self.rejected += 1
+        return allowed
+
+    async def allow_async(self, key, cost=1):
+        allowed = await self.store.take_async(self._prefix + str(key), self.rate, self.capacity, cost)
+        if not allowed:
+            self.rejected += 1
+        return allowed
+
+    def stats(self):
+        return {
+            "store": type(self.store).__name__,
+            "rejected": self.rejected,
+            "size": self.store.size()
+        }
+
+def create_bucket_store(url):
+    """Bucket store for a RATELIMIT_STORAGE_URL-style URL"""
+    if not url or url.startswith('memory://'):
+        return MemoryBucketStore()
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBucketStore(url)
+    raise ValueError(f"Unsupported bucket store: {url}")
+
+def create_tap_gate(url, interval, burst=1):
+    """The per-player "tapping too fast" bucket"""
+    return TokenBucket(create_bucket_store(url), "tap", interval, burst)
+
+def create_request_limits(url):
+    """Buckets matching the Flask app's limiter for servers without Flask-Limiter
+
+    "action" is the ACTION_LIMIT per ACTION_PERIOD on tap and game routes,
+    "request" the 100 per 15 minutes default; each allows its whole quota as
+    a burst.
+    """
+    store = create_bucket_store(url)
+    action = TokenBucket(store, "action", ACTION_PERIOD / ACTION_LIMIT, ACTION_LIMIT)
+    return action, TokenBucket(store, "request", 15 * 60 / 100, 100)
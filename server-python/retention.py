@@ -0,0 +1,272 @@
+"""
+game_actions partitioning, retention and archival for Keze Tap Game
+
+game_actions is RANGE COLUMNS partitioned on timestamp, one partition per
+month (or per day, GAME_ACTIONS_PARTITION_BY) plus a pmax catch-all. Inserts
+only ever touch the newest partition and its indexes, and old history leaves
+by dropping whole partitions instead of DELETE. `manage.py rotate-game-actions`,
+run daily from cron:
+
+  1. splits pmax so the next GAME_ACTIONS_PARTITIONS_AHEAD periods exist,
+  2. streams every partition older than GAME_ACTIONS_RETENTION periods, in id
+     order, to a file in GAME_ACTIONS_ARCHIVE_DIR (Parquet with zstd when
+     pyarrow is installed, gzip CSV otherwise),
+  3. drops each partition once its archive holds every row.
+
+An existing unpartitioned table is converted once with
+`manage.py partition-game-actions`.
+"""
+
+import csv
+import gzip
+import os
+from datetime import datetime, timedelta
+
+TABLE = "game_actions"
+
+# Columns exported by the archiver, in file order
+ARCHIVE_COLUMNS = (
+    'id', 'user_id', 'action', 'amount', 'payout', 'ton_coins', 'outcome', 'choice',
+    'rng_stream', 'rng_offset', 'result', 'timestamp', 'verified'
+)
+
+# MySQL requires the partitioning column in every unique key, hence (id, timestamp)
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS game_actions (
+    id INT AUTO_INCREMENT,
+    user_id BIGINT NOT NULL,
+    action VARCHAR(50) NOT NULL,
+    amount INT NOT NULL,
+    payout BIGINT DEFAULT NULL,
+    ton_coins INT NOT NULL DEFAULT 0,
+    outcome TINYINT UNSIGNED DEFAULT NULL,
+    choice ENUM('heads', 'tails') DEFAULT NULL,
+    rng_stream BINARY(8) DEFAULT NULL,
+    rng_offset INT UNSIGNED DEFAULT NULL,
+    result TEXT,
+    timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    verified BOOLEAN DEFAULT TRUE,
+    PRIMARY KEY (id, timestamp),
+    INDEX idx_user_id (user_id),
+    INDEX idx_timestamp (timestamp),
+    INDEX idx_action (action)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+PARTITION BY RANGE COLUMNS(timestamp) ({partitions})
+"""
+
+CONVERT_TABLE_SQL = """
+ALTER TABLE game_actions
+    MODIFY timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (id, timestamp)
+PARTITION BY RANGE COLUMNS(timestamp) ({partitions})
+"""
+
+PARTITIONS_QUERY = """
+SELECT partition_name AS name, partition_description AS bound
+FROM information_schema.partitions
+WHERE table_schema = DATABASE() AND table_name = %s
+ORDER BY partition_ordinal_position
+"""
+
+ARCHIVE_CHUNK_QUERY = """
+SELECT id, user_id, action, amount, payout, ton_coins, outcome, choice,
+    LOWER(HEX(rng_stream)) AS rng_stream, rng_offset, result, timestamp, verified
+FROM game_actions PARTITION ({partition})
+WHERE id > %s
+ORDER BY id
+LIMIT %s
+"""
+
+class RetentionError(Exception):
+    """The table is not in a state the retention job can work on"""
+
+# Periods
+
+def period_start(moment, by):
+    if by == 'day':
+        return datetime(moment.year, moment.month, moment.day)
+    return datetime(moment.year, moment.month, 1)
+
+def add_periods(start, by, count):
+    if by == 'day':
+        return start + timedelta(days=count)
+    months = start.year * 12 + start.month - 1 + count
+    return datetime(months // 12, months % 12 + 1, 1)
+
+def partition_name(start, by):
+    return start.strftime('p%Y%m%d' if by == 'day' else 'p%Y%m')
+
+def partition_clauses(first, last, by):
+    """Partition definitions for every period from first up to, not including, last, then pmax"""
+    clauses = []
+    start = first
+    while start < last:
+        upper = add_periods(start, by, 1)
+        clauses.append(f"PARTITION {partition_name(start, by)} VALUES LESS THAN ('{upper:%Y-%m-%d %H:%M:%S}')")
+        start = upper
+    clauses.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    return ", ".join(clauses)
+
+def create_table_sql(now, by, ahead):
+    """CREATE TABLE for a fresh database, partitioned from the current period on"""
+    first = period_start(now, by)
+    return CREATE_TABLE_SQL.format(partitions=partition_clauses(first, add_periods(first, by, ahead + 1), by))
+
+# Partition bookkeeping
+
+def list_partitions(cursor):
+    """[(name, upper bound datetime or None for MAXVALUE)]; empty when the table is not partitioned"""
+    cursor.execute(PARTITIONS_QUERY, (TABLE,))
+    partitions = []
+    for row in cursor.fetchall():
+        if row['name'] is None:
+            return []
+        bound = row['bound'].strip("'")
+        partitions.append((row['name'], None if bound == 'MAXVALUE' else datetime.fromisoformat(bound)))
+    return partitions
+
+def convert_table(cursor, now, by, ahead):
+    """Partition an existing game_actions table in place (rebuilds it once)"""
+    if list_partitions(cursor):
+        raise RetentionError("game_actions is already partitioned")
+    cursor.execute(f"SELECT MIN(timestamp) AS oldest FROM {TABLE}")
+    oldest = cursor.fetchone()['oldest'] or now
+    last = add_periods(period_start(now, by), by, ahead + 1)
+    clauses = partition_clauses(period_start(oldest, by), last, by)
+    cursor.execute(CONVERT_TABLE_SQL.format(partitions=clauses))
+    return clauses.count("PARTITION ")
+
+def ensure_future_partitions(cursor, now, by, ahead):
+    """Split pmax so partitions exist through `ahead` periods from now; returns how many were added"""
+    partitions = list_partitions(cursor)
+    if not partitions:
+        raise RetentionError("game_actions is not partitioned; run manage.py partition-game-actions")
+
+    bounds = [bound for _, bound in partitions if bound is not None]
+    first = max(bounds) if bounds else period_start(now, by)
+    last = add_periods(period_start(now, by), by, ahead + 1)
+    if first >= last:
+        return 0
+
+    clauses = partition_clauses(first, last, by)
+    cursor.execute(f"ALTER TABLE {TABLE} REORGANIZE PARTITION pmax INTO ({clauses})")
+    return clauses.count("PARTITION ") - 1
+
+def expired_partitions(cursor, now, by, retention):
+    """Partitions whose rows are all older than `retention` periods before the current one"""
+    cutoff = add_periods(period_start(now, by), by, -retention)
+    return [name for name, bound in list_partitions(cursor) if bound is not None and bound <= cutoff]
+
+def drop_partition(cursor, name):
+    cursor.execute(f"ALTER TABLE {TABLE} DROP PARTITION {name}")
+
+# Archival
+
+class ParquetArchive:
+    """Columnar archive, one row group per streamed chunk"""
+
+    suffix = '.parquet'
+
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self._pyarrow = pyarrow
+        self._schema = pyarrow.schema([
+            ('id', pyarrow.int64()), ('user_id', pyarrow.int64()), ('action', pyarrow.string()),
+            ('amount', pyarrow.int64()), ('payout', pyarrow.int64()), ('ton_coins', pyarrow.int32()),
+            ('outcome', pyarrow.uint8()), ('choice', pyarrow.string()),
+            ('rng_stream', pyarrow.string()), ('rng_offset', pyarrow.uint32()), ('result', pyarrow.string()),
+            ('timestamp', pyarrow.timestamp('us')), ('verified', pyarrow.bool_())
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression='zstd')
+
+    def write(self, rows):
+        self._writer.write_table(self._pyarrow.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+class CsvArchive:
+    """gzip CSV fallback when pyarrow is not installed"""
+
+    suffix = '.csv.gz'
+
+    def __init__(self, path):
+        self._file = gzip.open(path, 'wt', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=ARCHIVE_COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+def archive_class(archive_format):
+    if archive_format in ('auto', 'parquet'):
+        try:
+            import pyarrow.parquet
+            return ParquetArchive
+        except ImportError:
+            if archive_format == 'parquet':
+                raise
+    return CsvArchive
+
+def archive_partition(connection, name, directory, archive_format='auto', chunk_size=10000):
+    """Stream one partition to an archive file; returns (path, rows written)
+
+    The file is written under a temporary name and renamed when complete, so
+    a file with the final name always holds the whole partition.
+    """
+    archive = archive_class(archive_format)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{TABLE}-{name}{archive.suffix}")
+    partial = path + ".partial"
+
+    writer = archive(partial)
+    written = 0
+    last_id = 0
+    cursor = connection.cursor(dictionary=True)
+    try:
+        query = ARCHIVE_CHUNK_QUERY.format(partition=name)
+        while True:
+            cursor.execute(query, (last_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            writer.write(rows)
+            written += len(rows)
+            last_id = rows[-1]['id']
+    finally:
+        cursor.close()
+        writer.close()
+
+    os.replace(partial, path)
+    return path, written
+
+def partition_row_count(cursor, name):
+    cursor.execute(f"SELECT COUNT(*) AS count FROM {TABLE} PARTITION ({name})")
+    return cursor.fetchone()['count']
+
+def rotate(connection, now, by, ahead, retention, directory, archive_format='auto', dry_run=False):
+    """Add future partitions, then archive and drop expired ones; returns a summary dict"""
+    cursor = connection.cursor(dictionary=True)
+    summary = {"added": 0, "archived": []}
+    try:
+        if not dry_run:
+            summary["added"] = ensure_future_partitions(cursor, now, by, ahead)
+        for name in expired_partitions(cursor, now, by, retention):
+            if dry_run:
+                summary["archived"].append((name, None, partition_row_count(cursor, name)))
+                continue
+            path, written = archive_partition(connection, name, directory, archive_format)
+            # Rows can only land in an expired partition through a backdated
+            # insert; if one raced the export, keep the partition for the next run
+            if written != partition_row_count(cursor, name):
+                raise RetentionError(f"{name} changed while archiving; not dropped")
+            drop_partition(cursor, name)
+            summary["archived"].append((name, path, written))
+    finally:
+        cursor.close()
+    return summary
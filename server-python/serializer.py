@@ -0,0 +1,51 @@
+"""
+JSON encoding for Keze Tap Game API responses and audit-log blobs
+
+Uses orjson when it is installed (JSON_ENCODER=auto, the default, or orjson)
+and the standard library otherwise. Both write datetimes as ISO 8601 strings
+and accept UserState values, so raw user rows can be returned as-is.
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from config import Config
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if hasattr(value, 'as_dict'):
+        return value.as_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+orjson = None
+if Config.JSON_ENCODER in ('auto', 'orjson'):
+    try:
+        import orjson
+    except ImportError:
+        if Config.JSON_ENCODER == 'orjson':
+            raise
+
+if orjson:
+    BACKEND = 'orjson'
+
+    def dumps(obj):
+        """Encode to UTF-8 JSON bytes"""
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    BACKEND = 'json'
+    _encoder = json.JSONEncoder(default=_default, separators=(',', ':'), ensure_ascii=False)
+
+    def dumps(obj):
+        """Encode to UTF-8 JSON bytes"""
+        return _encoder.encode(obj).encode('utf-8')
+
+    loads = json.loads
+
+def dumps_str(obj):
+    """Encode to a JSON string (for TEXT/JSON columns)"""
+    return dumps(obj).decode('utf-8')
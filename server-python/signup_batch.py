@@ -0,0 +1,167 @@
+"""
+Bulk /start provisioning for the Keze Tap Game bot
+
+A channel promo sends thousands of /start commands within seconds, and one
+at a time each costs a user lookup, a referrer lookup, the referrer bonus,
+the insert and a read back. SignupBatcher collects the /start calls that
+arrive within BOT_SIGNUP_WINDOW (up to BOT_SIGNUP_BATCH of them) and
+provisions them together in one transaction:
+
+  1. one SELECT for every user and referrer in the batch,
+  2. one multi-row INSERT ... ON DUPLICATE KEY for the new users,
+  3. one multi-row INSERT into referrals and one grouped UPDATE crediting
+     each referrer for all its referrals,
+
+plus a per-user UPDATE only for returning users whose names changed. The new
+users are answered from the rows just inserted, without reading them back.
+
+If a user in the batch was created elsewhere between the SELECT and the
+INSERT, or one of its referrals is already recorded, an insert row count
+comes up short; provision() then raises SignupRace, the transaction rolls
+back and the caller registers that batch one user at a time, where the
+same upsert and referrals key decide each case.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+from user_state import UserState
+import queries
+
+logger = logging.getLogger(__name__)
+
+NAME_COLUMNS = ('username', 'first_name', 'last_name')
+
+class SignupRace(Exception):
+    """A user in the batch already existed by the time it was inserted"""
+
+def placeholders(count, width=1):
+    row = "%s" if width == 1 else f"({', '.join(['%s'] * width)})"
+    return ", ".join([row] * count)
+
+def referrer_id(user_id, referral_code):
+    """The Telegram ID a referral code points at, or None"""
+    if not referral_code or referral_code == str(user_id):
+        return None
+    try:
+        return int(referral_code)
+    except (ValueError, TypeError):
+        logger.warning(f"Invalid referral code: {referral_code}")
+        return None
+
+def provision(cursor, requests):
+    """Register a batch of (telegram user, referral code) pairs on a transaction's dict cursor
+
+    Returns one (user, rewarded_referrer_id, change) per request, in order,
+    where change is "created", "updated" (names refreshed) or None.
+    A user appearing twice in the batch is created once and only its first
+    referral code counts.
+    """
+    referrers = [referrer_id(user.id, referral_code) for user, referral_code in requests]
+    ids = {user.id for user, _ in requests} | {ref for ref in referrers if ref is not None}
+    cursor.execute(queries.USERS_BY_TELEGRAM_IDS_QUERY.format(placeholders(len(ids))), tuple(ids))
+    existing = {row['telegram_id']: row for row in cursor.fetchall()}
+
+    now = datetime.now()
+    results = []
+    new_rows = {}
+    referrals = Counter()
+    for (user, _), referrer in zip(requests, referrers):
+        if user.id in existing:
+            row = existing[user.id]
+            updates = {column: getattr(user, column) for column in NAME_COLUMNS if row.get(column) != getattr(user, column)}
+            if updates:
+                set_clause = ", ".join(f"{column} = %s" for column in updates)
+                cursor.execute(f"UPDATE users SET {set_clause} WHERE telegram_id = %s", (*updates.values(), user.id))
+                row.update(updates)
+            results.append((UserState.from_mapping(row), None, "updated" if updates else None))
+            continue
+        if user.id in new_rows:
+            results.append((UserState.from_mapping(new_rows[user.id]), None, None))
+            continue
+
+        # Only referrers that existed before this batch earn a bonus
+        referred_by = referrer if referrer in existing else None
+        row = queries.new_user_row(user.id, user.username, user.first_name, user.last_name, referred_by)
+        row['created_at'] = row['updated_at'] = now
+        row['referral_count'] = 0
+        new_rows[user.id] = row
+        if referred_by:
+            referrals[referred_by] += 1
+        results.append((UserState.from_mapping(row), referred_by, "created"))
+
+    if new_rows:
+        params = [row[column] for row in new_rows.values() for column in queries.NEW_USER_COLUMNS]
+        cursor.execute(
+            queries.CREATE_USERS_QUERY.format(placeholders(len(new_rows), len(queries.NEW_USER_COLUMNS))), params
+        )
+        if cursor.rowcount != len(new_rows):
+            raise SignupRace(f"{len(new_rows) - cursor.rowcount} of {len(new_rows)} users already existed")
+
+    referred = [(row['telegram_id'], row['referred_by'], now) for row in new_rows.values() if row['referred_by']]
+    if referred:
+        cursor.execute(
+            queries.RECORD_REFERRALS_QUERY.format(placeholders(len(referred), 3)),
+            [value for referral in referred for value in referral]
+        )
+        if cursor.rowcount != len(referred):
+            raise SignupRace(f"{len(referred) - cursor.rowcount} of {len(referred)} referrals already recorded")
+
+    if referrals:
+        derived = " UNION ALL ".join(["SELECT %s AS telegram_id, %s AS referrals"] * len(referrals))
+        params = [value for item in referrals.items() for value in item] + [now]
+        cursor.execute(queries.REFERRAL_BONUSES_QUERY.format(derived), params)
+
+    return results
+
+class SignupBatcher:
+    """Coalesces concurrent /start registrations into provisioning batches"""
+
+    def __init__(self, run, register_batch, window=0.02, max_batch=200):
+        # register_batch takes a list of requests and returns one result per
+        # request; it is blocking and runs through `run` (the bot's run_db)
+        self._run = run
+        self._register_batch = register_batch
+        self._window = window
+        self._max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._flushing = set()
+        self.batches = 0
+        self.registered = 0
+
+    async def register(self, user, referral_code=None):
+        """Queue one /start registration and wait for its batch"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((user, referral_code), future))
+        if len(self._pending) >= self._max_batch:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._window, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._flush(batch))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, batch):
+        try:
+            results = await self._run(self._register_batch, [request for request, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.registered += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
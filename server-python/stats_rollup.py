@@ -0,0 +1,187 @@
+"""
+Incremental admin statistics for Keze Tap Game
+
+Write paths record taps, coins, games and signups into in-memory counters
+that a background thread folds into two tables: stats_totals (a single row
+of running totals) and stats_buckets (hourly and daily time buckets). A
+reconciler periodically recomputes the totals, and the active-user count,
+from users in one pass; only one process wins each reconcile slot.
+"""
+
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('taps', 'coins_earned', 'games', 'new_users')
+GRANULARITIES = ('hour', 'day')
+
+BUCKET_UPSERT_QUERY = """
+INSERT INTO stats_buckets (granularity, bucket_start, taps, coins_earned, games, new_users)
+VALUES {}
+ON DUPLICATE KEY UPDATE
+    taps = taps + VALUES(taps),
+    coins_earned = coins_earned + VALUES(coins_earned),
+    games = games + VALUES(games),
+    new_users = new_users + VALUES(new_users)
+"""
+
+TOTALS_UPDATE_QUERY = """
+UPDATE stats_totals SET
+    total_taps = total_taps + %s,
+    total_coins = total_coins + %s,
+    total_users = total_users + %s
+WHERE id = 1
+"""
+
+CLAIM_RECONCILE_QUERY = """
+UPDATE stats_totals SET reconciled_at = %s
+WHERE id = 1 AND reconciled_at < %s
+"""
+
+RECONCILE_QUERY = """
+UPDATE stats_totals t
+JOIN (
+    SELECT
+        COUNT(*) AS total_users,
+        COALESCE(SUM(total_earnings), 0) AS total_coins,
+        COALESCE(SUM(taps_count), 0) AS total_taps,
+        COALESCE(SUM(last_action_time >= %s), 0) AS active_users
+    FROM users
+) u
+SET
+    t.total_users = u.total_users,
+    t.total_coins = u.total_coins,
+    t.total_taps = u.total_taps,
+    t.active_users = u.active_users
+WHERE t.id = 1
+"""
+
+TOTALS_QUERY = "SELECT total_users, active_users, total_coins, total_taps, reconciled_at FROM stats_totals WHERE id = 1"
+
+SERIES_QUERY = """
+SELECT bucket_start, taps, coins_earned, games, new_users
+FROM stats_buckets
+WHERE granularity = %s AND bucket_start >= %s AND bucket_start < %s
+ORDER BY bucket_start
+"""
+
+def bucket_start(moment, granularity):
+    """Start of the hour or day containing moment"""
+    if granularity == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+class StatsRollup:
+    """Accumulates counters in memory and flushes them into the rollup tables"""
+
+    def __init__(self, execute, transaction, flush_interval=5.0, reconcile_interval=300.0):
+        self._execute = execute
+        self._transaction = transaction
+        self._flush_interval = flush_interval
+        self._reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Make sure the totals row exists and start the flush/reconcile thread"""
+        self._execute(
+            "INSERT IGNORE INTO stats_totals (id, reconciled_at) VALUES (1, %s)",
+            (datetime(1970, 1, 1),)
+        )
+        self._thread = threading.Thread(target=self._run, name="stats-rollup", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout=self._flush_interval * 2)
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.wait(self._flush_interval):
+            try:
+                self.flush()
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Stats rollup error: {e}")
+
+    def record(self, taps=0, coins_earned=0, games=0, new_users=0):
+        """Count activity from a write path; never touches the database"""
+        hour = bucket_start(datetime.now(), 'hour')
+        with self._lock:
+            counters = self._pending.get(hour)
+            if counters is None:
+                counters = self._pending[hour] = [0, 0, 0, 0]
+            counters[0] += taps
+            counters[1] += coins_earned
+            counters[2] += games
+            counters[3] += new_users
+
+    def flush(self):
+        """Fold pending counters into the bucket and totals tables"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        buckets = {}
+        for hour, counters in pending.items():
+            for key in (('hour', hour), ('day', bucket_start(hour, 'day'))):
+                totals = buckets.setdefault(key, [0, 0, 0, 0])
+                for i, value in enumerate(counters):
+                    totals[i] += value
+
+        rows = []
+        params = []
+        for (granularity, start), counters in buckets.items():
+            rows.append("(%s, %s, %s, %s, %s, %s)")
+            params.extend([granularity, start] + counters)
+
+        taps = sum(counters[0] for counters in pending.values())
+        coins_earned = sum(counters[1] for counters in pending.values())
+        new_users = sum(counters[3] for counters in pending.values())
+
+        # Buckets and totals commit together, so a retry can never count either twice
+        try:
+            with self._transaction() as cursor:
+                cursor.execute(BUCKET_UPSERT_QUERY.format(", ".join(rows)), tuple(params))
+                cursor.execute(TOTALS_UPDATE_QUERY, (taps, coins_earned, new_users))
+        except Exception as e:
+            logger.error(f"Stats rollup flush failed, keeping counters for the next attempt: {e}")
+            with self._lock:
+                for hour, counters in pending.items():
+                    current = self._pending.setdefault(hour, [0, 0, 0, 0])
+                    for i, value in enumerate(counters):
+                        current[i] += value
+
+    def reconcile(self, force=False):
+        """Recompute totals from users if no process has done so recently"""
+        now = datetime.now()
+        cutoff = now if force else now - timedelta(seconds=self._reconcile_interval)
+        claimed = self._execute(CLAIM_RECONCILE_QUERY, (now, cutoff))
+        if not claimed:
+            return False
+        self._execute(RECONCILE_QUERY, (now - timedelta(days=1),))
+        return True
+
+    def totals(self):
+        """Current running totals, or None before the first reconcile"""
+        result = self._execute(TOTALS_QUERY, (), fetch=True)
+        if not result or result[0]['reconciled_at'] <= datetime(1970, 1, 1):
+            return None
+        return result[0]
+
+    def series(self, granularity, since, until):
+        """Bucketed activity between since and until"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of {GRANULARITIES}")
+        rows = self._execute(SERIES_QUERY, (granularity, bucket_start(since, granularity), until), fetch=True)
+        return rows or []
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Game settlement concurrency check
+Hammers one throwaway user with concurrent plays straight against MySQL and
+checks the books afterwards: the balance never goes negative, every accepted
+play is reflected exactly once (coins, total_staked, win counters) and no
+play beyond what the balance covered got through.
+
+--mode legacy replays the old read-check-then-update sequence for comparison;
+it is expected to overdraw under enough concurrency.
+
+    python stress_settle.py --threads 32 --plays 500 --balance 1000 --stake 100
+"""
+
+import argparse
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from config import Config
+from db import create_database
+import games
+import queries
+
+LEGACY_SETTLE_QUERY = "UPDATE users SET coins = coins + %s, total_staked = total_staked + %s WHERE telegram_id = %s"
+
+def reset_user(database, telegram_id, balance):
+    database.execute("DELETE FROM users WHERE telegram_id = %s", (telegram_id,))
+    row = queries.new_user_row(telegram_id, first_name="Settlement check")
+    row.update(coins=balance, total_earnings=balance)
+    database.execute(queries.CREATE_USER_QUERY, row)
+
+def play_guarded(database, telegram_id, action, stake, result):
+    params = games.settlement(telegram_id, action, stake, result, datetime.now())
+    with database.transaction(prepared=True) as session:
+        return session.execute(queries.GAME_SETTLE_QUERY, params) == 1
+
+def play_legacy(database, telegram_id, action, stake, result):
+    user = database.fetch_one("SELECT coins FROM users WHERE telegram_id = %s", (telegram_id,))
+    if user["coins"] < stake:
+        return False
+    database.execute(LEGACY_SETTLE_QUERY, (result["coins"] - stake, stake, telegram_id))
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Check game settlement for double-spends under concurrency")
+    parser.add_argument("--telegram-id", type=int, default=999999001, help="Throwaway user (deleted and recreated)")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--plays", type=int, default=500)
+    parser.add_argument("--balance", type=int, default=1000)
+    parser.add_argument("--stake", type=int, default=100)
+    parser.add_argument("--action", choices=games.GAMES, default="flip")
+    parser.add_argument("--mode", choices=("guarded", "legacy"), default="guarded")
+    args = parser.parse_args()
+
+    database = create_database("keze_settle_check", args.threads)
+    if not database:
+        sys.exit(1)
+    reset_user(database, args.telegram_id, args.balance)
+
+    play = play_guarded if args.mode == "guarded" else play_legacy
+    lock = threading.Lock()
+    accepted = []
+
+    def one_play(_):
+        result = games.play(args.action, args.stake, random.choice(("heads", "tails")))
+        if play(database, args.telegram_id, args.action, args.stake, result):
+            with lock:
+                accepted.append(result)
+
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(one_play, range(args.plays)))
+
+    user = database.fetch_one("SELECT * FROM users WHERE telegram_id = %s", (args.telegram_id,))
+    expected_coins = args.balance + sum(result["coins"] - args.stake for result in accepted)
+    expected_wins = sum(1 for result in accepted if result["won"])
+    won_column = games.GAME_STAT_COLUMNS[args.action]
+
+    problems = []
+    if user["coins"] < 0:
+        problems.append(f"balance went negative: {user['coins']}")
+    if user["coins"] != expected_coins:
+        problems.append(f"coins {user['coins']} != {expected_coins} expected from {len(accepted)} accepted plays")
+    if user["total_staked"] != len(accepted) * args.stake:
+        problems.append(f"total_staked {user['total_staked']} != {len(accepted) * args.stake}")
+    if args.mode == "guarded" and user[won_column] != expected_wins:
+        problems.append(f"{won_column} {user[won_column]} != {expected_wins}")
+
+    # With only losses, more accepted plays than the balance covers means coins were spent twice
+    if all(result["coins"] == 0 for result in accepted) and len(accepted) > args.balance // args.stake:
+        problems.append(f"{len(accepted)} losing plays accepted, balance covered {args.balance // args.stake}")
+
+    database.execute("DELETE FROM users WHERE telegram_id = %s", (args.telegram_id,))
+
+    print(f"mode={args.mode} threads={args.threads} plays={args.plays} accepted={len(accepted)} "
+          f"final_coins={user['coins']} (db {Config.DB_NAME})")
+    if problems:
+        for problem in problems:
+            print(f"❌ {problem}")
+        sys.exit(1)
+    print("✅ No double-spend or lost update")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Client tap journals for Keze Tap Game's /api/tap/batch
+
+A journal is a run-length, delta-encoded list of tap bursts:
+
+    [[taps, gap_ms], [taps, gap_ms, repeat], ...]
+
+gap_ms is the time since the previous burst (ignored for the very first
+one) and repeat, when given, expands an entry into that many identical
+bursts. Times are anchored to the server clock: the last burst happened
+age_ms before the request arrived, and every earlier one is placed by walking
+the gaps backwards, so the client's clock is never trusted. The client still
+chooses age_ms and the gaps, so a journal may reach at most
+TAP_BATCH_MAX_SPAN seconds back from its receipt.
+
+replay() applies the bursts to a user's tap state (a UserState or the tap
+buffer's per-user state) with the same rules as a single /api/tap: energy is
+derived from the energy model at each burst, and bursts closer than
+MIN_TAP_INTERVAL or larger than MAX_TAPS_PER_REQUEST reject the whole
+journal. Bursts placed before the user's last recorded action are dropped;
+after a journal that is the time it was received, not its last burst, so a
+journal cannot be replayed or backdated into time already accounted for and
+claim the energy that regenerated meanwhile a second time.
+"""
+
+import math
+from datetime import timedelta
+import energy
+
+class JournalError(ValueError):
+    """Journal is malformed or breaks an anti-cheat rule"""
+
+    def __init__(self, message, status=400, suspicious=False):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.suspicious = suspicious
+
+def parse(journal, age_ms, now, max_bursts, max_taps, min_interval, max_span):
+    """Expand a journal received at `now` into [(taps, at)] in time order, validating its shape and spacing"""
+    if not isinstance(journal, list) or not journal:
+        raise JournalError("Invalid tap journal")
+    if not isinstance(age_ms, int) or age_ms < 0:
+        raise JournalError("Invalid tap journal")
+
+    bursts = []  # (taps, gap_ms)
+    for entry in journal:
+        if not isinstance(entry, list) or len(entry) not in (2, 3):
+            raise JournalError("Invalid tap journal")
+        taps, gap_ms = entry[0], entry[1]
+        repeat = entry[2] if len(entry) == 3 else 1
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in (taps, gap_ms, repeat)):
+            raise JournalError("Invalid tap journal")
+        if repeat < 1 or len(bursts) + repeat > max_bursts:
+            raise JournalError(f"Journal exceeds {max_bursts} bursts")
+        if taps < 1 or taps > max_taps:
+            raise JournalError("Invalid tap data", suspicious=True)
+        bursts.extend([(taps, gap_ms)] * repeat)
+
+    min_gap_ms = min_interval * 1000
+    for taps, gap_ms in bursts[1:]:
+        if gap_ms < min_gap_ms:
+            raise JournalError("Tapping too fast", 429, suspicious=True)
+    if age_ms + sum(gap_ms for _, gap_ms in bursts[1:]) > max_span * 1000:
+        raise JournalError("Tap journal is too old", suspicious=True)
+
+    # Walk back from the last burst to place each one on the server clock
+    at = now - timedelta(milliseconds=age_ms)
+    timed = []
+    for index in range(len(bursts) - 1, -1, -1):
+        taps, gap_ms = bursts[index]
+        timed.append((taps, at))
+        at -= timedelta(milliseconds=gap_ms)
+    timed.reverse()
+    return timed
+
+def replay(state, bursts, min_interval, received):
+    """Apply timed bursts to tap state in place; returns (accepted_taps, coins_earned, level_up)
+
+    Bursts that find too little energy are dropped, as a single /api/tap
+    would reject them; everything before and after still counts. Bursts less
+    than min_interval after the last recorded action are dropped too, and
+    the last action moves to `received`, the journal's receipt time.
+    """
+    last_action = state.last_action_time
+    earliest = last_action + timedelta(seconds=min_interval) if last_action is not None else None
+
+    accepted = 0
+    coins_earned = 0
+    level_up = False
+    early = 0
+    for taps, at in bursts:
+        if earliest is not None and at < earliest:
+            early += 1
+            continue
+
+        available = energy.current_energy(state.energy, state.last_energy_update, state.level, at)
+        if available < taps:
+            continue
+
+        earned = taps * (math.floor(state.level / 3) + 1)
+        state.coins += earned
+        state.total_earnings += earned
+        state.taps_count += taps
+        state.experience += taps
+        state.energy = available - taps
+        state.last_energy_update = at
+        accepted += taps
+        coins_earned += earned
+
+        if state.experience >= state.level * 1000:
+            state.level += 1
+            state.experience = 0
+            state.energy = energy.max_energy(state.level)
+            level_up = True
+
+    if early == len(bursts):
+        raise JournalError("Tapping too fast", 429, suspicious=True)
+    if not accepted:
+        raise JournalError("Insufficient energy")
+    state.last_action_time = received
+    return accepted, coins_earned, level_up
@@ -7,12 +7,15 @@ Can be run separately from the Flask API server
 import os
 import asyncio
 import logging
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, ContextTypes
-import mysql.connector
-from mysql.connector import Error
 from dotenv import load_dotenv
+from config import Config
+from db import create_database
+from user_state import UserState
+from signup_batch import SignupBatcher, SignupRace, provision
+import queries
 
 # Load environment variables
 load_dotenv()
@@ -24,210 +27,220 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# MySQL connection configuration
-db_config = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'database': os.getenv('DB_NAME', 'keze_tap_game'),
-    'user': os.getenv('DB_USER', 'root'),
-    'password': os.getenv('DB_PASSWORD', ''),
-    'port': int(os.getenv('DB_PORT', 3306)),
-    'autocommit': True,
-    'charset': 'utf8mb4'
-}
+DB_POOL_SIZE = Config.BOT_DB_POOL_SIZE
 
 # Database connection pool
-try:
-    from mysql.connector import pooling
-    connection_pool = pooling.MySQLConnectionPool(
-        pool_name="keze_bot_pool",
-        pool_size=5,
-        pool_reset_session=True,
-        **db_config
-    )
-    logger.info("✅ Connected to MySQL successfully")
-except Error as e:
-    logger.error(f"❌ MySQL connection failed: {e}")
-    connection_pool = None
-
-def get_db_connection():
-    """Get database connection from pool"""
-    if not connection_pool:
-        return None
-    try:
-        return connection_pool.get_connection()
-    except Error as e:
-        logger.error(f"Error getting connection: {e}")
-        return None
+database = create_database("keze_bot_pool", DB_POOL_SIZE)
 
-def execute_query(query, params=None, fetch=False):
-    """Execute SQL query with error handling"""
-    if not connection_pool:
-        return None
-
-    connection = None
+# User cache: only a shared backend is useful here, since a per-process cache
+# in the bot would never see the API server's invalidations
+user_cache = None
+if Config.USER_CACHE_BACKEND == 'redis':
     try:
-        connection = get_db_connection()
-        if not connection:
-            return None
+        from user_cache import create_user_cache
+        user_cache = create_user_cache(
+            'redis', url=Config.USER_CACHE_URL, ttl=Config.USER_CACHE_TTL, projections=queries.USER_QUERIES
+        )
+        logger.info("✅ Shared user cache enabled")
+    except Exception as e:
+        logger.error(f"❌ User cache initialization failed: {e}")
 
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute(query, params or ())
+# Blocking MySQL work runs on this executor so a slow query never stalls the
+# bot's event loop; one thread per pooled connection bounds DB concurrency
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="bot-db")
 
-        if fetch:
-            result = cursor.fetchall()
-        else:
-            result = cursor.rowcount
+async def run_db(func, *args):
+    """Run a blocking database function off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
 
-        connection.commit()
-        cursor.close()
-        return result
+def execute_query(query, params=None, fetch=False, prepared=False):
+    """Execute SQL query with error handling; prepared=True for hot statements"""
+    if not database:
+        return None
+    return database.execute_query(query, params, fetch, prepared)
 
-    except Error as e:
-        logger.error(f"Database error: {e}")
-        if connection:
-            connection.rollback()
+def load_user_row(telegram_id, projection='full'):
+    """Load one projection of a user row straight from the database"""
+    if not database:
         return None
-    finally:
-        if connection and connection.is_connected():
-            connection.close()
-
-def get_user_by_telegram_id(telegram_id):
-    """Get user from database by Telegram ID"""
-    query = "SELECT * FROM users WHERE telegram_id = %s"
-    result = execute_query(query, (telegram_id,), fetch=True)
+    result = database.execute_query(
+        queries.USER_QUERIES[projection], (telegram_id,), fetch=True, prepared=True, row_type=UserState
+    )
     return result[0] if result else None
 
+def get_user_by_telegram_id(telegram_id, projection='bot'):
+    """Get user by Telegram ID (only the projection's columns), through the shared user cache when enabled"""
+    if user_cache:
+        return user_cache.get(telegram_id, load_user_row, projection)
+    return load_user_row(telegram_id, projection)
+
+def invalidate_user(*telegram_ids):
+    """Drop cached user rows after a write"""
+    if user_cache:
+        user_cache.invalidate(*telegram_ids)
+
 def create_user(telegram_id, username=None, first_name=None, last_name=None, referred_by=None):
-    """Create new user in database"""
-    user_data = {
-        'telegram_id': telegram_id,
-        'username': username,
-        'first_name': first_name,
-        'last_name': last_name,
-        'coins': 500 if referred_by else 0,
-        'ton_coins': 0,
-        'level': 1,
-        'experience': 0,
-        'taps_count': 0,
-        'energy': 1000,
-        'last_energy_update': datetime.now(),
-        'referral_code': str(telegram_id),
-        'referred_by': referred_by,
-        'daily_streak': 0,
-        'last_login_date': datetime.now(),
-        'total_earnings': 500 if referred_by else 0,
-        'spins_won': 0,
-        'treasures_found': 0,
-        'coins_flipped': 0,
-        'total_staked': 0,
-        'banned': False,
-        'last_action_time': datetime.now(),
-        'created_at': datetime.now(),
-        'updated_at': datetime.now()
-    }
-
-    query = """
-    INSERT INTO users (
-        telegram_id, username, first_name, last_name, coins, ton_coins, level,
-        experience, taps_count, energy, last_energy_update, referral_code,
-        referred_by, daily_streak, last_login_date, total_earnings,
-        spins_won, treasures_found, coins_flipped, total_staked, banned,
-        last_action_time, created_at, updated_at
-    ) VALUES (
-        %(telegram_id)s, %(username)s, %(first_name)s, %(last_name)s, %(coins)s,
-        %(ton_coins)s, %(level)s, %(experience)s, %(taps_count)s, %(energy)s,
-        %(last_energy_update)s, %(referral_code)s, %(referred_by)s, %(daily_streak)s,
-        %(last_login_date)s, %(total_earnings)s, %(spins_won)s, %(treasures_found)s,
-        %(coins_flipped)s, %(total_staked)s, %(banned)s, %(last_action_time)s,
-        %(created_at)s, %(updated_at)s
-    )
+    """Create a user and credit its referrer exactly once; returns (user, rewarded_referrer_id)
+
+    If the API created the user meanwhile, that row is returned and no bonus is paid.
     """
+    if not database:
+        return None, None
+    user_data = queries.new_user_row(telegram_id, username, first_name, last_name, referred_by)
+    rewarded_referrer = None
 
     try:
-        result = execute_query(query, user_data)
-        if result:
-            return get_user_by_telegram_id(telegram_id)
+        with database.transaction() as cursor:
+            cursor.execute(queries.CREATE_USER_QUERY, user_data)
+            created = cursor.rowcount == 1
+            if created and referred_by:
+                cursor.execute(queries.RECORD_REFERRAL_QUERY, (telegram_id, referred_by, user_data['created_at']))
+                if cursor.rowcount == 1:
+                    cursor.execute(queries.REFERRAL_BONUS_QUERY, (user_data['created_at'], referred_by))
+                    rewarded_referrer = referred_by
+            user_id = cursor.lastrowid
     except Exception as e:
         logger.error(f"Error creating user: {e}")
-    return None
-
-def get_referrals_count(telegram_id):
-    """Get count of users referred by this user"""
-    query = "SELECT COUNT(*) as count FROM users WHERE referred_by = %s"
-    result = execute_query(query, (telegram_id,), fetch=True)
-    return result[0]['count'] if result else 0
-
-def add_referral_bonus(referrer_id, new_user_id):
-    """Add referral relationship and give bonus"""
-    query = """
-    UPDATE users SET coins = coins + 1000, total_earnings = total_earnings + 1000, updated_at = %s
-    WHERE telegram_id = %s
-    """
-    execute_query(query, (datetime.now(), referrer_id))
+        return None, None
+
+    invalidate_user(telegram_id, rewarded_referrer)
+    if not created:
+        return get_user_by_telegram_id(telegram_id), None
+
+    logger.info(f"Created new user {telegram_id}")
+    if rewarded_referrer:
+        logger.info(f"Referral bonus given to user {rewarded_referrer}")
+    if stats_rollup:
+        stats_rollup.record(new_users=1, coins_earned=queries.signup_coins(referred_by, rewarded_referrer))
+    return UserState.from_mapping(queries.created_user_row(user_data, user_id)), rewarded_referrer
+
+# Leaderboard snapshot, re-synced in the background from the same index the API uses
+leaderboard = None
+if Config.LEADERBOARD_ENABLED and database:
+    from leaderboard import create_leaderboard
+    leaderboard = create_leaderboard(
+        Config.LEADERBOARD_BACKEND,
+        fetch=lambda query, params: execute_query(query, params, fetch=True),
+        url=Config.LEADERBOARD_URL,
+        resync_interval=Config.LEADERBOARD_RESYNC_INTERVAL,
+        size=Config.LEADERBOARD_SIZE
+    )
+
+# Admin stats rollups (signups made through the bot)
+stats_rollup = None
+if Config.STATS_ROLLUP_ENABLED and database:
+    from stats_rollup import StatsRollup
+    stats_rollup = StatsRollup(
+        execute=execute_query,
+        transaction=database.transaction,
+        flush_interval=Config.STATS_FLUSH_INTERVAL,
+        reconcile_interval=Config.STATS_RECONCILE_INTERVAL
+    )
+
+def register_user(user, referral_code=None):
+    """Create or refresh a user for /start; returns (current_user, rewarded_referrer_id)"""
+    existing_user = get_user_by_telegram_id(user.id)
+
+    if not existing_user:
+        # Handle referral; the bonus is credited with the insert, once
+        referred_by = None
+
+        if referral_code and referral_code != str(user.id):
+            try:
+                referrer_id = int(referral_code)
+                if get_user_by_telegram_id(referrer_id, 'exists'):
+                    referred_by = referrer_id
+            except (ValueError, TypeError):
+                logger.warning(f"Invalid referral code: {referral_code}")
+
+        return create_user(user.id, user.username, user.first_name, user.last_name, referred_by)
+
+    # Update user info if changed
+    updates = {}
+    if existing_user.get("username") != user.username:
+        updates["username"] = user.username
+    if existing_user.get("first_name") != user.first_name:
+        updates["first_name"] = user.first_name
+    if existing_user.get("last_name") != user.last_name:
+        updates["last_name"] = user.last_name
+
+    if updates:
+        # Build update query dynamically
+        set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
+        query = f"UPDATE users SET {set_clause} WHERE telegram_id = %s"
+        values = list(updates.values()) + [user.id]
+        execute_query(query, values)
+        invalidate_user(user.id)
+        existing_user.update(updates)
+
+    return existing_user, None
+
+def register_users(requests):
+    """Provision a batch of /start registrations in one transaction; returns (current_user, rewarded_referrer) each"""
+    try:
+        with database.transaction() as cursor:
+            results = provision(cursor, requests)
+    except SignupRace as e:
+        # Someone else created one of these users meanwhile; the per-user path sorts it out
+        logger.info(f"Signup batch raced ({e}), registering {len(requests)} users one by one")
+        return [register_user(user, referral_code) for user, referral_code in requests]
+
+    created = [(user, referrer) for user, referrer, change in results if change == "created"]
+    invalidate_user(
+        *{user['telegram_id'] for user, _, change in results if change},
+        *{referrer for _, referrer in created if referrer}
+    )
+    if created:
+        logger.info(f"Created {len(created)} new users in one batch")
+        if stats_rollup:
+            # In a batch every referred signup also rewards its referrer
+            coins = sum(queries.signup_coins(referrer, referrer) for _, referrer in created)
+            stats_rollup.record(new_users=len(created), coins_earned=coins)
+    return [(user, referrer) for user, referrer, _ in results]
+
+# Coalesces /start storms into provisioning batches (see signup_batch.py)
+signup_batcher = None
+if database:
+    signup_batcher = SignupBatcher(
+        run=run_db,
+        register_batch=register_users,
+        window=Config.BOT_SIGNUP_WINDOW,
+        max_batch=Config.BOT_SIGNUP_BATCH
+    )
+
+def load_top_users(limit=10):
+    """Top players for /leaderboard, from the in-memory snapshot when it is loaded"""
+    if leaderboard and leaderboard.synced:
+        return leaderboard.top(limit)
+    return [{
+        "name": user.get('first_name') or user.get('username') or 'Anonymous',
+        "totalEarnings": user.get('total_earnings', 0),
+        "level": user.get('level', 1)
+    } for user in execute_query(queries.LEADERBOARD_QUERY, (limit, 0), fetch=True) or []]
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     try:
-        chat_id = update.effective_chat.id
         user = update.effective_user
         args = context.args
         referral_code = args[0] if args else None
 
         logger.info(f"Start command from user {user.id} ({user.username})")
 
-        # Check if user exists
-        existing_user = get_user_by_telegram_id(user.id)
-
-        if not existing_user:
-            # Handle referral
-            referred_by = None
-            referrer_bonus = False
-
-            if referral_code and referral_code != str(user.id):
-                try:
-                    referrer_id = int(referral_code)
-                    referrer = get_user_by_telegram_id(referrer_id)
-                    if referrer:
-                        referred_by = referrer_id
-                        # Give referrer bonus
-                        add_referral_bonus(referrer_id, user.id)
-                        referrer_bonus = True
-                        logger.info(f"Referral bonus given to user {referrer_id}")
-                except (ValueError, TypeError):
-                    logger.warning(f"Invalid referral code: {referral_code}")
-
-            # Create new user
-            new_user = create_user(user.id, user.username, user.first_name, user.last_name, referred_by)
-            if new_user:
-                logger.info(f"Created new user {user.id}")
-                if referrer_bonus:
-                    await context.bot.send_message(
-                        chat_id=referred_by,
-                        text="🎉 You earned 1,000 KEZE coins for inviting a friend!"
-                    )
+        if signup_batcher:
+            current_user, rewarded_referrer = await signup_batcher.register(user, referral_code)
         else:
-            # Update user info if changed
-            updates = {}
-            if existing_user.get("username") != user.username:
-                updates["username"] = user.username
-            if existing_user.get("first_name") != user.first_name:
-                updates["first_name"] = user.first_name
-            if existing_user.get("last_name") != user.last_name:
-                updates["last_name"] = user.last_name
-
-            if updates:
-                # Build update query dynamically
-                set_clause = ", ".join([f"{key} = %s" for key in updates.keys()])
-                query = f"UPDATE users SET {set_clause} WHERE telegram_id = %s"
-                values = list(updates.values()) + [user.id]
-                execute_query(query, values)
-
-        # Get current user data
-        current_user = get_user_by_telegram_id(user.id)
+            current_user, rewarded_referrer = await run_db(register_user, user, referral_code)
         if not current_user:
             await update.message.reply_text("❌ Sorry, there was an error. Please try again later.")
             return
 
+        if rewarded_referrer:
+            await context.bot.send_message(
+                chat_id=rewarded_referrer,
+                text="🎉 You earned 1,000 KEZE coins for inviting a friend!"
+            )
+
         # Create WebApp button
         game_url = os.getenv('GAME_URL', 'https://keze.bissols.com')
         web_app = WebAppInfo(url=game_url)
@@ -264,13 +277,13 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /stats command"""
     try:
         user_id = update.effective_user.id
-        user = get_user_by_telegram_id(user_id)
+        user = await run_db(get_user_by_telegram_id, user_id)
 
         if not user:
             await update.message.reply_text("Please start the game first with /start")
             return
 
-        referrals_count = get_referrals_count(user_id)
+        referrals_count = user.get('referral_count', 0)
 
         message = (
             f"📊 Your Keze Tap Game Stats:\n\n"
@@ -297,34 +310,27 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /leaderboard command"""
     try:
-        if not connection_pool:
+        if not database:
             await update.message.reply_text("❌ Database not available.")
             return
 
-        query = """
-        SELECT first_name, last_name, username, total_earnings, level
-        FROM users
-        WHERE banned = FALSE
-        ORDER BY total_earnings DESC
-        LIMIT 10
-        """
-        top_users = execute_query(query, fetch=True)
+        top_users = await run_db(load_top_users, 10)
 
         if not top_users:
             await update.message.reply_text("📊 Leaderboard is empty. Be the first to play!")
             return
 
-        leaderboard = "🏆 TOP KEZE EARNERS\n\n"
+        message = "🏆 TOP KEZE EARNERS\n\n"
 
         for i, user in enumerate(top_users):
-            name = user.get('first_name') or user.get('username') or 'Anonymous'
-            earnings = user.get('total_earnings', 0)
-            level = user.get('level', 1)
+            name = user['name']
+            earnings = user['totalEarnings']
+            level = user['level']
 
             medal = ['🥇', '🥈', '🥉'][i] if i < 3 else f"{i + 1}."
-            leaderboard += f"{medal} {name} - {earnings:,} KEZE (Lv.{level})\n"
+            message += f"{medal} {name} - {earnings:,} KEZE (Lv.{level})\n"
 
-        await update.message.reply_text(leaderboard)
+        await update.message.reply_text(message)
 
     except Exception as e:
         logger.error(f"Leaderboard error: {e}")
@@ -368,8 +374,13 @@ def main():
         logger.error("❌ TELEGRAM_BOT_TOKEN not found in environment variables")
         return
 
-    # Create application
-    application = Application.builder().token(bot_token).build()
+    # Create application; updates from different users are handled concurrently
+    application = (
+        Application.builder()
+        .token(bot_token)
+        .concurrent_updates(Config.BOT_CONCURRENT_UPDATES)
+        .build()
+    )
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -380,10 +391,19 @@ def main():
     # Add error handler
     application.add_error_handler(error_handler)
 
+    if stats_rollup:
+        stats_rollup.start()
+
+    if leaderboard:
+        try:
+            leaderboard.start()
+        except Exception as e:
+            logger.error(f"❌ Leaderboard failed to load: {e}")
+
     # Start bot
     logger.info("🤖 Starting Keze Tap Game Telegram Bot (MySQL Version)...")
     logger.info(f"🎮 Game URL: {os.getenv('GAME_URL', 'Not configured')}")
-    logger.info(f"💾 Database: {'connected' if connection_pool else 'not connected'}")
+    logger.info(f"💾 Database: {'connected' if database else 'not connected'}")
 
     # Run the bot
     application.run_polling(drop_pending_updates=True)
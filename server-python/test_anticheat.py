@@ -0,0 +1,50 @@
+"""
+Anti-cheat analyzer checks against synthetic game_actions rows
+(run with `python -m pytest test_anticheat.py`)
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from anticheat import AntiCheatAnalyzer
+from rate_limit import ACTION_LIMIT, ACTION_PERIOD, ACTION_ROUTES
+
+START = datetime(2026, 1, 1)
+
+def rows_at_limit(periods):
+    """One player spending every route's quota at the edges of fixed rate-limit windows
+
+    Even periods are spent in their last second and odd ones in their first,
+    so each pair of quotas lands within two seconds: the densest traffic the
+    limits let through.
+    """
+    rng = random.Random(7)
+    rows = []
+    for period in range(periods):
+        edge = (period + 1) * ACTION_PERIOD - 1 if period % 2 == 0 else period * ACTION_PERIOD
+        for route in range(ACTION_ROUTES):
+            for _ in range(ACTION_LIMIT):
+                at = START + timedelta(seconds=edge + rng.random())
+                action = 'spin' if route == ACTION_ROUTES - 1 else 'tap'
+                rows.append({'user_id': 1, 'action': action, 'amount': 100, 'payout': 0, 'timestamp': at})
+    rows.sort(key=lambda row: row['timestamp'])
+    for row_id, row in enumerate(rows, 1):
+        row['id'] = row_id
+    return rows
+
+def test_player_at_rate_limit_ceiling_is_not_flagged():
+    analyzer = AntiCheatAnalyzer(window=ACTION_PERIOD)
+    flags, bans = analyzer.observe(rows_at_limit(6))
+    assert 'rate' not in flags.values()
+    assert not bans
+
+def test_one_action_over_the_ceiling_is_flagged():
+    analyzer = AntiCheatAnalyzer(window=ACTION_PERIOD)
+    rows = rows_at_limit(2)
+    extra = dict(rows[-1], id=len(rows) + 1)
+    flags, _ = analyzer.observe(rows + [extra])
+    assert flags == {extra['id']: 'rate'}
+
+def test_threshold_follows_the_window():
+    assert AntiCheatAnalyzer(window=ACTION_PERIOD * 4).threshold > AntiCheatAnalyzer(window=ACTION_PERIOD).threshold
+    assert AntiCheatAnalyzer(threshold=50).threshold == 50
@@ -0,0 +1,73 @@
+"""
+Payout table and outcome stream checks (run with `python -m pytest test_games.py`)
+"""
+
+import pytest
+
+import games
+from config import Config
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(Config, 'GAME_RNG_SECRET', "test-secret")
+    return "test-secret"
+
+@pytest.mark.parametrize("action", games.GAMES)
+def test_tables_cover_every_draw(action):
+    table = games.PAYOUT_TABLES[action]
+    assert sum(outcome.probability for outcome in table) == pytest.approx(1.0)
+    assert games.THRESHOLDS[action][-1] == 1.0
+    assert games.outcome_index(action, 0.0) == 0
+    assert games.outcome_index(action, 0.999999) == len(table) - 1
+
+def test_win_odds_match_the_tables():
+    def won(action):
+        return sum(outcome.probability for outcome in games.PAYOUT_TABLES[action] if outcome.won)
+    assert won('spin') == pytest.approx(0.5)
+    # 40% find treasure: 10% of finds pay x10, 30% of the rest x5
+    assert won('treasure') == pytest.approx(0.4)
+    assert games.PAYOUT_TABLES['treasure'][0].probability == pytest.approx(0.4 * 0.1)
+    assert games.PAYOUT_TABLES['treasure'][1].probability == pytest.approx(0.4 * 0.9 * 0.3)
+    # A flip call matches half the time and pays double
+    assert all(outcome.multiplier == 2 for outcome in games.PAYOUT_TABLES['flip'])
+
+@pytest.mark.parametrize("action", ('spin', 'treasure'))
+def test_draws_follow_the_table(action):
+    plays = 20000
+    counts = [0] * len(games.PAYOUT_TABLES[action])
+    for offset in range(plays):
+        counts[games.outcome_index(action, games.draw(action, "feedface", offset))] += 1
+    for count, outcome in zip(counts, games.PAYOUT_TABLES[action]):
+        # Five standard deviations of a binomial count
+        spread = 5 * (plays * outcome.probability * (1 - outcome.probability)) ** 0.5
+        assert abs(count - plays * outcome.probability) < spread
+
+@pytest.mark.parametrize("action", games.GAMES)
+def test_stream_plays_replay_exactly(action):
+    stream = games.OutcomeStream(action, batch_size=4)
+    for _ in range(10):
+        index, reference = stream.next()
+        played = games.result_for(action, 1000, "heads", index, reference)
+        assert games.replay(action, reference, 1000, "heads") == played
+        assert "rng" not in games.public_result(played)
+
+def test_replay_needs_the_same_secret():
+    draws = [games.draw('spin', "feedface", offset) for offset in range(20)]
+    assert [games.draw('spin', "feedface", offset, "test-secret") for offset in range(20)] == draws
+    assert [games.draw('spin', "feedface", offset, "other-secret") for offset in range(20)] != draws
+
+def test_no_draws_with_the_default_secret(monkeypatch):
+    monkeypatch.setattr(Config, 'GAME_RNG_SECRET', Config.DEFAULT_SECRET_KEY)
+    with pytest.raises(RuntimeError):
+        games.draw('spin', "feedface", 0)
+
+def test_results_and_settlement():
+    spin = games.result_for('spin', 2000, None, 0, "feedface:0")
+    assert spin == {"coins": 20000, "won": True, "outcome": 0, "rng": "feedface:0", "tonCoins": 2}
+
+    flip = games.result_for('flip', 500, "tails", 0, "feedface:1")
+    assert (flip["won"], flip["coins"], flip["flip"]) == (False, 0, "heads")
+
+    params = games.settlement(7, 'spin', 2000, spin, None)
+    assert (params["payout"], params["earnings"], params["ton_coins"]) == (20000, 18000, 2)
+    assert params["spins_won"] == 1 and params["treasures_found"] == 0 and params["coins_flipped"] == 0
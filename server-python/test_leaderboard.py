@@ -0,0 +1,91 @@
+"""
+In-process leaderboard checks (run with `python -m pytest test_leaderboard.py`)
+"""
+
+import random
+
+import pytest
+
+from leaderboard import PLAYERS_QUERY, PROFILE_QUERY, RESYNC_QUERY, Leaderboard, SortedKeys
+
+def test_sorted_keys_match_a_sorted_list():
+    rng = random.Random(3)
+    keys = SortedKeys(rng.sample(range(10000), 300), load=8)
+    expected = sorted(keys.slice(0, len(keys)))
+    for _ in range(2000):
+        key = rng.randrange(10000)
+        if key in expected:
+            keys.remove(key)
+            expected.remove(key)
+        else:
+            keys.add(key)
+            expected.append(key)
+            expected.sort()
+    assert len(keys) == len(expected)
+    assert keys.slice(0, len(keys)) == expected
+    assert keys.slice(17, 60) == expected[17:60]
+    assert all(keys.index(key) == position for position, key in enumerate(expected))
+    assert keys.pop() == expected[-1]
+
+def test_sorted_keys_missing_key():
+    keys = SortedKeys([1, 3])
+    with pytest.raises(KeyError):
+        keys.index(2)
+    with pytest.raises(KeyError):
+        keys.remove(2)
+    with pytest.raises(KeyError):
+        SortedKeys().index(1)
+
+class FakeUsers:
+    """The three leaderboard queries over a dict of telegram_id -> (name, total_earnings, level)"""
+
+    def __init__(self, users):
+        self.users = users
+
+    def fetch(self, query, params):
+        if query == RESYNC_QUERY:
+            ranked = sorted(self.users.items(), key=lambda item: -item[1][1])[:params[0]]
+            return [self._row(telegram_id, user) for telegram_id, user in ranked]
+        if query == PLAYERS_QUERY:
+            return [{'players': len(self.users)}]
+        if query == PROFILE_QUERY.format(", ".join(["%s"] * len(params))):
+            return [self._row(telegram_id, self.users[telegram_id]) for telegram_id in params]
+        raise AssertionError(query)
+
+    @staticmethod
+    def _row(telegram_id, user):
+        name, total_earnings, level = user
+        return {'telegram_id': telegram_id, 'first_name': name, 'username': None,
+                'total_earnings': total_earnings, 'level': level}
+
+@pytest.fixture
+def users():
+    return FakeUsers({telegram_id: (f"player{telegram_id}", telegram_id * 100, 1) for telegram_id in range(1, 8)})
+
+def test_resync_ranks_and_pages(users):
+    board = Leaderboard(users.fetch, size=5)
+    board.resync()
+    assert board.size() == 5
+    assert [entry['name'] for entry in board.top(3)] == ["player7", "player6", "player5"]
+    assert board.page(2, 2) == [
+        {"rank": 3, "name": "player5", "totalEarnings": 500, "level": 1},
+        {"rank": 4, "name": "player4", "totalEarnings": 400, "level": 1}
+    ]
+    assert board.rank(6) == {"rank": 2, "totalEarnings": 600, "totalPlayers": 7}
+    # Below the window: callers fall back to MySQL
+    assert board.rank(1) is None
+
+def test_updates_reorder_and_trim(users):
+    board = Leaderboard(users.fetch, size=5)
+    board.resync()
+    board.update(1, 650, 1)
+    assert board.rank(1)["rank"] == 2
+    assert board.size() == 5
+    # player3 fell out of the window to make room
+    assert board.rank(3) is None
+    # A user first seen since the resync gets a profile on the page that shows them
+    assert board.page(1, 2)[1] == {"rank": 2, "name": "player1", "totalEarnings": 650, "level": 1}
+
+    board.remove(7)
+    assert board.rank(1)["rank"] == 1
+    assert board.size() == 4
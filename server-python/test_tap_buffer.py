@@ -0,0 +1,200 @@
+"""
+Write-behind tap buffer checks against an in-memory stand-in for the users table
+(run with `python -m pytest test_tap_buffer.py`)
+"""
+
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+
+import tap_buffer
+import tap_journal
+
+class FakeUsers:
+    """Just enough of MySQL for the statements tap_buffer.py runs"""
+
+    def __init__(self, **users):
+        self.users = users
+        self.marked = set()
+        self.fail = False
+
+    @contextmanager
+    def transaction(self, prepared=False):
+        if self.fail:
+            raise RuntimeError("database down")
+        users = {telegram_id: dict(row) for telegram_id, row in self.users.items()}
+        marked = set(self.marked)
+        cursor = FakeCursor(users, marked)
+        yield cursor
+        self.users, self.marked = users, marked
+
+    def load_user(self, telegram_id):
+        row = self.users.get(telegram_id)
+        return dict(row) if row else None
+
+class FakeCursor:
+    def __init__(self, users, marked):
+        self.users = users
+        self.marked = marked
+        self.result = []
+
+    def execute(self, query, params=()):
+        if query == tap_buffer.FLUSH_QUERY:
+            self._upsert(params)
+        elif query == tap_buffer.MARK_SEGMENT_QUERY:
+            self.marked.add(params[0])
+        elif query.startswith("SELECT segment"):
+            self.result = [{'segment': name} for name in params if name in self.marked]
+        elif query.startswith("SELECT telegram_id FROM users WHERE banned"):
+            self.result = [{'telegram_id': telegram_id} for telegram_id in params
+                           if self.users.get(telegram_id, {}).get('banned')]
+        elif query == tap_buffer.REFRESH_QUERY:
+            row = self.users.get(params[0])
+            self.result = [dict(row)] if row else []
+        else:
+            self.result = []
+
+    def executemany(self, query, rows):
+        for params in rows:
+            self.execute(query, params)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def _upsert(self, params):
+        telegram_id, coins, taps, earnings, experience, level, energy, last_update, last_action, _ = params
+        row = self.users[telegram_id]
+        if row['banned']:
+            return
+        row['coins'] += coins
+        row['taps_count'] += taps
+        row['total_earnings'] += earnings
+        row.update(experience=experience, level=level, energy=energy,
+                   last_energy_update=last_update, last_action_time=last_action)
+
+def user_row(coins=0):
+    now = datetime.now()
+    return {
+        'coins': coins, 'taps_count': 0, 'total_earnings': coins, 'banned': False, 'level': 1,
+        'experience': 0, 'energy': 1000, 'last_energy_update': now, 'last_action_time': now - timedelta(minutes=1)
+    }
+
+@pytest.fixture
+def database():
+    return FakeUsers(**{'1': user_row(), '2': user_row()})
+
+def start_buffer(database, journal_dir):
+    buffer = tap_buffer.TapBuffer(database.load_user, database.transaction, str(journal_dir), flush_interval=3600)
+    # Several buffers share one process (and clock second) here, so keep their segment names apart
+    buffer._segment_prefix += f"-{id(buffer)}"
+    buffer.start()
+    return buffer
+
+def crash(buffer):
+    """Drop a buffer the way a killed worker would: journal files stay, nothing reaches the database"""
+    def unreachable(prepared=False):
+        raise RuntimeError("worker is gone")
+    buffer._transaction = unreachable
+    buffer._stopping.set()
+    buffer._wake.set()
+    buffer._thread.join()
+    for fd in {fd for _, fd in buffer._sealed + [buffer._segment]}:
+        os.close(fd)
+
+def test_flush_credits_each_tap_once(database, tmp_path):
+    buffer = start_buffer(database, tmp_path)
+    buffer.tap('1', 10)
+    buffer.tap('2', 5)
+    assert buffer.flush() == 2
+    assert buffer.flush() == 0
+    assert database.users['1']['coins'] == 10
+    assert database.users['2']['coins'] == 5
+    # Flushed segments are gone; only the fresh, empty one is left
+    assert all(path.stat().st_size == 0 for path in tmp_path.glob("*.journal"))
+    buffer.stop()
+
+def test_recovery_replays_unflushed_taps_once(database, tmp_path):
+    buffer = start_buffer(database, tmp_path)
+    buffer.tap('1', 10)
+    crash(buffer)
+
+    start_buffer(database, tmp_path).stop()
+    assert database.users['1']['coins'] == 10
+    # A second recovery finds nothing left to replay
+    start_buffer(database, tmp_path).stop()
+    assert database.users['1']['coins'] == 10
+
+def test_failed_flush_keeps_taps_buffered(database, tmp_path):
+    buffer = start_buffer(database, tmp_path)
+    buffer.tap('1', 10)
+    database.fail = True
+    assert buffer.flush() == 0
+    database.fail = False
+    buffer.tap('1', 10)
+    assert buffer.flush() == 1
+    assert database.users['1']['coins'] == 20
+    buffer.stop()
+
+def test_single_user_flush_is_not_replayed(database, tmp_path):
+    buffer = start_buffer(database, tmp_path)
+    buffer.tap('1', 10)
+    buffer.tap('2', 5)
+    assert buffer.flush_user('1') == 1
+    assert database.users['1']['coins'] == 10
+    assert database.users['2']['coins'] == 0
+    crash(buffer)
+
+    start_buffer(database, tmp_path).stop()
+    assert database.users['1']['coins'] == 10
+    assert database.users['2']['coins'] == 5
+
+def test_batch_replay_is_not_credited_twice(database, tmp_path):
+    buffer = start_buffer(database, tmp_path)
+    now = datetime.now()
+    bursts = tap_journal.parse([[10, 0], [10, 1000, 5]], 1000, now, max_bursts=300, max_taps=10,
+                               min_interval=0.1, max_span=120)
+    _, accepted, _, error = buffer.tap_batch('1', bursts, now)
+    assert error is None and accepted == 60
+
+    _, _, _, error = buffer.tap_batch('1', bursts, now + timedelta(seconds=1))
+    assert isinstance(error, tap_journal.JournalError)
+    buffer.stop()
+    assert database.users['1']['coins'] == 60
+
+class EvictedAfterLookup(dict):
+    """Users map whose first lookup of one user returns a state already evicted"""
+
+    def __init__(self, users, telegram_id, evicted):
+        super().__init__(users)
+        self.telegram_id = telegram_id
+        self.evicted = evicted
+
+    def get(self, key, default=None):
+        if key == self.telegram_id and self.evicted is not None:
+            evicted, self.evicted = self.evicted, None
+            return evicted
+        return super().get(key, default)
+
+def test_evicted_state_is_reloaded_not_credited(database, tmp_path):
+    buffer = start_buffer(database, tmp_path)
+    buffer.tap('1', 10)
+    buffer.flush()
+    evicted = buffer._users.pop('1')
+    buffer._users = EvictedAfterLookup(buffer._users, '1', evicted)
+
+    buffer.tap('1', 10)
+    assert buffer._users['1'] is not evicted
+    buffer.flush()
+    assert database.users['1']['coins'] == 20
+    buffer.stop()
+
+def test_taps_after_stop_are_refused(database, tmp_path):
+    buffer = start_buffer(database, tmp_path)
+    buffer.stop()
+    _, _, error = buffer.tap('1', 1)
+    assert error[1] == 503
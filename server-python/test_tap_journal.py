@@ -0,0 +1,71 @@
+"""
+Backdating checks for tap_journal (run with `python -m pytest test_tap_journal.py`)
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import energy
+import tap_journal
+from user_state import UserState
+
+MIN_INTERVAL = 0.1
+MAX_SPAN = 120
+
+def parse(journal, age_ms, now):
+    return tap_journal.parse(journal, age_ms, now, max_bursts=300, max_taps=10,
+                             min_interval=MIN_INTERVAL, max_span=MAX_SPAN)
+
+def drained_user(now, idle):
+    """A level 1 user who emptied their energy `idle` ago and has not acted since"""
+    return UserState(
+        coins=0, total_earnings=0, taps_count=0, level=1, experience=0,
+        energy=0, last_energy_update=now - idle, last_action_time=now - idle
+    )
+
+def test_journal_reaching_back_hours_is_rejected():
+    now = datetime.now()
+    # The reported case: 3000 taps spread over 22.4h in one call
+    with pytest.raises(tap_journal.JournalError):
+        parse([[10, 0], [10, 270000, 299]], 0, now)
+
+def test_journal_cannot_reach_past_the_span():
+    now = datetime.now()
+    with pytest.raises(tap_journal.JournalError):
+        parse([[10, 0]], MAX_SPAN * 1000 + 1, now)
+
+def test_backdated_journal_gets_no_extra_energy():
+    now = datetime.now()
+    idle = timedelta(minutes=30)
+    user = drained_user(now, idle)
+    # 1200 taps claimed over the whole window the journal may cover
+    bursts = parse([[10, 0], [10, 1000, 119]], 0, now)
+    accepted, _, _ = tap_journal.replay(user, bursts, MIN_INTERVAL, now)
+
+    # Never more than the energy regenerated since the last action
+    regenerated = energy.current_energy(0, now - idle, 1, now)
+    assert 0 < accepted <= regenerated
+
+def test_bursts_before_the_last_action_are_dropped():
+    now = datetime.now()
+    user = drained_user(now, timedelta(seconds=5))
+    # Placed 30-90s ago, when the energy was already spent
+    bursts = parse([[10, 0], [10, 1000, 60]], 30000, now)
+    with pytest.raises(tap_journal.JournalError) as raised:
+        tap_journal.replay(user, bursts, MIN_INTERVAL, now)
+    assert raised.value.status == 429
+    assert user.coins == 0
+
+def test_replayed_journal_is_not_credited_twice():
+    now = datetime.now()
+    user = drained_user(now, timedelta(minutes=30))
+    bursts = parse([[10, 0], [10, 1000, 50]], 10000, now)
+    first, _, _ = tap_journal.replay(user, bursts, MIN_INTERVAL, now)
+    assert first > 0
+    assert user.last_action_time == now
+
+    # The same journal again a second later lies entirely before the receipt of the first
+    later = now + timedelta(seconds=1)
+    with pytest.raises(tap_journal.JournalError):
+        tap_journal.replay(user, parse([[10, 0], [10, 1000, 50]], 11000, later), MIN_INTERVAL, later)
@@ -0,0 +1,143 @@
+"""
+Read-through user cache for Keze Tap Game
+
+Caches UserState rows returned by get_user_by_telegram_id, one entry per user and
+projection (see queries.USER_PROJECTIONS). Every write path that changes a
+user row must call invalidate() for that user, which drops all projections. The memory backend
+is per process (LRU + TTL); the redis backend is shared by every worker and
+by the Telegram bot, so an invalidation in one process is seen by all.
+Redis entries are stored as JSON, never pickles, so whoever can write to the
+cache server cannot get code run in the app.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import serializer
+from user_state import UserState
+
+# Written as ISO 8601 strings by serializer, parsed back on read
+DATETIME_COLUMNS = ('last_energy_update', 'last_login_date', 'last_action_time', 'created_at', 'updated_at')
+
+class MemoryBackend:
+    """In-process LRU cache with per-entry TTL"""
+
+    shared = False
+
+    def __init__(self, max_entries=10000):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def size(self):
+        return len(self._entries)
+
+class RedisBackend:
+    """Shared cache in Redis; eviction is left to the server's maxmemory-policy"""
+
+    shared = True
+
+    def __init__(self, url, prefix="keze:user:"):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self.evictions = 0
+
+    def get(self, key):
+        data = self._client.get(self._prefix + str(key))
+        if data is None:
+            return None
+        row = serializer.loads(data)
+        for column in DATETIME_COLUMNS:
+            if isinstance(row.get(column), str):
+                row[column] = datetime.fromisoformat(row[column])
+        return UserState.from_mapping(row)
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + str(key), serializer.dumps(value), px=int(ttl * 1000))
+
+    def delete(self, *keys):
+        self._client.delete(*[self._prefix + str(key) for key in keys])
+
+    def size(self):
+        return None
+
+class UserCache:
+    """Read-through cache of user rows keyed by Telegram ID"""
+
+    def __init__(self, backend, ttl=5.0, projections=('full',)):
+        self.backend = backend
+        self.ttl = ttl
+        self.projections = tuple(projections)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, telegram_id, loader, projection='full'):
+        """Return a copy of the cached row, loading it with loader(telegram_id, projection) on a miss"""
+        key = f"{projection}:{telegram_id}"
+        row = self.backend.get(key)
+        if row is not None:
+            self.hits += 1
+            return row.copy()
+
+        self.misses += 1
+        row = loader(telegram_id, projection)
+        if row is not None:
+            self.backend.set(key, row.copy(), self.ttl)
+        return row
+
+    def invalidate(self, *telegram_ids):
+        """Drop cached rows after a write"""
+        for telegram_id in telegram_ids:
+            if telegram_id is not None:
+                self.backend.delete(*[f"{projection}:{telegram_id}" for projection in self.projections])
+                self.invalidations += 1
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "evictions": self.backend.evictions,
+            "size": self.backend.size()
+        }
+
+def create_user_cache(backend, url=None, ttl=5.0, max_entries=10000, projections=('full',)):
+    """Build a UserCache from config values; returns None when caching is off"""
+    if backend == 'memory':
+        return UserCache(MemoryBackend(max_entries), ttl, projections)
+    if backend == 'redis':
+        return UserCache(RedisBackend(url), ttl, projections)
+    return None
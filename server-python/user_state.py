@@ -0,0 +1,186 @@
+"""
+Compact user model for Keze Tap Game
+
+UserState holds one users row (or any projection of it, see
+queries.USER_PROJECTIONS) in __slots__ instead of a dict. It is what the
+database layer decodes user reads into, what the user cache stores and what
+the tap paths and the bot read from. Columns that were not loaded are simply
+unset; get() falls back to the default as it would for a missing dict key.
+
+API responses are built from precomputed (attribute, camelCase key, default)
+tables rather than field-by-field dict literals in each route.
+"""
+
+from functools import lru_cache
+
+COLUMNS = (
+    'id', 'telegram_id', 'username', 'first_name', 'last_name', 'coins', 'ton_coins',
+    'level', 'experience', 'taps_count', 'energy', 'last_energy_update', 'referral_code',
+    'referred_by', 'referral_count', 'daily_streak', 'last_login_date', 'total_earnings',
+    'spins_won', 'treasures_found', 'coins_flipped', 'total_staked', 'banned',
+    'last_action_time', 'created_at', 'updated_at'
+)
+
+# Values derived by the application, never stored
+DERIVED = ('max_energy', 'coins_earned')
+
+PROFILE_FIELDS = (
+    ('coins', 'coins', 0),
+    ('ton_coins', 'tonCoins', 0),
+    ('level', 'level', 1),
+    ('experience', 'experience', 0),
+    ('energy', 'energy', 1000),
+    ('max_energy', 'maxEnergy', 1000),
+    ('taps_count', 'tapsCount', 0),
+    ('total_earnings', 'totalEarnings', 0),
+    ('referral_count', 'referrals', 0)
+)
+
+GAME_STAT_FIELDS = (
+    ('spins_won', 'spinsWon', 0),
+    ('treasures_found', 'treasuresFound', 0),
+    ('coins_flipped', 'coinsFlipped', 0),
+    ('total_staked', 'totalStaked', 0)
+)
+
+TAP_FIELDS = (
+    ('coins', 'coins', 0),
+    ('level', 'level', 1),
+    ('experience', 'experience', 0),
+    ('energy', 'energy', 0),
+    ('taps_count', 'tapsCount', 0)
+)
+
+# The tap response is a few integers and a boolean, so it is rendered by
+# %-formatting into pre-encoded bytes instead of going through an encoder
+TAP_RESPONSE_TEMPLATE = (
+    b'{"success":true,' + b','.join(b'"%s":%%d' % key.encode() for _, key, _ in TAP_FIELDS)
+    + b',"levelUp":%s}'
+)
+
+class UserState:
+    """A user row held in slots, with dict-style access for existing callers"""
+
+    __slots__ = COLUMNS + DERIVED
+    _fields = frozenset(__slots__)
+
+    def __init__(self, **values):
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def from_mapping(cls, row):
+        """Build from a dict row (aiomysql, dict cursors) or another UserState"""
+        if row is None:
+            return None
+        if isinstance(row, cls):
+            return row.copy()
+        state = cls.__new__(cls)
+        for key, value in row.items():
+            if key in cls._fields:
+                setattr(state, key, value)
+        return state
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def decoder(columns):
+        """Function turning one result tuple with these columns into a UserState"""
+        unknown = [column for column in columns if column not in UserState._fields]
+        if unknown:
+            raise ValueError(f"Not users columns: {unknown}")
+
+        def decode(values):
+            state = UserState.__new__(UserState)
+            for column, value in zip(columns, values):
+                setattr(state, column, value)
+            return state
+        return decode
+
+    # Dict-style access
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._fields and hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self._fields else default
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def copy(self):
+        state = UserState.__new__(UserState)
+        for key in self.__slots__:
+            try:
+                setattr(state, key, getattr(self, key))
+            except AttributeError:
+                pass
+        return state
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __getstate__(self):
+        return self.as_dict()
+
+    def __setstate__(self, values):
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return f"UserState(telegram_id={self.get('telegram_id')!r})"
+
+    # API serialization
+
+    def _serialize(self, fields):
+        return {key: getattr(self, attribute, default) for attribute, key, default in fields}
+
+    def game_stats(self):
+        return self._serialize(GAME_STAT_FIELDS)
+
+    def to_profile(self):
+        """GET /api/user response body"""
+        body = self._serialize(PROFILE_FIELDS)
+        body["gameStats"] = self.game_stats()
+        return body
+
+    def to_tap_response(self, level_up):
+        """POST /api/tap response body"""
+        body = self._serialize(TAP_FIELDS)
+        body["success"] = True
+        body["levelUp"] = level_up
+        return body
+
+    def to_tap_response_bytes(self, level_up):
+        """POST /api/tap response body, already encoded"""
+        values = tuple(getattr(self, attribute, default) for attribute, _, default in TAP_FIELDS)
+        return TAP_RESPONSE_TEMPLATE % (values + (b'true' if level_up else b'false',))
+
+    def to_game_response(self, result):
+        """POST /api/game/<action> response body"""
+        return {
+            "success": True,
+            "result": result,
+            "coins": getattr(self, 'coins', 0),
+            "tonCoins": getattr(self, 'ton_coins', 0),
+            "gameStats": self.game_stats()
+        }